@@ -1,11 +1,13 @@
 import numpy as np
 import vtk
+from vtk.util import numpy_support
 import matplotlib.pyplot as plt
 import os
 import glob
 import pandas as pd
 import pickle
 import h5py
+from concurrent.futures import ProcessPoolExecutor
 
 import ipywidgets as widgets
 from ipywidgets import interact, Button, Layout, interactive, fixed
@@ -17,6 +19,245 @@ from IPython.display import display, Markdown, Latex, clear_output
 # http://forrestbao.blogspot.com/2011/12/reading-vtk-files-in-python-via-python.html
 
 
+def get_cell_point_ids(vtkdata):
+	"""
+	Return the ids of the first three points of each cell as a (n_cells, 3) array.
+	The connectivity array of the mesh is read in one go when all the cells are triangles,
+	we only fall back on a loop over the cells for mixed meshes.
+	"""
+	n_cells = vtkdata.GetNumberOfCells()
+
+	if isinstance(vtkdata, vtk.vtkPolyData):
+		cells = vtkdata.GetPolys() if vtkdata.GetNumberOfPolys() == n_cells else None
+	else:
+		cells = vtkdata.GetCells() if hasattr(vtkdata, "GetCells") else None
+
+	if cells is not None:
+		# VTK >= 9 stores offsets and connectivity separately
+		if hasattr(cells, "GetConnectivityArray"):
+			offsets = numpy_support.vtk_to_numpy(cells.GetOffsetsArray())
+			connectivity = numpy_support.vtk_to_numpy(cells.GetConnectivityArray())
+			if connectivity.size == 3 * n_cells and np.all(np.diff(offsets) == 3):
+				return connectivity.reshape(n_cells, 3)
+
+		# Legacy layout, [3, id0, id1, id2, 3, ...]
+		else:
+			connectivity = numpy_support.vtk_to_numpy(cells.GetData())
+			if connectivity.size == 4 * n_cells and np.all(connectivity[::4] == 3):
+				return connectivity.reshape(n_cells, 4)[:, 1:]
+
+	return np.array([[vtkdata.GetCell(i).GetPointId(k) for k in range(3)] for i in range(n_cells)], dtype = np.int64).reshape(n_cells, 3)
+
+
+def hkl_family(hkl):
+	"""
+	Return all the directions equivalent to hkl in a cubic lattice (permutations and sign
+	changes of the indices) as a (n, 3) array, e.g. 6 directions for [1, 0, 0]
+	"""
+	hkl = np.abs(np.asarray(hkl))
+	permutations = np.array([[0, 1, 2], [0, 2, 1], [1, 0, 2], [1, 2, 0], [2, 0, 1], [2, 1, 0]])
+	signs = np.array([[i, j, k] for i in [1, -1] for j in [1, -1] for k in [1, -1]])
+	family = (hkl[permutations][:, None, :] * signs[None, :, :]).reshape(-1, 3)
+
+	return np.unique(family, axis = 0)
+
+
+def rotate_normals(
+	normals,
+	rotation_matrix,
+	):
+	"""
+	Rotate a (n, 3) array of normals with one matrix product.
+	rotation_matrix can be a (3, 3) matrix or a (m, 3, 3) batch of matrices,
+	in which case a (m, n, 3) array is returned.
+	"""
+	return np.matmul(np.asarray(normals, dtype = np.float64), np.swapaxes(rotation_matrix, -1, -2))
+
+
+def angles_between(
+	normals,
+	reference,
+	):
+	"""
+	Angles in degrees between each normal of a (..., 3) array and the reference vector(s),
+	normals that cannot be normalized give nan
+	"""
+	normals = np.asarray(normals, dtype = np.float64)
+	reference = np.asarray(reference, dtype = np.float64)
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		cosines = np.sum(normals * reference, axis = -1) / (np.linalg.norm(normals, axis = -1) * np.linalg.norm(reference, axis = -1))
+
+	return np.rad2deg(np.arccos(np.clip(cosines, -1, 1)))
+
+
+def index_normals(
+	normals,
+	hkls,
+	):
+	"""
+	Assign to each normal of a (..., n, 3) array the closest direction in the (k, 3) hkls array.
+	Returns the index in hkls of the closest direction and the angle in degrees to it,
+	both with shape (..., n).
+	"""
+	normals = np.asarray(normals, dtype = np.float64)
+	hkls = np.asarray(hkls, dtype = np.float64)
+
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		normals = normals / np.linalg.norm(normals, axis = -1)[..., None]
+	hkls = hkls / np.linalg.norm(hkls, axis = -1)[:, None]
+
+	cosines = np.nan_to_num(np.matmul(normals, hkls.T), nan = -1)
+	best = np.argmax(cosines, axis = -1)
+	best_cosines = np.take_along_axis(cosines, best[..., None], axis = -1)[..., 0]
+
+	return best, np.rad2deg(np.arccos(np.clip(best_cosines, -1, 1)))
+
+
+def random_rotation_matrices(
+	n,
+	seed = 0,
+	):
+	"""
+	Return n rotation matrices, (n, 3, 3) array, uniformly distributed in rotation space
+	(built from uniform random unit quaternions)
+	"""
+	rng = np.random.default_rng(seed)
+	u1, u2, u3 = rng.random((3, n))
+	w = np.sqrt(1 - u1) * np.sin(2 * np.pi * u2)
+	x = np.sqrt(1 - u1) * np.cos(2 * np.pi * u2)
+	y = np.sqrt(u1) * np.sin(2 * np.pi * u3)
+	z = np.sqrt(u1) * np.cos(2 * np.pi * u3)
+
+	return np.stack([
+		np.stack([1 - 2*(y**2 + z**2), 2*(x*y - z*w), 2*(x*z + y*w)], axis = -1),
+		np.stack([2*(x*y + z*w), 1 - 2*(x**2 + z**2), 2*(y*z - x*w)], axis = -1),
+		np.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x**2 + y**2)], axis = -1),
+		], axis = 1)
+
+
+def score_orientations(
+	rotation_matrices,
+	normals,
+	weights,
+	directions,
+	):
+	"""
+	Weighted RMS angle (degrees) between the rotated normals and their closest direction,
+	for each matrix of a (m, 3, 3) batch. Returns a (m,) array.
+	"""
+	_, angles = index_normals(rotate_normals(normals, rotation_matrices), directions)
+
+	return np.sqrt(np.sum(weights * angles**2, axis = -1) / np.sum(weights))
+
+
+def fit_rotation(
+	normals,
+	targets,
+	weights,
+	):
+	"""
+	Rotation matrix R minimizing sum(weights * |R @ normal - target|**2), with normals and
+	targets as (n, 3) arrays of unit vectors (Kabsch algorithm)
+	"""
+	h = (weights[:, None] * normals).T @ targets
+	u, _, vt = np.linalg.svd(h)
+	d = np.sign(np.linalg.det(vt.T @ u.T))
+
+	return vt.T @ np.diag([1, 1, d]) @ u.T
+
+
+FACETS_HDF5_VERSION = 1
+
+# Attributes saved by Facets.save_hdf5 when they exist
+FACETS_HDF5_ATTRIBUTES = [
+	"u0", "v0", "w0", "u", "v", "norm_u", "norm_v", "norm_w",
+	"rotation_matrix", "rotation_residual",
+	"hkl_reference", "planar_dist", "ref_normal", "theoretical_normals",
+	]
+
+
+class LazyColumns(dict):
+	"""
+	Dictionnary of the datasets of an hdf5 group, each dataset is only read from the file
+	the first time its key is accessed, then kept in memory
+	"""
+
+	def __init__(
+		self,
+		path_to_data,
+		group,
+		columns,
+		):
+		super(LazyColumns, self).__init__()
+		self.path_to_data = path_to_data
+		self.group = group
+		self.columns = list(columns)
+
+
+	def __missing__(self, key):
+		if key not in self.columns:
+			raise KeyError(key)
+		with h5py.File(self.path_to_data, mode="r") as f:
+			value = f[self.group][key][()]
+		self[key] = value
+		return value
+
+
+	def __contains__(self, key):
+		return key in self.columns
+
+
+	def keys(self):
+		return list(self.columns)
+
+
+	def load(self):
+		"""Read all the columns that are not in memory yet"""
+		for key in self.columns:
+			self[key]
+		return self
+
+
+def write_table(
+	group,
+	df,
+	):
+	"""
+	Save a DataFrame in an hdf5 group, one dataset per column.
+	Object columns (e.g. legend) are saved as strings, missing values as an empty string.
+	"""
+	group.attrs["columns"] = [str(c) for c in df.columns]
+	for column in df.columns:
+		values = np.asarray(df[column])
+		if values.dtype == object:
+			try:
+				values = values.astype(np.float64)
+			except (TypeError, ValueError):
+				values = np.array(
+					["" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v) for v in values],
+					dtype = h5py.string_dtype(),
+					)
+				group.create_dataset(str(column), data = values).attrs["kind"] = "str"
+				continue
+		group.create_dataset(str(column), data = values)
+
+
+def read_table(
+	group,
+	columns = None,
+	):
+	"""
+	Read a DataFrame saved with write_table, only the given columns if specified
+	"""
+	columns = columns or list(group.attrs["columns"])
+	df = pd.DataFrame()
+	for column in columns:
+		dataset = group[column]
+		if dataset.attrs.get("kind") == "str":
+			df[column] = pd.Series([v.decode() or None for v in dataset[()]], dtype = object)
+		else:
+			df[column] = dataset[()]
+	return df
 
 
 class Facets(object):
@@ -38,6 +279,7 @@ class Facets(object):
 		filename, 
 		pathdir = "./", 
 		lattice = 3.912,
+		show_window = True,
 		):
 		super(Facets, self).__init__()
 		self.pathsave = pathdir + "facets_analysis/"
@@ -45,13 +287,32 @@ class Facets(object):
 		self.filename = filename
 
 		self.lattice = lattice
+		self.comment = ''
 
 		# Plotting options
+		self.init_plot_options()
+
+		# Load the data
+		self.load_vtk()
+
+		# Add edges and corners data if not there already
+		self.save_edges_corners_data()
+
+		# Create widget for particle viewing
+		if show_window:
+			self.create_window()
+
+
+	def init_plot_options(
+		self
+		):
+		"""
+		Default plotting options
+		"""
 		self.strain_range = 0.001
 		self.disp_range_avg = 0.2
 		self.disp_range = 0.35
 		self.strain_range_avg = 0.0005
-		self.comment = ''
 
 		self.title_fontsize = 24
 		self.axes_fontsize = 18
@@ -61,13 +322,17 @@ class Facets(object):
 		self.cmap = "viridis"
 		self.particle_cmap = "gist_ncar"
 
-		# Load the data
-		self.load_vtk()
+		# Level of detail of the 3D plots shown in the notebook, saved figures are at full resolution
+		self.lod_max_points = 20000
+		self.lod_method = "voxel"
 
-		# Add edges and corners data if not there already
-		self.save_edges_corners_data()
 
-		# Create widget for particle viewing
+	def create_window(
+		self
+		):
+		"""
+		Create the widget used to view the particle, saved as self.window
+		"""
 		self.window = interactive(self.view_particle,
 		           elev = widgets.IntSlider(
 		                value = 0,
@@ -149,67 +414,64 @@ class Facets(object):
 		print("Number of points = %s" % str(vtkdata.GetNumberOfPoints()))
 		print("Number of cells = %s" % str(vtkdata.GetNumberOfCells()))
 
+		# Whole arrays are pulled from the vtk buffers at once, as numpy views
 		self.vtk_data = {}
 
-		self.vtk_data['x'] = [vtkdata.GetPoint(i)[0] for i in range(vtkdata.GetNumberOfPoints())]
-		self.vtk_data['y'] = [vtkdata.GetPoint(i)[1] for i in range(vtkdata.GetNumberOfPoints())]
-		self.vtk_data['z'] = [vtkdata.GetPoint(i)[2] for i in range(vtkdata.GetNumberOfPoints())]
-		self.vtk_data['strain'] = [pointData.GetArray('strain').GetValue(i) for i in range(vtkdata.GetNumberOfPoints())]
-		self.vtk_data['disp'] = [pointData.GetArray('disp').GetValue(i) for i in range(vtkdata.GetNumberOfPoints())]
+		points = numpy_support.vtk_to_numpy(vtkdata.GetPoints().GetData())
+		self.vtk_data['x'] = points[:, 0]
+		self.vtk_data['y'] = points[:, 1]
+		self.vtk_data['z'] = points[:, 2]
+		self.vtk_data['strain'] = numpy_support.vtk_to_numpy(pointData.GetArray('strain'))
+		self.vtk_data['disp'] = numpy_support.vtk_to_numpy(pointData.GetArray('disp'))
 
 		# Get cell data
 		cellData = vtkdata.GetCellData()
 
-		self.vtk_data['facet_probabilities'] = [cellData.GetArray('FacetProbabilities').GetValue(i) for i in range(vtkdata.GetNumberOfCells())]
-		self.vtk_data['facet_id'] = [cellData.GetArray('FacetIds').GetValue(i) for i in range(vtkdata.GetNumberOfCells())]
-		self.vtk_data['x0'] = [vtkdata.GetCell(i).GetPointId(0) for i in range(vtkdata.GetNumberOfCells())]
-		self.vtk_data['y0'] = [vtkdata.GetCell(i).GetPointId(1) for i in range(vtkdata.GetNumberOfCells())]
-		self.vtk_data['z0'] = [vtkdata.GetCell(i).GetPointId(2) for i in range(vtkdata.GetNumberOfCells())]
+		self.vtk_data['facet_probabilities'] = numpy_support.vtk_to_numpy(cellData.GetArray('FacetProbabilities'))
+		self.vtk_data['facet_id'] = numpy_support.vtk_to_numpy(cellData.GetArray('FacetIds'))
+
+		cell_point_ids = get_cell_point_ids(vtkdata)
+		self.vtk_data['x0'] = cell_point_ids[:, 0]
+		self.vtk_data['y0'] = cell_point_ids[:, 1]
+		self.vtk_data['z0'] = cell_point_ids[:, 2]
 
 		self.nb_facets = int(max(self.vtk_data['facet_id']))
 		print("Number of facets = %s" % str(self.nb_facets))
 
-		# Get means
-		facet_indices = np.arange(1, int(self.nb_facets) + 1, 1) # indices from 1 to n_facets
+		# Points belonging to each facet, computed once for all
+		self.build_facet_index()
 
-		strain_mean = np.zeros(self.nb_facets) # stored later in field data
-		strain_std = np.zeros(self.nb_facets) # stored later in field data
-		disp_mean = np.zeros(self.nb_facets) # stored later in field data
-		disp_std = np.zeros(self.nb_facets) # stored later in field data
+		# Get statistics on each facet, index 0 are the edges and corners
+		self.compute_facet_stats()
 
 		# For future analysis
 		self.strain_mean_facets=[]
 		self.disp_mean_facets=[]
 
-		for ind in facet_indices:
-		    print("Facet = %d" % ind)
-		    results = self.extract_facet(ind, plot = False)
-		    strain_mean[ind-1] = results['strain_mean']
-		    strain_std[ind-1] = results['strain_std']
-		    disp_mean[ind-1] = results['disp_mean']
-		    disp_std[ind-1] = results['disp_std']
-
 
 		# Get field data
 		self.field_data = pd.DataFrame()
 		fieldData = vtkdata.GetFieldData()
 
-		self.field_data['facet_id'] = [fieldData.GetArray('FacetIds').GetValue(i) for i in range(self.nb_facets)]
-		self.field_data['strain_mean'] = strain_mean
-		self.field_data['strain_std'] = strain_std
-		self.field_data['disp_mean'] = disp_mean
-		self.field_data['disp_std'] = disp_std
-		self.field_data['n0'] = [fieldData.GetArray('facetNormals').GetValue(3*i) for i in range(self.nb_facets)]
-		self.field_data['n1'] = [fieldData.GetArray('facetNormals').GetValue(3*i+1) for i in range(self.nb_facets)]
-		self.field_data['n2'] = [fieldData.GetArray('facetNormals').GetValue(3*i+2) for i in range(self.nb_facets)]
-		self.field_data['c0'] = [fieldData.GetArray('FacetCenters').GetValue(3*i) for i in range(self.nb_facets)]
-		self.field_data['c1'] = [fieldData.GetArray('FacetCenters').GetValue(3*i+1) for i in range(self.nb_facets)]
-		self.field_data['c2'] = [fieldData.GetArray('FacetCenters').GetValue(3*i+2) for i in range(self.nb_facets)]
-		self.field_data['interplanar_angles'] = [fieldData.GetArray('interplanarAngles').GetValue(i) for i in range(self.nb_facets)]
-		self.field_data['abs_facet_size'] = [fieldData.GetArray('absFacetSize').GetValue(i) for i in range(self.nb_facets)]
-		self.field_data['rel_facet_size'] = [fieldData.GetArray('relFacetSize').GetValue(i) for i in range(self.nb_facets)]
-
-		self.field_data = self.field_data.astype({'facet_id': np.int8})
+		normals = np.ravel(numpy_support.vtk_to_numpy(fieldData.GetArray('facetNormals')))
+		centers = np.ravel(numpy_support.vtk_to_numpy(fieldData.GetArray('FacetCenters')))
+
+		self.field_data['facet_id'] = numpy_support.vtk_to_numpy(fieldData.GetArray('FacetIds'))[:self.nb_facets]
+		self.field_data['strain_mean'] = self.facet_stats['strain_mean'].values[1:]
+		self.field_data['strain_std'] = self.facet_stats['strain_std'].values[1:]
+		self.field_data['disp_mean'] = self.facet_stats['disp_mean'].values[1:]
+		self.field_data['disp_std'] = self.facet_stats['disp_std'].values[1:]
+		self.field_data['n0'] = normals[0:3*self.nb_facets:3]
+		self.field_data['n1'] = normals[1:3*self.nb_facets:3]
+		self.field_data['n2'] = normals[2:3*self.nb_facets:3]
+		self.field_data['c0'] = centers[0:3*self.nb_facets:3]
+		self.field_data['c1'] = centers[1:3*self.nb_facets:3]
+		self.field_data['c2'] = centers[2:3*self.nb_facets:3]
+		self.field_data['interplanar_angles'] = numpy_support.vtk_to_numpy(fieldData.GetArray('interplanarAngles'))[:self.nb_facets]
+		self.field_data['abs_facet_size'] = numpy_support.vtk_to_numpy(fieldData.GetArray('absFacetSize'))[:self.nb_facets]
+		self.field_data['rel_facet_size'] = numpy_support.vtk_to_numpy(fieldData.GetArray('relFacetSize'))[:self.nb_facets]
+
+		self.field_data = self.field_data.astype({'facet_id': np.int32})
 
 		# Get normals
 		# Don't use array index but facet number in case we sort the dataframe !!
@@ -222,6 +484,201 @@ class Facets(object):
 		self.field_data["legend"] = legend
 
 
+	def build_facet_index(
+		self
+		):
+		"""
+		Build a CSR-like index of the points belonging to each facet.
+		The ids of the points of facet i, without doubles, are
+		self.facet_index_points[self.facet_index_ptr[i]:self.facet_index_ptr[i+1]]
+		self.facet_index_ids gives the facet id of each entry of self.facet_index_points
+		"""
+		n_points = len(self.vtk_data['x'])
+		n_ids = self.nb_facets + 1 # 0 is for the edges and corners
+
+		# Each cell gives its facet id to its three points
+		facet_ids = np.repeat(np.asarray(self.vtk_data['facet_id'], dtype = np.int64), 3)
+		point_ids = np.stack([
+			self.vtk_data['x0'],
+			self.vtk_data['y0'],
+			self.vtk_data['z0'],
+			], axis = 1).astype(np.int64).ravel()
+
+		# Unique (facet, point) pairs, sorted by facet then by point
+		keys = np.unique(facet_ids * n_points + point_ids)
+
+		self.facet_index_ids = keys // n_points
+		self.facet_index_points = keys % n_points
+		self.facet_index_ptr = np.zeros(n_ids + 1, dtype = np.int64)
+		self.facet_index_ptr[1:] = np.cumsum(np.bincount(self.facet_index_ids, minlength = n_ids))
+		self.lod_cache = {}
+
+
+	def decimate_facets(
+		self,
+		max_points = None,
+		method = None,
+		seed = 0,
+		):
+		"""
+		Select about max_points entries of the facet index to plot, keeping at least one point per facet.
+		Returns the positions of the selected entries in self.facet_index_points, sorted by facet.
+		The selection is computed once and cached for each (max_points, method).
+
+		method: "voxel" keeps one point per facet in each cell of a regular grid, the grid size
+			being adjusted to get about max_points points
+			"random" keeps a random fraction of the points of each facet
+		"""
+		if not hasattr(self, 'facet_index_ptr'):
+			self.build_facet_index()
+		if not hasattr(self, 'lod_cache'):
+			self.lod_cache = {}
+
+		max_points = max_points or self.lod_max_points
+		method = method or self.lod_method
+		n_entries = len(self.facet_index_points)
+
+		if (max_points, method) in self.lod_cache:
+			return self.lod_cache[(max_points, method)]
+
+		if n_entries <= max_points:
+			selection = np.arange(n_entries)
+
+		elif method == "voxel":
+			positions = np.stack([
+				np.asarray(self.vtk_data[key], dtype = np.float64)[self.facet_index_points]
+				for key in ['x', 'y', 'z']
+				], axis = 1)
+			origin = positions.min(axis = 0)
+			extent = np.ptp(positions, axis = 0).max()
+
+			# The points lie on a surface, their number goes as 1/voxel_size**2
+			voxel_size = extent * np.sqrt(2 / max_points)
+			for _ in range(10):
+				cells = np.floor((positions - origin) / voxel_size).astype(np.int64)
+				n_cells = cells.max() + 1
+				keys = ((self.facet_index_ids * n_cells + cells[:, 0]) * n_cells + cells[:, 1]) * n_cells + cells[:, 2]
+				_, selection = np.unique(keys, return_index = True)
+				ratio = len(selection) / max_points
+				if 0.8 < ratio <= 1:
+					break
+				voxel_size *= np.sqrt(ratio) * 1.05 if ratio > 1 else np.sqrt(ratio)
+
+			# Keep the order of the index, sorted by facet
+			selection = np.sort(selection)
+
+		elif method == "random":
+			rng = np.random.default_rng(seed)
+			keep = rng.random(n_entries) < max_points / n_entries
+			keep[self.facet_index_ptr[:-1][np.diff(self.facet_index_ptr) > 0]] = True
+			selection = np.flatnonzero(keep)
+
+		else:
+			raise ValueError("method must be 'voxel' or 'random'")
+
+		self.lod_cache[(max_points, method)] = selection
+		return selection
+
+
+	def facet_points(
+		self,
+		facet_ids,
+		full_resolution = False,
+		):
+		"""
+		Returns the point ids and the facet ids of the points of the given facets, concatenated
+		so that they can be drawn with a single scatter call.
+		Unless full_resolution, the points are decimated with decimate_facets.
+		"""
+		if not hasattr(self, 'facet_index_ptr'):
+			self.build_facet_index()
+
+		if full_resolution:
+			entries = np.arange(len(self.facet_index_points))
+		else:
+			entries = self.decimate_facets()
+
+		ids = self.facet_index_ids[entries]
+		entries = entries[np.isin(ids, facet_ids)]
+		return self.facet_index_points[entries], self.facet_index_ids[entries]
+
+
+	def facet_mean_std(
+		self,
+		key
+		):
+		"""
+		Mean and standard deviation of the point array self.vtk_data[key] on each facet,
+		computed with segmented sums over the facet index.
+		Returns two arrays indexed by facet id (0 for the edges and corners).
+		"""
+		n_ids = self.nb_facets + 1
+		values = np.asarray(self.vtk_data[key], dtype = np.float64)[self.facet_index_points]
+		counts = np.diff(self.facet_index_ptr).astype(np.float64)
+
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			mean = np.bincount(self.facet_index_ids, weights = values, minlength = n_ids) / counts
+			deviation = values - mean[self.facet_index_ids]
+			std = np.sqrt(np.bincount(self.facet_index_ids, weights = deviation**2, minlength = n_ids) / counts)
+
+		return mean, std
+
+
+	def compute_facet_stats(
+		self,
+		keys = ('strain', 'disp'),
+		percentiles = (5, 25, 75, 95),
+		):
+		"""
+		Compute in one pass the statistics of each point array in keys on every facet:
+		count, mean, std, median and percentiles (linear interpolation, as in np.percentile).
+		The values of each array are sorted once inside each facet segment, all the order
+		statistics are then read at computed positions in the sorted array.
+
+		The result is cached in self.facet_stats, a DataFrame indexed by facet id (0 for the
+		edges and corners), with columns "count" and "<key>_<statistic>".
+		To add a new metric, add a column computed from the segments of self.facet_index_points.
+		"""
+		try:
+			ptr = self.facet_index_ptr
+		except AttributeError:
+			self.build_facet_index()
+			ptr = self.facet_index_ptr
+
+		counts = np.diff(ptr)
+		starts = ptr[:-1]
+		last = np.maximum(counts - 1, 0)
+		empty = counts == 0
+
+		stats = pd.DataFrame(index = pd.Index(np.arange(self.nb_facets + 1), name = 'facet_id'))
+		stats['count'] = counts
+
+		for key in keys:
+			mean, std = self.facet_mean_std(key)
+			stats[f"{key}_mean"] = mean
+			stats[f"{key}_std"] = std
+
+			# Sort the values inside each facet segment, the segments are already ordered
+			values = np.asarray(self.vtk_data[key], dtype = np.float64)[self.facet_index_points]
+			values = values[np.lexsort((values, self.facet_index_ids))]
+
+			for q in [50] + list(percentiles):
+				position = last * q / 100
+				low = np.floor(position).astype(np.int64)
+				high = np.ceil(position).astype(np.int64)
+				low_values = values[np.minimum(starts + low, len(values) - 1)]
+				high_values = values[np.minimum(starts + high, len(values) - 1)]
+				result = low_values + (position - low) * (high_values - low_values)
+				result[empty] = np.nan
+
+				name = f"{key}_median" if q == 50 else f"{key}_p{q}"
+				stats[name] = result
+
+		self.facet_stats = stats
+
+		return self.facet_stats
+
+
 	def set_rotation_matrix(self,
 		u0, 
 		v0, 
@@ -257,32 +714,108 @@ class Facets(object):
 		self.rotation_matrix = np.dot(np.transpose(tensor0), np.transpose(inv_tensor1))
 
 
+	def find_rotation_matrix(
+		self,
+		hkls = None,
+		n_orientations = 50000,
+		batch_size = 5000,
+		n_workers = None,
+		n_refine = 10,
+		seed = 0,
+		):
+		"""
+		Automatic alternative to set_rotation_matrix.
+		Search rotation space for the matrix that best brings the measured facet normals on the
+		families of hkls (by default the theoretical normals of fixed_reference), each facet being
+		weighted by its relative size.
+
+		n_orientations random orientations are scored by batches of batch_size, in n_workers
+		processes if n_workers is given. The best one is then refined by alternating the hkl
+		assignment and the optimal rotation for this assignment, at most n_refine times.
+
+		The matrix is saved as self.rotation_matrix, to be used by rotate_particle.
+		Returns the rotation matrix, the weighted RMS angle (degrees) between the rotated
+		normals and their hkl, and a DataFrame with the hkl assigned to each facet.
+		"""
+		if hkls is None:
+			try:
+				hkls = self.theoretical_normals
+			except AttributeError:
+				raise AttributeError("Run fixed_reference first or provide a list of hkl.")
+
+		directions = np.unique(np.concatenate([hkl_family(hkl) for hkl in hkls]), axis = 0)
+		unit_directions = directions / np.linalg.norm(directions, axis = 1)[:, None]
+
+		facets = (self.field_data["facet_id"] != 0).values
+		normals = self.field_data.loc[facets, ['n0', 'n1', 'n2']].values.astype(np.float64)
+		normals /= np.linalg.norm(normals, axis = 1)[:, None]
+		weights = self.field_data.loc[facets, 'rel_facet_size'].values.astype(np.float64)
+
+		# Coarse search by batches of orientations
+		rotations = random_rotation_matrices(n_orientations, seed = seed)
+		batches = [rotations[i:i+batch_size] for i in range(0, n_orientations, batch_size)]
+
+		if n_workers:
+			with ProcessPoolExecutor(max_workers = n_workers) as executor:
+				scores = list(executor.map(
+					score_orientations,
+					batches,
+					*[[a] * len(batches) for a in (normals, weights, unit_directions)],
+					))
+		else:
+			scores = [score_orientations(b, normals, weights, unit_directions) for b in batches]
+
+		scores = np.concatenate(scores)
+		rotation_matrix = rotations[np.argmin(scores)]
+		residual = scores.min()
+
+		# Refinement, new assignment then optimal rotation for that assignment
+		for i in range(n_refine):
+			best, _ = index_normals(rotate_normals(normals, rotation_matrix), unit_directions)
+			new_rotation = fit_rotation(normals, unit_directions[best], weights)
+			new_residual = score_orientations(new_rotation[None], normals, weights, unit_directions)[0]
+
+			if new_residual >= residual:
+				break
+			rotation_matrix, residual = new_rotation, new_residual
+
+		best, angles = index_normals(rotate_normals(normals, rotation_matrix), unit_directions)
+		assignment = pd.DataFrame({
+			'facet_id': self.field_data.loc[facets, 'facet_id'].values,
+			'hkl': [str(d) for d in directions[best].tolist()],
+			'angle': angles,
+			'rel_facet_size': weights,
+			})
+
+		self.rotation_matrix = rotation_matrix
+		self.rotation_residual = residual
+		print(f"Weighted RMS angle between the rotated normals and their hkl: {residual:.2f} deg")
+
+		return rotation_matrix, residual, assignment
+
+
 	def rotate_particle(self):
 		"""
 		Rotate the particle so that the base of the normals to the facets is computed with the new 
 		rotation matrix
 		"""
 
-		# Get normals, again to make sure that we have the good ones
-		normals = {f"facet_{row.facet_id}":  np.array([row['n0'], row['n1'], row['n2']]) for j, row in self.field_data.iterrows() if row.facet_id != 0}
+		# Get normals, again to make sure that we have the good ones, edges and corners have no normal
+		facets = (self.field_data["facet_id"] != 0).values
+		normals = self.field_data.loc[facets, ['n0', 'n1', 'n2']].values.astype(np.float64)
 
 		try:
-		    for e in normals.keys():
-		        normals[e] = np.dot(self.rotation_matrix, normals[e])
-		except:
+			normals = rotate_normals(normals, self.rotation_matrix)
+		except AttributeError:
 			print("""You need to define the rotation matrix first if you want to rotate the particle.
 				Please choose vectors from the normals in field data""")
+			return
 
-		# Save the new normals
-		for k, v in normals.items():
-			# we make sure that we use the same facets !!
-			mask = self.field_data["facet_id"] == int(k.split("facet_")[-1])
-			self.field_data.loc[mask, 'n0'] = v[0]
-			self.field_data.loc[mask, 'n1'] = v[1]
-			self.field_data.loc[mask, 'n2'] = v[2]
+		# Save the new normals, the mask keeps the link with the facet ids
+		self.field_data.loc[facets, ['n0', 'n1', 'n2']] = normals
 
-			# Update legend
-			self.field_data.loc[mask, 'legend'] = ' '.join(['{:.2f}'.format(e) for e in v])
+		# Update legend
+		self.field_data.loc[facets, 'legend'] = [' '.join(['{:.2f}'.format(e) for e in v]) for v in normals]
 
 
 	def fixed_reference(self, 
@@ -291,6 +824,7 @@ class Facets(object):
 		):
 		"""
 		Recompute the interplanar angles between each normal and a fixed reference vector
+		Each facet is then indexed with the closest direction among the families of the theoretical normals
 		"""
 
 		self.hkl_reference = hkl_reference
@@ -299,24 +833,13 @@ class Facets(object):
 		self.ref_normal = self.hkl_reference/np.linalg.norm(self.hkl_reference)
 
 		# Get normals, again to make sure that we have the good ones
-		normals = {f"facet_{row.facet_id}":  np.array([row['n0'], row['n1'], row['n2']]) for j, row in self.field_data.iterrows() if row.facet_id != 0}
+		facets = (self.field_data["facet_id"] != 0).values
+		normals = self.field_data.loc[facets, ['n0', 'n1', 'n2']].values.astype(np.float64)
 
 		# Interplanar angle recomputed from a fixed reference plane, between the experimental facets
-		new_angles = [np.nan]
-		for e in normals.keys():
-			value = np.rad2deg(
-						np.arccos(
-							np.dot(self.ref_normal, normals[e]/np.linalg.norm(normals[e]))
-							)
-						)
-
-			new_angles.append(value)
-
-		# Convert nan to zeros
-		mask = np.isnan(new_angles)
-		for j, m in enumerate(mask):
-		    if m:
-		        new_angles[j] = 0
+		# nan (edges and corners, null normals) are converted to zeros
+		new_angles = np.zeros(len(self.field_data))
+		new_angles[facets] = np.nan_to_num(angles_between(normals, self.ref_normal))
 
 		self.field_data['interplanar_angles'] = new_angles
 
@@ -329,15 +852,14 @@ class Facets(object):
 				[1, 1, 3], [1, -1, 3], [1, -1, -3], [-1, -1, 3], [1, 1, -3], [-1, -1, -3],
 				[1, 1, 5], [1, -1, 5], [1, -1, -5], [-1, -1, 5], [1, 1, -5], [-1, -1, -5],
 		          ]
+		self.theoretical_normals = normals
 
 		# Stores the theoretical angles between normals
-		self.theoretical_angles = {}
-		for n in normals:
-		    self.theoretical_angles[str(n)] = np.rad2deg(
-									np.arccos(
-										np.dot(self.ref_normal, n/np.linalg.norm(n))
-												)
-											)
+		angles = angles_between(normals, self.ref_normal)
+		self.theoretical_angles = {str(n): a for n, a in zip(normals, angles)}
+
+		# Index the facets with the closest theoretical direction
+		self.index_facets()
 
 		# Make a plot
 		if plot == True:
@@ -378,6 +900,38 @@ class Facets(object):
 			plt.show()
 
 
+	def index_facets(
+		self,
+		hkls = None,
+		):
+		"""
+		Find for each facet the closest direction among the families of hkls (by default the
+		families of the theoretical normals defined in fixed_reference).
+		The direction and the angle between it and the facet normal are saved in field_data,
+		in the "hkl" and "hkl_angle" columns.
+		"""
+		if hkls is None:
+			try:
+				hkls = self.theoretical_normals
+			except AttributeError:
+				print("Run fixed_reference first or provide a list of hkl.")
+				return
+
+		directions = np.unique(np.concatenate([hkl_family(hkl) for hkl in hkls]), axis = 0)
+
+		facets = (self.field_data["facet_id"] != 0).values
+		normals = self.field_data.loc[facets, ['n0', 'n1', 'n2']].values.astype(np.float64)
+		best, angles = index_normals(normals, directions)
+
+		hkl = np.full(len(self.field_data), None, dtype = object)
+		hkl_angle = np.full(len(self.field_data), np.nan)
+		hkl[facets] = [str(d) for d in directions[best].tolist()]
+		hkl_angle[facets] = angles
+
+		self.field_data['hkl'] = hkl
+		self.field_data['hkl_angle'] = hkl_angle
+
+
 	def test_vector(self,
 		vec
 		):
@@ -401,26 +955,16 @@ class Facets(object):
 		Extract data from one facet, [x, y, z], strain, displacement and their means, also plots it
 		"""
 
-		# Retrieve voxels that correspond to that facet index
-		voxel_indices = []
-		for i in range(len(self.vtk_data['facet_id'])):
-		    if (int(self.vtk_data['facet_id'][i]) == facet_id):
-		        voxel_indices.append(self.vtk_data['x0'][i])
-		        voxel_indices.append(self.vtk_data['y0'][i])
-		        voxel_indices.append(self.vtk_data['z0'][i])
+		# Retrieve voxels that correspond to that facet index, without doubles
+		try:
+			voxel_indices = self.facet_index_points[self.facet_index_ptr[facet_id]:self.facet_index_ptr[facet_id+1]]
+		except AttributeError:
+			self.build_facet_index()
+			voxel_indices = self.facet_index_points[self.facet_index_ptr[facet_id]:self.facet_index_ptr[facet_id+1]]
 
-		# wtf here
-		voxel_indices_new = list(set(voxel_indices))
 		results = {}
-		results['x'], results['y'], results['z'] = np.zeros(len(voxel_indices_new)), np.zeros(len(voxel_indices_new)), np.zeros(len(voxel_indices_new))
-		results['strain'], results['disp'] = np.zeros(len(voxel_indices_new)), np.zeros(len(voxel_indices_new))
-
-		for j in range(len(voxel_indices_new)):
-		    results['x'][j] = self.vtk_data['x'][int(voxel_indices_new[j])]
-		    results['y'][j] = self.vtk_data['y'][int(voxel_indices_new[j])]
-		    results['z'][j] = self.vtk_data['z'][int(voxel_indices_new[j])]
-		    results['strain'][j] = self.vtk_data['strain'][int(voxel_indices_new[j])]
-		    results['disp'][j] = self.vtk_data['disp'][int(voxel_indices_new[j])]
+		for key in ['x', 'y', 'z', 'strain', 'disp']:
+			results[key] = np.asarray(self.vtk_data[key][voxel_indices], dtype = np.float64)
 		results['strain_mean'] = np.mean(results['strain'])
 		results['strain_std'] = np.std(results['strain'])
 		results['disp_mean'] = np.mean(results['disp'])
@@ -500,75 +1044,30 @@ class Facets(object):
 		ax.set_ylabel('Y axis', fontsize = self.axes_fontsize)
 		ax.set_zlabel('Z axis', fontsize = self.axes_fontsize)
 
-		def plot_facet_id(facet_id):
-			"""
-			Plots the voxes belonging to a specific facet, ogether with the normal to that facet and it's id
-			"""
-
-			# Retrieve voxels for each facet
-			voxel_indices = []
-			for i in range(len(self.vtk_data['facet_id'])):
-			    if (int(self.vtk_data['facet_id'][i]) == facet_id):
-			        voxel_indices.append(self.vtk_data['x0'][i])
-			        voxel_indices.append(self.vtk_data['y0'][i])
-			        voxel_indices.append(self.vtk_data['z0'][i])
-
-			# Delete doubles
-			voxel_indices_new = list(set(voxel_indices))
-			results = {}
-			results['x'], results['y'], results['z'] = np.zeros(len(voxel_indices_new)), np.zeros(len(voxel_indices_new)), np.zeros(len(voxel_indices_new))
-			results['facet_id'] = np.zeros(len(voxel_indices_new))
-
-			for j in range(len(voxel_indices_new)):
-			    results['x'][j] = self.vtk_data['x'][int(voxel_indices_new[j])]
-			    results['y'][j] = self.vtk_data['y'][int(voxel_indices_new[j])]
-			    results['z'][j] = self.vtk_data['z'][int(voxel_indices_new[j])]
-			    results['facet_id'][j] = facet_id
-
-			# Plot all the voxels with the color of their facet
-			if elev_axis == "z":
-				ax.scatter(
-				    results['x'],
-				    results['y'],
-				    results['z'],
-				    s = 50,
-				    c = results['facet_id'],
-				    cmap = self.particle_cmap,
-				    vmin = facet_id_range[0], 
-				    vmax = facet_id_range[1], 
-				    antialiased=True, 
-				    depthshade=True
-					)
-
-			if elev_axis == "x":
-				ax.scatter(
-				    results['y'],
-				    results['z'],
-				    results['x'],
-				    s = 50,
-				    c = results['facet_id'],
-				    cmap = self.particle_cmap,
-				    vmin = facet_id_range[0], 
-				    vmax = facet_id_range[1], 
-				    antialiased=True, 
-				    depthshade=True
-					)
-
-			if elev_axis == "y":
-				ax.scatter(
-				    results['z'],
-				    results['x'],
-				    results['y'],
-				    s = 50,
-				    c = results['facet_id'],
-				    cmap = self.particle_cmap,
-				    vmin = facet_id_range[0], 
-				    vmax = facet_id_range[1], 
-				    antialiased=True, 
-				    depthshade=True
-					)
-
-			# Plot the normal to each facet at their center, do it after so that is it the top layer
+		# Plot all the voxels with the color of their facet, in a single call
+		facet_ids = list(range(facet_id_range[0], facet_id_range[1]))
+		if show_edges_corners:
+			facet_ids.append(0)
+		points, ids = self.facet_points(facet_ids)
+
+		x = np.asarray(self.vtk_data['x'])[points]
+		y = np.asarray(self.vtk_data['y'])[points]
+		z = np.asarray(self.vtk_data['z'])[points]
+		coordinates = {"z" : (x, y, z), "x" : (y, z, x), "y" : (z, x, y)}[elev_axis]
+
+		ax.scatter(
+		    *coordinates,
+		    s = 50,
+		    c = ids,
+		    cmap = self.particle_cmap,
+		    vmin = facet_id_range[0], 
+		    vmax = facet_id_range[1], 
+		    antialiased=True, 
+		    depthshade=True
+			)
+
+		# Plot the normal to each facet at their center, do it after so that is it the top layer
+		for facet_id in facet_ids:
 			row = self.field_data.loc[self.field_data["facet_id"] == facet_id]
 			if facet_id != 0:
 				if elev_axis == "x":
@@ -595,12 +1094,6 @@ class Facets(object):
 				n_str = str(facet_id) + str(n.round(2).tolist())
 				ax.text(com[0], com[1], com[2], n_str, color='red', fontsize = 20)
 
-		for i in range(facet_id_range[0], facet_id_range[1]):
-		    plot_facet_id(i)
-
-		if show_edges_corners:
-			plot_facet_id(0)
-		    
 		plt.tick_params(axis='both', which='major', labelsize = self.ticks_fontsize)
 		plt.tick_params(axis='both', which='minor', labelsize = self.ticks_fontsize)
 		ax.set_title(f"Particle voxels", fontsize = self.title_fontsize)
@@ -608,75 +1101,88 @@ class Facets(object):
 		plt.show()
 
 
-	def plot_strain(self, 
-		figsize = (12, 10), 
-		view = [20, 60], 
-		save = True
+	def plot_facets_3D(
+		self,
+		values,
+		vmin,
+		vmax,
+		title,
+		fig_name,
+		figsize = (12, 10),
+		view = [20, 60],
+		save = True,
 		):
+		"""
+		Scatter the points of the facets in 3D, in a single call, coloured by values(point_ids, facet_ids).
+		The figure is saved at full resolution, the figure shown uses the points of decimate_facets.
+		"""
+		facet_ids = range(1, self.nb_facets)
 
-		# 3D strain
-		fig_name = 'strain_3D_' + self.hkls + self.comment + '_' + str(self.strain_range)
 		fig = plt.figure(figsize = figsize)
 		ax = fig.add_subplot(projection='3d')
 
-		for ind in range(1, self.nb_facets):
-		    results = self.extract_facet(ind, plot = False)
-
-		    p = ax.scatter(
-		    	results['x'], 
-		    	results['y'],
-		    	results['z'], 
+		def scatter(full_resolution):
+			points, ids = self.facet_points(facet_ids, full_resolution = full_resolution)
+			return ax.scatter(
+		    	np.asarray(self.vtk_data['x'])[points], 
+		    	np.asarray(self.vtk_data['y'])[points],
+		    	np.asarray(self.vtk_data['z'])[points], 
 		    	s=50, 
-		    	c = results['strain'],
+		    	c = values(points, ids),
 		    	cmap = self.cmap,  
-		    	vmin = -self.strain_range, 
-		    	vmax = self.strain_range, 
+		    	vmin = vmin, 
+		    	vmax = vmax, 
 		    	antialiased=True, 
 		    	depthshade=True)
 
+		p = scatter(full_resolution = save)
+
 		fig.colorbar(p)
 		ax.view_init(elev = view[0], azim = view[1])
-		plt.title("Strain for each voxel", fontsize = self.title_fontsize)
+		plt.title(title, fontsize = self.title_fontsize)
 		ax.tick_params(axis='both', which='major', labelsize = self.ticks_fontsize)
 		ax.tick_params(axis='both', which='minor', labelsize = self.ticks_fontsize)
 
 		if save:
 			plt.savefig(self.pathsave + fig_name + '.png', bbox_inches = 'tight')
+			p.remove()
+			scatter(full_resolution = False)
 		plt.show()
 
-		# Average strain
-		fig_name = 'strain_3D_avg_' + self.hkls + self.comment + '_' + str(self.strain_range_avg) 
-		fig = plt.figure(figsize = figsize)
-		ax = fig.add_subplot(projection='3d')
-
-		for ind in range(1, self.nb_facets):
-		    results = self.extract_facet(ind, plot = False)
-
-		    strain_mean_facet = np.zeros(results['strain'].shape)
-		    strain_mean_facet.fill(results['strain_mean'])
-		    self.strain_mean_facets=np.append(self.strain_mean_facets, strain_mean_facet, axis=0)
 
-		    p = ax.scatter(
-		    	results['x'], 
-		    	results['y'],
-		    	results['z'], 
-		    	s=50, 
-		    	c = strain_mean_facet,
-		    	cmap = self.cmap,  
-		    	vmin = -self.strain_range_avg, 
-		    	vmax = self.strain_range_avg, 
-		    	antialiased=True, 
-		    	depthshade=True)
+	def plot_strain(self, 
+		figsize = (12, 10), 
+		view = [20, 60], 
+		save = True
+		):
 
-		fig.colorbar(p)
-		ax.view_init(elev = view[0], azim = view[1])
-		plt.title("Mean strain per facet", fontsize = self.title_fontsize)
-		ax.tick_params(axis='both', which='major', labelsize = self.ticks_fontsize)
-		ax.tick_params(axis='both', which='minor', labelsize = self.ticks_fontsize)
+		# 3D strain
+		self.plot_facets_3D(
+			values = lambda points, ids: np.asarray(self.vtk_data['strain'])[points],
+			vmin = -self.strain_range,
+			vmax = self.strain_range,
+			title = "Strain for each voxel",
+			fig_name = 'strain_3D_' + self.hkls + self.comment + '_' + str(self.strain_range),
+			figsize = figsize,
+			view = view,
+			save = save,
+			)
 
-		if save:
-			plt.savefig(self.pathsave + fig_name + '.png', bbox_inches = 'tight')
-		plt.show()
+		# Average strain
+		strain_mean = self.facet_stats['strain_mean'].reindex(range(self.nb_facets + 1)).values
+		_, ids = self.facet_points(range(1, self.nb_facets), full_resolution = True)
+		self.strain_mean_facets = strain_mean[ids]
+
+		self.plot_facets_3D(
+			values = lambda points, ids: strain_mean[ids],
+			vmin = -self.strain_range_avg,
+			vmax = self.strain_range_avg,
+			title = "Mean strain per facet",
+			fig_name = 'strain_3D_avg_' + self.hkls + self.comment + '_' + str(self.strain_range_avg),
+			figsize = figsize,
+			view = view,
+			save = save,
+			)
 
 
 	def plot_displacement(
@@ -687,69 +1193,32 @@ class Facets(object):
 		):
 
 		# 3D displacement
-		fig_name = 'disp_3D_' + self.hkls + self.comment + '_' + str(self.disp_range)
-		fig = plt.figure(figsize = figsize)
-		ax = fig.add_subplot(projection='3d')
-
-		for ind in range(1, self.nb_facets):
-		    results = self.extract_facet(ind, plot = False)
-
-		    p = ax.scatter(
-		    	results['x'], 
-		    	results['y'],
-		    	results['z'], 
-		    	s=50, 
-		    	c = results['disp'],
-		    	cmap = self.cmap,  
-		    	vmin = -self.disp_range, 
-		    	vmax = self.disp_range, 
-		    	antialiased=True, 
-		    	depthshade=True)
-
-		fig.colorbar(p)
-		ax.view_init(elev = view[0], azim = view[1])
-		plt.title("Displacement for each voxel", fontsize = self.title_fontsize)
-		ax.tick_params(axis='both', which='major', labelsize = self.ticks_fontsize)
-		ax.tick_params(axis='both', which='minor', labelsize = self.ticks_fontsize)
-
-		if save:
-			plt.savefig(self.pathsave + fig_name + '.png', bbox_inches = 'tight')
-		plt.show()
-
+		self.plot_facets_3D(
+			values = lambda points, ids: np.asarray(self.vtk_data['disp'])[points],
+			vmin = -self.disp_range,
+			vmax = self.disp_range,
+			title = "Displacement for each voxel",
+			fig_name = 'disp_3D_' + self.hkls + self.comment + '_' + str(self.disp_range),
+			figsize = figsize,
+			view = view,
+			save = save,
+			)
 
 		# Average disp
-		fig_name = 'disp_3D_avg_' + self.hkls + self.comment + '_' + str(self.disp_range_avg)
-		fig = plt.figure(figsize = figsize)
-		ax = fig.add_subplot(projection='3d')
-
-		for ind in range(1, self.nb_facets):
-		    results = self.extract_facet(ind, plot = False)
-
-		    disp_mean_facet = np.zeros(results['disp'].shape)
-		    disp_mean_facet.fill(results['disp_mean'])
-		    self.disp_mean_facets=np.append(self.disp_mean_facets, disp_mean_facet,axis=0)
-
-		    p = ax.scatter(
-		    	results['x'],
-		    	results['y'],
-		    	results['z'], 
-		    	s=50, 
-		    	c = disp_mean_facet,
-		    	cmap = self.cmap,  
-		    	vmin = -self.disp_range_avg/2, 
-		    	vmax = self.disp_range_avg/2, 
-		    	antialiased=True, 
-		    	depthshade=True)
-
-		fig.colorbar(p)
-		ax.view_init(elev = view[0], azim = view[1])
-		plt.title("Mean displacement per facet", fontsize = self.title_fontsize)
-		ax.tick_params(axis='both', which='major', labelsize = self.ticks_fontsize)
-		ax.tick_params(axis='both', which='minor', labelsize = self.ticks_fontsize)
-
-		if save:
-			plt.savefig(self.pathsave + fig_name + '.png', bbox_inches = 'tight')
-		plt.show()
+		disp_mean = self.facet_stats['disp_mean'].reindex(range(self.nb_facets + 1)).values
+		_, ids = self.facet_points(range(1, self.nb_facets), full_resolution = True)
+		self.disp_mean_facets = disp_mean[ids]
+
+		self.plot_facets_3D(
+			values = lambda points, ids: disp_mean[ids],
+			vmin = -self.disp_range_avg/2,
+			vmax = self.disp_range_avg/2,
+			title = "Mean displacement per facet",
+			fig_name = 'disp_3D_avg_' + self.hkls + self.comment + '_' + str(self.disp_range_avg),
+			figsize = figsize,
+			view = view,
+			save = save,
+			)
 
 
 	def evolution_curves(
@@ -757,6 +1226,14 @@ class Facets(object):
 		ncol = 1
 		):
 
+		# Per-facet statistics are read from the cached table
+		if not hasattr(self, 'facet_stats'):
+			self.compute_facet_stats()
+
+		stats_columns = ['strain_mean', 'strain_std', 'disp_mean', 'disp_std']
+		data = self.field_data.drop(columns = stats_columns, errors = 'ignore')
+		data = data.join(self.facet_stats[stats_columns], on = 'facet_id')
+
 		# 1D plot: average displacement vs facet index
 		fig_name = 'avg_disp_vs_facet_id_' + self.hkls + self.comment
 		fig = plt.figure(figsize = (10, 6))
@@ -778,7 +1255,7 @@ class Facets(object):
 		ax.set_yticks(minor_y_ticks_facet, minor=True)
 		plt.yticks(fontsize = self.ticks_fontsize)
 
-		for j, row in self.field_data.iterrows():
+		for j, row in data.iterrows():
 		    ax.errorbar(row['facet_id'], row['disp_mean'], row['disp_std'], fmt='o', label = row["legend"])
 		
 		ax.set_title("Average displacement vs facet index", fontsize = self.title_fontsize)
@@ -811,7 +1288,7 @@ class Facets(object):
 		ax.set_yticks(minor_y_ticks_facet, minor=True)
 		plt.yticks(fontsize = self.ticks_fontsize)
 
-		for j, row in self.field_data.iterrows():
+		for j, row in data.iterrows():
 		    ax.errorbar(row['facet_id'], row['strain_mean'], row['strain_std'], fmt='o', label = row["legend"])
 		
 		ax.set_title("Average strain vs facet index", fontsize = self.title_fontsize)
@@ -848,7 +1325,7 @@ class Facets(object):
 		ax0.set_yticks(major_y_ticks)
 		ax0.set_yticks(minor_y_ticks, minor=True)
 
-		for j, row in self.field_data.iterrows():
+		for j, row in data.iterrows():
 			try:
 				lx, ly, lz = float(row.legend.split()[0]),float(row.legend.split()[1]),float(row.legend.split()[2])
 				if (lx>=0 and ly>=0):
@@ -879,7 +1356,7 @@ class Facets(object):
 		ax1.set_yticks(major_y_ticks)
 		ax1.set_yticks(minor_y_ticks, minor=True)
 
-		for j, row in self.field_data.iterrows():
+		for j, row in data.iterrows():
 			try:
 				lx, ly, lz = float(row.legend.split()[0]),float(row.legend.split()[1]),float(row.legend.split()[2])
 				if (lx>=0 and ly>=0):
@@ -908,7 +1385,7 @@ class Facets(object):
 		ax2.set_yticks(major_y_ticks)
 		ax2.set_yticks(minor_y_ticks, minor=True)
 
-		for j, row in self.field_data.iterrows():
+		for j, row in data.iterrows():
 			try:
 				lx, ly, lz = float(row.legend.split()[0]),float(row.legend.split()[1]),float(row.legend.split()[2])
 				if (lx>=0 and ly>=0):
@@ -935,7 +1412,7 @@ class Facets(object):
 		self
 		):
 		if not 0 in self.field_data.facet_id.values:
-			result = self.extract_facet(0)
+			result = self.facet_stats.loc[0]
 
 			edges_cornes_df = pd.DataFrame({
 			    'facet_id' : [0],
@@ -960,6 +1437,22 @@ class Facets(object):
 			self.field_data = self.field_data.reset_index(drop = True)
 
 
+	def facet_table(
+		self
+		):
+		"""
+		Compact table with one row per facet: field data and all the statistics of facet_stats,
+		without the point cloud
+		"""
+		if not hasattr(self, 'facet_stats'):
+			self.compute_facet_stats()
+
+		table = self.field_data.drop(columns = [c for c in self.facet_stats.columns if c in self.field_data.columns])
+		table = table.join(self.facet_stats, on = 'facet_id')
+
+		return table
+
+
 	def save_data(
 		self,
 		path_to_data
@@ -993,6 +1486,136 @@ class Facets(object):
 		    return pickle.load(f)
 
 
+	def __getstate__(self):
+		# The widget cannot be pickled, it is created again after loading
+		state = self.__dict__.copy()
+		state.pop('window', None)
+		if isinstance(state.get('vtk_data'), LazyColumns):
+			state['vtk_data'] = dict(state['vtk_data'].load())
+		return state
+
+
+	def save_hdf5(
+		self,
+		path_to_data,
+		compression = "gzip",
+		compression_opts = 4,
+		):
+		"""
+		Save the analysis in a versioned hdf5 layout, that can be reloaded with Facets.load_hdf5.
+		Writing twice in the same file overwrites the previous data.
+
+		/facets                  attributes: format_version, filename, path_to_data, nb_facets, lattice, comment
+		/facets/vtk_data/<key>   point and cell arrays, chunked and compressed
+		/facets/index/<key>      facet index (ptr, points, ids)
+		/facets/field_data       one dataset per column
+		/facets/facet_stats      one dataset per column
+		/facets/attributes/<key> orientation attributes, if defined
+		"""
+		with h5py.File(path_to_data, mode="a") as f:
+			if "facets" in f:
+				del f["facets"]
+			group = f.create_group("facets")
+
+			group.attrs["format_version"] = FACETS_HDF5_VERSION
+			group.attrs["filename"] = self.filename
+			group.attrs["path_to_data"] = self.path_to_data
+			group.attrs["nb_facets"] = self.nb_facets
+			group.attrs["lattice"] = self.lattice
+			group.attrs["comment"] = self.comment
+
+			vtk_group = group.create_group("vtk_data")
+			for key in self.vtk_data.keys():
+				vtk_group.create_dataset(
+					key,
+					data = np.asarray(self.vtk_data[key]),
+					chunks = True,
+					compression = compression,
+					compression_opts = compression_opts,
+					shuffle = True,
+					)
+
+			if not hasattr(self, 'facet_index_ptr'):
+				self.build_facet_index()
+			index_group = group.create_group("index")
+			index_group.create_dataset("ptr", data = self.facet_index_ptr)
+			for key in ["points", "ids"]:
+				index_group.create_dataset(
+					key,
+					data = getattr(self, f"facet_index_{key}"),
+					chunks = True,
+					compression = compression,
+					compression_opts = compression_opts,
+					shuffle = True,
+					)
+
+			write_table(group.create_group("field_data"), self.field_data)
+			if not hasattr(self, 'facet_stats'):
+				self.compute_facet_stats()
+			write_table(group.create_group("facet_stats"), self.facet_stats.reset_index())
+
+			attributes = group.create_group("attributes")
+			for key in FACETS_HDF5_ATTRIBUTES:
+				if hasattr(self, key):
+					attributes.create_dataset(key, data = np.asarray(getattr(self, key)))
+
+		print(f"Saved facets in {path_to_data}")
+
+
+	@staticmethod
+	def load_hdf5(
+		path_to_data,
+		pathdir = None,
+		show_window = False,
+		):
+		"""
+		Load a Facets object saved with save_hdf5.
+		The tables and the facet index are read, the point and cell arrays of vtk_data are only
+		read from the file when they are first used (e.g. x, y, z and strain by plot_strain).
+		"""
+		facets = Facets.__new__(Facets)
+		facets.init_plot_options()
+
+		with h5py.File(path_to_data, mode="r") as f:
+			group = f["facets"]
+			version = group.attrs.get("format_version", 0)
+			if version > FACETS_HDF5_VERSION:
+				raise ValueError(f"File format version {version} is not supported, update gwaihir.")
+
+			facets.filename = str(group.attrs["filename"])
+			facets.path_to_data = str(group.attrs["path_to_data"])
+			facets.nb_facets = int(group.attrs["nb_facets"])
+			facets.lattice = float(group.attrs["lattice"])
+			facets.comment = str(group.attrs["comment"])
+
+			facets.vtk_data = LazyColumns(path_to_data, "facets/vtk_data", list(group["vtk_data"].keys()))
+
+			facets.facet_index_ptr = group["index/ptr"][()]
+			facets.facet_index_points = group["index/points"][()]
+			facets.facet_index_ids = group["index/ids"][()]
+
+			facets.field_data = read_table(group["field_data"])
+			facets.facet_stats = read_table(group["facet_stats"]).set_index("facet_id")
+
+			for key, dataset in group["attributes"].items():
+				value = dataset[()]
+				setattr(facets, key, value.decode() if isinstance(value, bytes) else value)
+
+		if hasattr(facets, 'hkl_reference'):
+			facets.hkls = ' '.join(str(e) for e in facets.hkl_reference)
+		if hasattr(facets, 'theoretical_normals'):
+			facets.theoretical_normals = facets.theoretical_normals.tolist()
+
+		if pathdir is None:
+			pathdir = os.path.dirname(facets.path_to_data) + "/"
+		facets.pathsave = pathdir + "facets_analysis/"
+
+		if show_window:
+			facets.create_window()
+
+		return facets
+
+
 	def to_hdf5(
 		self, 
 		path_to_data
@@ -1060,7 +1683,7 @@ class Facets(object):
 			self.field_data.to_hdf(path_to_data,
 									key='data/facets/tables/field_data', 
 									mode='a', 
-									append = True,
+									append = False,
 									format = 'table',
 									data_columns=True,
 									)
@@ -1076,7 +1699,7 @@ class Facets(object):
 			df.to_hdf(path_to_data,
 						key='data/facets/tables/theoretical_angles', 
 						mode='a', 
-						append = True,
+						append = False,
 						format = 'table',
 						data_columns=True,
 						)
@@ -1093,4 +1716,175 @@ class Facets(object):
 
 
 	def __str__(self):        
-	    return repr(self)
\ No newline at end of file
+	    return repr(self)
+
+def load_facet_table(
+	path_to_data,
+	lattice = 3.912,
+	hkl_reference = [1, 1, 1],
+	find_rotation = False,
+	rotation_kwargs = {},
+	):
+	"""
+	Load one vtk file and return its per-facet table (see Facets.facet_table).
+	The point cloud is dropped before returning, so that only the table is sent back
+	when used in a worker process.
+	If find_rotation, the particle is first rotated with Facets.find_rotation_matrix.
+	"""
+	pathdir, filename = os.path.split(path_to_data)
+	facets = Facets(filename = filename, pathdir = pathdir + "/", lattice = lattice, show_window = False)
+
+	if find_rotation:
+		facets.fixed_reference(hkl_reference = hkl_reference, plot = False)
+		facets.find_rotation_matrix(**rotation_kwargs)
+		facets.rotate_particle()
+
+	facets.fixed_reference(hkl_reference = hkl_reference, plot = False)
+	table = facets.facet_table()
+	del facets
+
+	return table
+
+
+class FacetSeries(object):
+	"""
+	Collection of particles (vtk files from the FacetAnalyser plugin), e.g. a time series or
+	a series of gas conditions, used to follow the evolution of each facet.
+
+	The files are loaded in parallel, and only one compact table per particle is kept
+	(one row per facet, see Facets.facet_table), so that memory stays bounded when
+	hundreds of files are loaded.
+	All the tables are concatenated in self.data, a long-form DataFrame with one row per
+	facet and per condition.
+	"""
+
+	def __init__(
+		self,
+		filenames,
+		conditions = None,
+		pathsave = "./facets_analysis/",
+		lattice = 3.912,
+		hkl_reference = [1, 1, 1],
+		find_rotation = False,
+		n_workers = None,
+		):
+		"""
+		filenames: list of paths to the vtk files
+		conditions: label of each file (e.g. temperature, time), defaults to the file index
+		find_rotation: rotate each particle with Facets.find_rotation_matrix before the analysis
+		n_workers: number of processes used to load the files, all the cores if None
+		"""
+		super(FacetSeries, self).__init__()
+		self.filenames = list(filenames)
+		self.conditions = list(conditions) if conditions is not None else list(range(len(self.filenames)))
+		if len(self.conditions) != len(self.filenames):
+			raise ValueError("conditions should have the same length as filenames")
+
+		self.pathsave = pathsave
+		self.lattice = lattice
+		self.hkl_reference = hkl_reference
+		self.find_rotation = find_rotation
+		self.n_workers = n_workers
+
+		# Plotting options
+		self.title_fontsize = 24
+		self.axes_fontsize = 18
+		self.legend_fontsize = 11
+		self.ticks_fontsize = 14
+
+		self.load()
+
+
+	def load(
+		self
+		):
+		"""
+		Load all the files with a process pool and build the long-form table self.data
+		"""
+		if not os.path.exists(self.pathsave):
+		    os.makedirs(self.pathsave)
+
+		n = len(self.filenames)
+		tables = []
+		with ProcessPoolExecutor(max_workers = self.n_workers) as executor:
+			for filename, condition, table in zip(
+				self.filenames,
+				self.conditions,
+				executor.map(
+					load_facet_table,
+					self.filenames,
+					[self.lattice] * n,
+					[self.hkl_reference] * n,
+					[self.find_rotation] * n,
+					),
+				):
+				table.insert(0, 'filename', filename)
+				table.insert(0, 'condition', condition)
+				tables.append(table)
+
+		self.data = pd.concat(tables, ignore_index = True)
+
+
+	def pivot(
+		self,
+		value = 'strain_mean',
+		group = 'facet_id',
+		):
+		"""
+		Wide table of value, one row per condition and one column per group (facet id or hkl)
+		"""
+		return self.data.pivot_table(index = 'condition', columns = group, values = value, aggfunc = 'mean', sort = False)
+
+
+	def evolution_curves(
+		self,
+		key = 'strain',
+		group = 'hkl',
+		ncol = 1,
+		save = True,
+		):
+		"""
+		Plot the mean (with the standard deviation as error bar) of key ('strain' or 'disp')
+		for each group ('facet_id', 'hkl', ...) as a function of the condition
+		"""
+		mean = self.pivot(f"{key}_mean", group)
+		std = self.pivot(f"{key}_std", group)
+		x = np.arange(len(mean.index))
+
+		fig, ax = plt.subplots(figsize = (12, 6))
+		for column in mean.columns:
+			if column is None or (group == 'facet_id' and column == 0):
+				continue
+			ax.errorbar(x, mean[column].values, std[column].values, fmt = 'o-', capsize = 2, label = str(column))
+
+		ax.set_xticks(x)
+		ax.set_xticklabels([str(c) for c in mean.index], fontsize = self.ticks_fontsize)
+		ax.set_xlabel('Condition', fontsize = self.axes_fontsize)
+		ax.set_ylabel(f'Average retrieved {key}', fontsize = self.axes_fontsize)
+		ax.set_title(f"Average {key} vs condition for each {group}", fontsize = self.title_fontsize)
+		ax.legend(bbox_to_anchor=(1, 1), loc='upper left', borderaxespad=0, fontsize = self.legend_fontsize, ncol = ncol)
+		ax.grid(which='major', alpha=0.5)
+
+		if save:
+			plt.savefig(self.pathsave + f"avg_{key}_vs_condition_per_{group}.png", bbox_inches = 'tight')
+		plt.show()
+
+
+	def save_data(
+		self,
+		path_to_data
+		):
+		"""
+		Save the long-form table as csv
+		"""
+		self.data.to_csv(path_to_data, index = False)
+
+
+	def __repr__(self):
+		return "FacetSeries of {} files\n".format(
+		            len(self.filenames), 
+		            )
+
+
+	def __str__(self):        
+	    return repr(self)
@@ -40,7 +40,7 @@ import tables as tb
 from gwaihir import facet_analysis
 from gwaihir import plot
 from gwaihir.sixs import ReadNxs4 as rd
-from gwaihir.runner import preprocess, correct_angles, strain
+from gwaihir.runner import preprocess, correct_angles, strain, output
 from gwaihir.gui import gui_iterable
 from gwaihir.support import SupportTools
 
@@ -3101,15 +3101,12 @@ class Interface(object):
                 self.Dataset.calc_llk = 50 # for now
 
                 if self.Dataset.iobs:
-                    if self.Dataset.iobs.endswith(".npy"):
-                        iobs = np.load(self.Dataset.iobs)
+                    # npz, h5 or npy file, see gwaihir.runner.output
+                    try:
+                        iobs = output.load_array(self.Dataset.iobs, ("data",))
                         print("CXI input: loading data")
-                    elif self.Dataset.iobs.endswith(".npz"):
-                        try:
-                            iobs = np.load(self.Dataset.iobs)["data"]
-                            print("CXI input: loading data")
-                        except:
-                            print("Could not load 'data' array from npz file")
+                    except:
+                        print("Could not load 'data' array from file")
 
                     if self.Dataset.rebin != (1,1,1):
                         try:
@@ -3121,17 +3118,12 @@ class Interface(object):
                     iobs = fftshift(iobs)
 
                 if self.Dataset.mask:
-                    if self.Dataset.mask.endswith(".npy"):
-                        mask = np.load(self.Dataset.mask).astype(np.int8)
+                    try:
+                        mask = output.load_array(self.Dataset.mask, ("mask", "data")).astype(np.int8)
                         nb = mask.sum()
                         print("CXI input: loading mask, with %d pixels masked (%6.3f%%)" % (nb, nb * 100 / mask.size))
-                    elif self.Dataset.mask.endswith(".npz"):
-                        try:
-                            mask = np.load(self.Dataset.mask)["mask"].astype(np.int8)
-                            nb = mask.sum()
-                            print("CXI input: loading mask, with %d pixels masked (%6.3f%%)" % (nb, nb * 100 / mask.size))
-                        except:
-                            print("Could not load 'mask' array from npz file")            
+                    except:
+                        print("Could not load 'mask' array from file")
 
                     if self.Dataset.rebin != (1,1,1):
                         try:
@@ -3143,25 +3135,11 @@ class Interface(object):
                     mask = fftshift(mask)
 
                 if self.Dataset.support:
-                    if self.Dataset.support.endswith(".npy"):
-                        support = np.load(self.Dataset.support)
+                    try:
+                        support = output.load_array(self.Dataset.support, ("data", "support", "obj"))
                         print("CXI input: loading support")
-                    elif self.Dataset.support.endswith(".npz"):
-                        try:
-                            support = np.load(self.Dataset.support)["data"]
-                            print("CXI input: loading support")
-                        except:
-                            # print("Could not load 'data' array from npz file")
-                            try:
-                                support = np.load(self.Dataset.support)["support"]
-                                print("CXI input: loading support")
-                            except:
-                                # print("Could not load 'support' array from npz file")
-                                try:
-                                    support = np.load(self.Dataset.support)["obj"]
-                                    print("CXI input: loading support")
-                                except:
-                                    print("Could not load support")
+                    except:
+                        print("Could not load support")
 
                     if self.Dataset.rebin != (1,1,1):
                         try:
@@ -3173,15 +3151,11 @@ class Interface(object):
                     support = fftshift(support)
 
                 if self.Dataset.obj:
-                    if self.Dataset.obj.endswith(".npy"):
-                        obj = np.load(self.Dataset.obj)
+                    try:
+                        obj = output.load_array(self.Dataset.obj, ("data",))
                         print("CXI input: loading object")
-                    elif self.Dataset.obj.endswith(".npz"):
-                        try:
-                            obj = np.load(self.Dataset.obj)["data"]
-                            print("CXI input: loading object")
-                        except:
-                            print("Could not load 'data' array from npz file")
+                    except:
+                        print("Could not load 'data' array from file")
 
                     if self.Dataset.rebin != (1,1,1):
                         try:
@@ -26,6 +26,8 @@ try :
 
     import tables as tb
 
+    from gwaihir.runner import output
+
 except ModuleNotFoundError:
     raise ModuleNotFoundError("""The following packages must be installed: numpy, pandas ipywidgets, iPython, thorondor and pytables.""")
 
@@ -446,12 +448,12 @@ class Dataset():
             ### Save 3D coherent diffraction intensity
             try:
                 reciprocal_space.create_dataset("data",
-                                          data = np.load(self.iobs)["data"],
+                                          data = output.load_array(self.iobs, ("data",)),
                                           chunks=True,
                                           shuffle=True,
                                           compression="gzip")
                 reciprocal_space.create_dataset("mask",
-                                          data = np.load(self.mask)["mask"],
+                                          data = output.load_array(self.mask, ("mask", "data")),
                                           chunks=True,
                                           shuffle=True,
                                           compression="gzip")
@@ -891,12 +893,12 @@ class Dataset():
             ### Save 3D coherent diffraction intensity
             try:
                 reciprocal_space.create_dataset("data",
-                                          data = np.load(self.iobs)["data"],
+                                          data = output.load_array(self.iobs, ("data",)),
                                           chunks=True,
                                           shuffle=True,
                                           compression="gzip")
                 reciprocal_space.create_dataset("mask",
-                                          data = np.load(self.mask)["mask"],
+                                          data = output.load_array(self.mask, ("mask", "data")),
                                           chunks=True,
                                           shuffle=True,
                                           compression="gzip")
@@ -7,4 +7,4 @@
 Welcome to gwaihir, there is one submodule used for the gui. The terminal scripts used for quick analysis are in the terminal_scripts folder
 """
 
-__all__ = ["correct_angles", "make_support", "preprocess", "strain"]
\ No newline at end of file
+__all__ = ["correct_angles", "make_support", "preprocess", "strain", "out_of_core", "batch", "filtering", "gridding", "output", "masking", "checkpoint"]
\ No newline at end of file
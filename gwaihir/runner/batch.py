@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+Non-interactive preprocessing of a series of scans in parallel.
+
+    parameters = dict(root_folder=..., save_dir=..., ...)  # preprocess_bcdi arguments
+    summary = preprocess_scans(range(1600, 1700), parameters, n_workers=8)
+
+Each scan is preprocessed by preprocess_bcdi in its own worker process, in
+headless mode (figures saved without window, no interactive masking, use
+auto_mask=True in the parameters for the automatic masking), with at most
+n_workers scans at the same time. The output of each scan is written in a
+log file and the status, timings, output files and peak memory of all the scans
+are gathered in a summary table.
+"""
+
+import contextlib
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from gwaihir.runner import preprocess
+
+# Columns of the summary table
+SUMMARY_COLUMNS = [
+    "scan",
+    "status",
+    "start",
+    "duration",
+    "shape",
+    "data_file",
+    "mask_file",
+    "automask_file",
+    "savedir",
+    "peak_memory",
+    "cached_stages",
+    "log_file",
+    "error",
+]
+
+
+def _preprocess_scan(task):
+    """
+    Worker of preprocess_scans, preprocess one scan and return its row of the summary.
+
+    The errors are written in the log file and returned in the row instead of raised.
+    """
+    scan, parameters, log_file = task
+    row = {
+        "scan": scan,
+        "status": "failed",
+        "start": datetime.now().isoformat(timespec="seconds"),
+        "log_file": log_file,
+        "error": None,
+    }
+    start = time.perf_counter()
+    with open(log_file, "w") as log, contextlib.redirect_stdout(log), \
+            contextlib.redirect_stderr(log):
+        try:
+            outputs = preprocess.preprocess_bcdi(
+                scans=(scan,), headless=True, **parameters
+            )
+            row.update((outputs or {}).get(scan, {}))
+            row["status"] = "done"
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+    row["duration"] = time.perf_counter() - start
+    return row
+
+
+def preprocess_scans(
+    scans,
+    parameters,
+    n_workers=None,
+    log_dir=None,
+    summary_file=None,
+):
+    """
+    Preprocess scans in parallel worker processes with preprocess_bcdi.
+
+    :param scans: scan numbers, e.g. range(1600, 1700), without duplicates
+    :param parameters: dictionary of the other arguments of preprocess_bcdi, e.g.
+     the parameters of scripts/run_preprocess_bcdi.py. sample_name can be a list
+     with one name per scan. flag_interact is set to False and reload_previous is
+     not supported. Functions (e.g. linearity_func) must be picklable, i.e. not
+     lambda functions.
+    :param n_workers: maximum number of scans processed at the same time, default is
+     the number of cpus. Each worker holds the data of one scan in memory, use
+     out_of_core=True in the parameters for large stacks. Setting OMP_NUM_THREADS=1
+     avoids the oversubscription of the cores by the numerical libraries.
+    :param log_dir: directory of the log files of the scans, default is
+     save_dir/preprocess_logs or ./preprocess_logs
+    :param summary_file: optional path of a csv file where the summary is saved
+    :return: the summary, a pandas DataFrame with one row per scan
+    """
+    scans = list(scans)
+    duplicates = sorted({scan for scan in scans if scans.count(scan) > 1})
+    if duplicates:
+        # the scans share their output files and log file
+        raise ValueError(f"duplicate scans: {duplicates}")
+    parameters = dict(parameters)
+    parameters.pop("scans", None)
+    parameters.pop("headless", None)
+    if parameters.get("reload_previous"):
+        raise ValueError("reload_previous is not supported in batch mode")
+    parameters["flag_interact"] = False
+    parameters.setdefault("GUI", False)
+    # the scans are already processed in parallel
+    parameters.setdefault("filter_workers", 1)
+
+    sample_name = parameters.pop("sample_name", None)
+    if isinstance(sample_name, (list, tuple)):
+        if len(sample_name) != len(scans):
+            raise ValueError("sample_name should have one name per scan")
+        sample_names = list(sample_name)
+    else:
+        sample_names = [sample_name] * len(scans)
+
+    if log_dir is None:
+        log_dir = os.path.join(parameters.get("save_dir") or os.getcwd(), "preprocess_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    tasks = [
+        (
+            scan,
+            dict(parameters, sample_name=name),
+            os.path.join(log_dir, f"S{scan}_preprocess.log"),
+        )
+        for scan, name in zip(scans, sample_names)
+    ]
+
+    rows = {}
+    print(f"Preprocessing {len(scans)} scans, logs in {log_dir}")
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(_preprocess_scan, task): task for task in tasks}
+        for future in as_completed(futures):
+            scan, _, log_file = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:  # the worker died or the task could not be sent
+                row = {
+                    "scan": scan,
+                    "status": "failed",
+                    "log_file": log_file,
+                    "error": f"{type(e).__name__}: {e}",
+                }
+            rows[scan] = row
+            duration = row.get("duration")
+            print(
+                f"S{scan}: {row['status']}"
+                + (f" in {duration:.1f} s" if duration is not None else "")
+                + (f" ({row['error']})" if row.get("error") else "")
+                + f" [{len(rows)}/{len(scans)}]"
+            )
+
+    summary = pd.DataFrame([rows[scan] for scan in scans], columns=SUMMARY_COLUMNS)
+    summary["peak_memory"] = summary["peak_memory"] / 2**20
+    summary = summary.rename(columns={"duration": "duration_s", "peak_memory": "peak_memory_MB"})
+
+    done = (summary["status"] == "done").sum()
+    print(f"\n{done}/{len(scans)} scans preprocessed")
+    print(summary[["scan", "status", "duration_s", "peak_memory_MB", "shape", "error"]].to_string(index=False))
+    if summary_file:
+        summary.to_csv(summary_file, index=False)
+        print("Summary saved in", summary_file)
+    return summary
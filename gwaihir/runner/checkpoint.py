@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stage checkpoints of preprocess_bcdi.
+
+The preprocessing of a scan is split in named stages (STAGES). The output of
+each stage (data, mask, q values...) is saved in a checkpoint directory under
+a key, the hash of:
+
+    - the content hash of the output of the previous stage (for the first stage,
+      the size and modification time of the raw data files of the scan, see
+      scan_files)
+    - the parameters of the stage
+
+so that a rerun with the same raw data and parameters restores the stages from
+their checkpoints instead of computing them, and restarts from the first stage
+whose inputs or parameters changed, e.g. after a crash or to try another
+filtering:
+
+    checkpoints = Checkpoints(directory)
+    state = checkpoints.restore("filtering", params)
+    if state is None:
+        ...  # compute the stage
+        checkpoints.store("filtering", data=data, mask=mask)
+    else:
+        data, mask = state["data"], state["mask"]
+    print(checkpoints.report())
+
+The checkpoints are written in the "npy" format of gwaihir.runner.output, a
+directory of .npy files written by blocks of frames (the scratch arrays of the
+out-of-core mode are not read in memory), and are restored as copy-on-write
+memory maps, so that restoring a stage which is followed by another restored
+stage does not read its arrays.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import h5py
+import numpy as np
+
+from gwaihir.runner import out_of_core as ooc
+from gwaihir.runner import output
+
+# Stages of preprocess_bcdi, in order
+STAGES = (
+    "load",
+    "gridding",
+    "center_fft",
+    "masking",
+    "filtering",
+    "binning",
+    "save",
+)
+
+
+def _default(value):
+    """JSON encoding of the parameters which are not JSON types"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', value)}"
+    return str(value)
+
+
+def hash_parameters(*args, **params):
+    """Hash of parameters (JSON encoded, with the keys sorted)"""
+    encoded = json.dumps([args, params], sort_keys=True, default=_default)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def fingerprint(*paths):
+    """
+    Fingerprint of files and directories, without reading them.
+
+    :param paths: paths of files or directories (listed recursively), the None or
+     missing paths are ignored
+    :return: list of (path, size, modification time in ns) of the files
+    """
+    files = []
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        if os.path.isfile(path):
+            names = [path]
+        else:
+            names = sorted(
+                os.path.join(root, name)
+                for root, _, filenames in os.walk(path)
+                for name in filenames
+            )
+        for name in names:
+            stat = os.stat(name)
+            files.append((os.path.abspath(name), stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+def scan_files(directory, template, scan_number):
+    """
+    Raw data files of a scan, rather than the whole data directory which may hold
+    the other scans of the beamtime.
+
+    :param directory: data directory of the scan
+    :param template: template of the image files, e.g. "S%05d.nxs" (file of the
+     scan, SIXS, CRISTAL...) or "data_mpx4_%05d.edf.gz" (one file per frame, ID01)
+    :param scan_number: the scan number
+    :return: the sorted list of the paths of the files, empty if none is found
+    """
+    if not directory or not template:
+        return []
+    if "%" in template:
+        try:
+            path = os.path.join(directory, template % scan_number)
+        except (TypeError, ValueError):
+            path = None
+        if path and os.path.isfile(path):
+            return [path]
+        pattern = re.sub(r"%[-+ #0]*\d*d", "*", template)
+    else:
+        pattern = template
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+class Checkpoints:
+    """
+    Checkpoints of the stages of the preprocessing of a scan.
+
+    :param directory: directory of the checkpoints, created if needed. None
+     disables the checkpoints: restore always returns None and store does nothing.
+    :param inputs: fingerprint or hash of the inputs of the first stage
+    :param verbose: True to print the restored and computed stages
+    """
+
+    def __init__(self, directory, inputs=None, verbose=True):
+        self.directory = directory
+        self.verbose = verbose
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.previous = hash_parameters(inputs)  # hash of the inputs of the next stage
+        self.key = None  # key of the current stage
+        self.stage = None
+        self.status = {}  # "cached" or "computed", by stage
+
+    def path(self, stage, key):
+        """Directory of the checkpoint of a stage"""
+        return os.path.join(self.directory, f"{stage}_{key[:16]}")
+
+    def restore(self, stage, params=None, cache=True):
+        """
+        Restore a stage from its checkpoint.
+
+        :param stage: name of the stage, stages must be restored or stored in order
+        :param params: dictionary of the parameters of the stage
+        :param cache: False to compute the stage even with a checkpoint, e.g. for
+         the interactive masking. Its output is still stored for the next stages.
+        :return: the dictionary of the arrays and values of the checkpoint (arrays
+         memory mapped in copy-on-write mode), or None if the stage must be computed
+        """
+        if stage not in STAGES:
+            raise ValueError(f"stage should be one of {STAGES}, got {stage}")
+        self.stage = stage
+        if self.directory is None:
+            return None
+        self.key = hash_parameters(self.previous, stage, params or {})
+        path = self.path(stage, self.key)
+        state = None
+        if cache and os.path.isdir(path):
+            try:
+                state = output.load(path, mmap_mode="c")
+            except (OSError, ValueError):  # incomplete or corrupted checkpoint
+                state = None
+        if state is not None and all(
+            os.path.exists(name) for name in state.get("files", [])
+        ):
+            self.previous = state["hash"]
+            self.status[stage] = "cached"
+            if self.verbose:
+                print(f"\nStage '{stage}' restored from {path}")
+            return state
+        self.status[stage] = "computed"
+        return None
+
+    def store(self, stage, **values):
+        """
+        Save the output of a stage in its checkpoint.
+
+        :param stage: name of the stage, the last one given to restore
+        :param values: arrays (numpy arrays or scratch arrays) and JSON values, by
+         name. files is a list of output files which must exist to restore the stage.
+        :return: the content hash of the output
+        """
+        if stage != self.stage:
+            raise ValueError(f"restore('{stage}') should be called before store")
+        if self.directory is None:
+            return None
+        path = self.path(stage, self.key)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        content = hashlib.sha256()
+        metadata = {}
+        order = []
+        for name, value in values.items():
+            order.append(name)
+            content.update(name.encode())
+            if isinstance(value, h5py.Dataset) or output._is_array(value):
+                _save_array(os.path.join(tmp_path, name + ".npy"), value, content)
+            else:
+                metadata[name] = value
+                content.update(json.dumps(value, default=_default).encode())
+        metadata["hash"] = content.hexdigest()
+        with open(os.path.join(tmp_path, output.METADATA), "w") as f:
+            json.dump(
+                {"order": order + ["hash"], "values": metadata}, f, default=_default
+            )
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)  # the checkpoint is complete or absent
+        self.previous = metadata["hash"]
+        if self.verbose:
+            print(f"\nStage '{stage}' saved in {path}")
+        return metadata["hash"]
+
+    def report(self):
+        """Summary of the cached and computed stages"""
+        cached = [stage for stage, status in self.status.items() if status == "cached"]
+        computed = [
+            stage for stage, status in self.status.items() if status == "computed"
+        ]
+        return (
+            f"Stages restored from the checkpoints: {', '.join(cached) or 'none'}\n"
+            f"Stages computed: {', '.join(computed) or 'none'}"
+        )
+
+
+def _save_array(path, array, content, blocksize=ooc.BLOCK_SIZE):
+    """Save an array in a .npy file by blocks of frames and update its content hash"""
+    if np.ndim(array) < 3:
+        array = np.asarray(array)
+        np.save(path, array)
+        content.update(f"{array.dtype.str}{array.shape}".encode())
+        content.update(np.ascontiguousarray(array).data)
+        return
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=array.dtype, shape=array.shape)
+    content.update(f"{out.dtype.str}{out.shape}".encode())
+    for frames in ooc.frame_slices(array.shape, array.dtype, blocksize=blocksize):
+        block = np.ascontiguousarray(array[frames])
+        out[frames] = block
+        content.update(block.data)
+    out.flush()
+    del out
@@ -20,6 +20,7 @@ import bcdi.preprocessing.preprocessing_utils as pru
 from bcdi.experiment.detector import create_detector
 from bcdi.experiment.setup import Setup
 import bcdi.utils.utilities as util
+from gwaihir.runner import output
 
 
 # Functions used in the gui
@@ -149,9 +150,9 @@ def correct_angles_detector(
         file_path = filedialog.askopenfilename(
             initialdir=detector.scandir + "pynxraw/",
             title="Select 3D data",
-            filetypes=[("NPZ", "*.npz")],
+            filetypes=output.FILETYPES,
         )
-        data = np.load(file_path)["data"]
+        data = output.load_array(file_path, ("data",))
         data = data[detector.roi[0] : detector.roi[1], detector.roi[2] : detector.roi[3]]
         frames_logical = np.ones(data.shape[0]).astype(
             int
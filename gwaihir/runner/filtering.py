@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""
+Frame-parallel filtering stage of preprocess_bcdi.
+
+The isolated pixels filter (pru.mean_filter) and the median filter
+(scipy.signal.medfilt2d) are applied frame by frame, like in the former loop of
+preprocess_bcdi, but the frames are distributed over a pool of workers:
+
+    - processes for the isolated pixels filter, which is written in Python. The
+      frames are shared with the workers through shared memory and each worker
+      filters its frames in place. Shared memory needs Python 3.8, the isolated
+      pixels filter is sequential with older versions.
+    - threads for the median filter, medfilt2d releasing the GIL.
+
+In a worker process (e.g. of gwaihir.runner.batch, which already processes the
+scans in parallel) the frames are filtered sequentially by default, rather than
+in a pool nested in each worker. The caller can also pass its own executor.
+
+Each frame is filtered by the same function as before, so the output is
+identical to the sequential loop. The data and mask can be numpy arrays or the
+scratch arrays of the out-of-core mode, they are processed by blocks of frames.
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+import numpy as np
+import scipy.signal  # for medfilt2d
+import bcdi.preprocessing.preprocessing_utils as pru
+
+from gwaihir.runner import out_of_core as ooc
+
+FILTERS = {"mask_isolated", "interp_isolated", "median"}
+
+
+def mean_filter_frame(data, mask, nb_neighbours, interpolate, debugging=False):
+    """
+    Isolated pixels filter of one frame, same call as in preprocess_bcdi.
+
+    :return: the filtered frame, its mask and the number of filtered pixels
+    """
+    data, processed_pix, mask = pru.mean_filter(
+        data=data,
+        nb_neighbours=nb_neighbours,
+        mask=mask,
+        interpolate=interpolate,
+        min_count=3,
+        debugging=debugging,
+    )
+    return data, mask, processed_pix
+
+
+def median_filter_frame(data, mask):
+    """
+    Median filter of one frame, same call as in preprocess_bcdi.
+
+    :return: the filtered frame, its mask and 0 filtered pixels
+    """
+    return scipy.signal.medfilt2d(data, [3, 3]), mask, 0
+
+
+def _filter(func, data, mask, indices):
+    """Filter the frames of data and mask at the given indices, in place."""
+    processed_pix = []
+    for idx in indices:
+        data[idx], mask[idx], nb_pix = func(data[idx], mask[idx])
+        processed_pix.append(nb_pix)
+    return processed_pix
+
+
+def _filter_shared(func, data_spec, mask_spec, indices):
+    """Worker process: attach to the shared frames and filter them in place."""
+    blocks = [
+        shared_memory.SharedMemory(name=name) for name, _, _ in (data_spec, mask_spec)
+    ]
+    views = [
+        np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        for block, (_, shape, dtype) in zip(blocks, (data_spec, mask_spec))
+    ]
+    try:
+        return _filter(func, *views, indices)
+    finally:
+        del views  # the views must be released before closing the blocks
+        for block in blocks:
+            block.close()
+
+
+def _to_shared(array):
+    """Copy an array in a new shared memory block, return the block and the view."""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return block, shared
+
+
+def filter_frames(
+    data,
+    mask,
+    method,
+    start=0,
+    stop=None,
+    nb_neighbours=None,
+    n_workers=None,
+    debugging=False,
+    blocksize=ooc.BLOCK_SIZE,
+    executor=None,
+):
+    """
+    Filter the frames of the data and mask in place, in parallel.
+
+    :param data: 3D array, frames along axis 0, numpy array or scratch array
+    :param mask: 3D array of the same shape
+    :param method: 'mask_isolated' or 'interp_isolated' for pru.mean_filter,
+     'median' for scipy.signal.medfilt2d
+    :param start: first frame to filter
+    :param stop: last frame (excluded), default is the number of frames
+    :param nb_neighbours: minimum number of non-zero neighbours, for mean_filter
+    :param n_workers: number of workers, default is the number of cpus (1 in a worker
+     process), 1 to filter the frames in the current process. It is set to 1 with
+     debugging, which shows plots, and for the worker processes without shared
+     memory (Python < 3.8). With an executor, it only sets the number of chunks of
+     frames.
+    :param debugging: debugging option of pru.mean_filter
+    :param blocksize: approximate size in bytes of the blocks of frames shared with
+     the workers
+    :param executor: optional executor of the caller used instead of a new pool, it
+     is not shut down. The frames are shared through shared memory with a
+     ProcessPoolExecutor and filtered in place with other executors (threads).
+    :return: the total number of filtered pixels
+    """
+    if method not in FILTERS:
+        raise ValueError(f"method should be one of {sorted(FILTERS)}, got {method}")
+    stop = data.shape[0] if stop is None else stop
+    if debugging:
+        n_workers, executor = 1, None
+    elif not n_workers:
+        # no pool nested in the workers of a pool, e.g. of gwaihir.runner.batch
+        if multiprocessing.current_process().name != "MainProcess":
+            n_workers = 1
+        else:
+            n_workers = os.cpu_count() or 1
+
+    if method == "median":
+        func = median_filter_frame
+        pool = ThreadPoolExecutor
+    else:
+        func = partial(
+            mean_filter_frame,
+            nb_neighbours=nb_neighbours,
+            interpolate=method,
+            debugging=debugging,
+        )
+        pool = ProcessPoolExecutor
+    if shared_memory is None and (
+        pool is ProcessPoolExecutor or isinstance(executor, ProcessPoolExecutor)
+    ):
+        # the frames cannot be shared with worker processes
+        n_workers, executor = 1, None
+    owned = executor is None and n_workers > 1
+    if owned:
+        executor = pool(max_workers=n_workers)
+
+    nb_pix = 0
+    nb_frames = max(stop - start, 0)
+    begin = time.perf_counter()
+    try:
+        for frames in ooc.frame_slices(data.shape, data.dtype, start, stop, blocksize):
+            data_block = np.asarray(data[frames])
+            mask_block = np.asarray(mask[frames])
+            indices = np.arange(frames.stop - frames.start)
+            chunks = np.array_split(indices, min(len(indices), 4 * n_workers))
+
+            if executor is None:
+                processed_pix = _filter(func, data_block, mask_block, indices)
+            elif not isinstance(executor, ProcessPoolExecutor):
+                processed_pix = sum(
+                    executor.map(
+                        partial(_filter, func, data_block, mask_block), chunks
+                    ),
+                    [],
+                )
+            else:
+                blocks, views = zip(
+                    *(_to_shared(block) for block in (data_block, mask_block))
+                )
+                try:
+                    specs = [
+                        (block.name, view.shape, view.dtype.str)
+                        for block, view in zip(blocks, views)
+                    ]
+                    processed_pix = sum(
+                        executor.map(partial(_filter_shared, func, *specs), chunks),
+                        [],
+                    )
+                    data_block, mask_block = [np.array(view) for view in views]
+                finally:
+                    del views  # the views must be released before closing the blocks
+                    for block in blocks:
+                        block.close()
+                        block.unlink()
+
+            data[frames] = data_block
+            mask[frames] = mask_block
+            nb_pix += sum(processed_pix)
+            sys.stdout.write(
+                f"\rFrame {frames.stop - 1}, number of filtered pixels: {nb_pix}"
+            )
+            sys.stdout.flush()
+    finally:
+        if owned:
+            executor.shutdown()
+
+    duration = time.perf_counter() - begin
+    print(
+        f"\nFiltered {nb_frames} frames in {duration:.1f} s"
+        f" ({nb_frames / max(duration, 1e-9):.1f} frames/s, {n_workers} workers)"
+    )
+    return nb_pix
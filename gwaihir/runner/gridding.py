@@ -0,0 +1,605 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cached gridding of the BCDI data in the orthonormal laboratory frame.
+
+The linearization of preprocess_bcdi (bcdi Setup.ortho_reciprocal) interpolates
+the detector frame data linearly on a regular q grid, defined by a
+transformation matrix calculated from the geometry of the scan. The
+interpolation is a linear operator which only depends on this geometry: it is
+calculated once as a sparse matrix of interpolation weights (8 per voxel of the
+q grid) and saved with the transformation matrix and the q values in a cache
+directory, under a hash of the geometry (setup, detector ROI and binning,
+angles, energy, detector distance and shape of the data). The following runs
+on the same scan, e.g. with a different masking, only apply the sparse matrix to
+the data and to the mask.
+
+The sparse matrix is wrapped in a Regridder, which grids the data, the mask
+and any other channel with one sparse matrix-vector product each, by blocks of
+rows in parallel threads:
+
+    regridder = Regridder.linearization(transfer_matrix, q_values, data.shape)
+    data, mask = regridder(data, mask, fill_value=(0, 1))
+
+    data, mask, q_values = grid_labframe(data, mask, detector, setup, cache_dir)
+
+The q values of the Regridder are relative to the center of the data, in 1/nm.
+grid_labframe returns the q values of pru.grid_bcdi_labframe, with the offset
+due to the detector angles and in 1/A.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy import sparse
+
+import bcdi.graph.graph_utils as gu
+import bcdi.utils.utilities as util
+
+# Version of the cached operators, part of the hash
+CACHE_VERSION = 2
+
+
+def _update_hash(sha, item):
+    """Feed an item (number, string, array or container of items) to a hash."""
+    if isinstance(item, dict):
+        for key in sorted(item):
+            _update_hash(sha, key)
+            _update_hash(sha, item[key])
+    elif isinstance(item, (list, tuple)):
+        sha.update(f"<{type(item).__name__} {len(item)}>".encode())
+        for value in item:
+            _update_hash(sha, value)
+    elif isinstance(item, np.ndarray) and item.ndim > 0:
+        item = np.ascontiguousarray(item)
+        sha.update(f"<array {item.dtype.str} {item.shape}>".encode())
+        sha.update(item.tobytes())
+    elif isinstance(item, (float, np.floating)):
+        sha.update(float(item).hex().encode())
+    else:
+        sha.update(repr(item.item() if isinstance(item, np.generic) else item).encode())
+    sha.update(b";")
+
+
+def _unbinned_pixel_size(detector):
+    """Unbinned pixel size of the detector (vertical, horizontal) in meters."""
+    pixel_size = getattr(detector, "unbinned_pixel_size", None)
+    if pixel_size is None:  # former name in bcdi
+        pixel_size = detector.unbinned_pixel
+    return tuple(pixel_size)
+
+
+def _transformation(setup, **kwargs):
+    """Transformation matrix and q offset of the linearization (bcdi Setup)."""
+    transformation = getattr(setup, "transformation_bcdi", None)
+    if transformation is None:  # former name in bcdi
+        transformation = setup.transformation_matrix
+    return transformation(**kwargs)
+
+
+def geometry_key(setup, detector, shape, **options):
+    """
+    Hash of the geometry defining the gridding of the data.
+
+    :param setup: instance of bcdi Setup, with the angles of the scan
+    :param detector: instance of bcdi Detector
+    :param shape: shape of the data in the detector frame
+    :param options: other parameters of the gridding, e.g. align_q
+    :return: the hexadecimal sha256 hash
+    """
+    geometry = {
+        "version": CACHE_VERSION,
+        "beamline": str(getattr(setup.beamline, "name", setup.beamline)),
+        "rocking_angle": setup.rocking_angle,
+        "energy": np.asarray(setup.energy, dtype=float),
+        "distance": setup.distance,
+        "outofplane_angle": setup.outofplane_angle,
+        "inplane_angle": setup.inplane_angle,
+        "tilt_angle": setup.tilt_angle,
+        "grazing_angle": setup.grazing_angle,
+        "beam_direction": np.asarray(setup.beam_direction, dtype=float),
+        "detector": str(getattr(detector, "name", "")),
+        "roi": list(detector.roi),
+        "binning": list(detector.binning),
+        "preprocessing_binning": list(detector.preprocessing_binning),
+        "pixel_size": _unbinned_pixel_size(detector),
+        "shape": tuple(int(val) for val in shape),
+        "options": options,
+    }
+    sha = hashlib.sha256()
+    _update_hash(sha, geometry)
+    return sha.hexdigest()
+
+
+def linearization_geometry(
+    setup, detector, shape, align_q=False, reference_axis=(0, 1, 0), verbose=True
+):
+    """
+    Transformation matrix and q grid of the linearization.
+
+    Same calculation as bcdi Setup.ortho_reciprocal.
+
+    :param setup: instance of bcdi Setup, with the angles of the scan
+    :param detector: instance of bcdi Detector
+    :param shape: shape of the data in the detector frame
+    :param align_q: True to rotate the q grid so that q is along reference_axis
+    :param reference_axis: 3D vector in the order x y z
+    :param verbose: True to print the sampling and shapes
+    :return: the transformation matrix from the detector frame to the
+     laboratory/crystal frame (1/nm), the q offset (x, y, z order, 1/nm) and the
+     q values (qx, qz, qy) of the output grid, relative to the center of the data
+     (1/nm), see labframe_q_values
+    """
+    if setup.rocking_angle == "energy":
+        raise NotImplementedError(
+            "Geometric transformation not yet implemented for energy scans"
+        )
+    nbz, nby, nbx = shape
+    pixel_y, pixel_x = _unbinned_pixel_size(detector)
+    transfer_matrix, q_offset = _transformation(
+        setup,
+        array_shape=shape,
+        tilt_angle=setup.tilt_angle * detector.preprocessing_binning[0],
+        direct_space=False,
+        verbose=verbose,
+        pixel_x=pixel_x,
+        pixel_y=pixel_y,
+    )
+
+    # q coordinates of the data points, only their extent is used
+    myz, myy, myx = np.meshgrid(
+        np.arange(-nbz // 2, nbz // 2, 1),
+        np.arange(-nby // 2, nby // 2, 1),
+        np.arange(-nbx // 2, nbx // 2, 1),
+        indexing="ij",
+        sparse=True,
+    )
+
+    def q_extent(matrix):
+        extent = []
+        for row in matrix:  # along x, y, z
+            q_along = row[0] * myx + row[1] * myy + row[2] * myz
+            extent.append(
+                int(np.rint((q_along.max() - q_along.min()) / np.linalg.norm(row)))
+            )
+        return extent
+
+    nx_output, ny_output, nz_output = q_extent(transfer_matrix)
+
+    if align_q:
+        # q at the center of the array (x, y, z), where the Bragg peak should be
+        center = np.array([-nb // 2 + nb // 2 for nb in (nbx, nby, nbz)])
+        q_com = transfer_matrix @ center + np.asarray(q_offset)
+        qnorm = np.linalg.norm(q_com)
+        if verbose:
+            print(f"\nAligning Q along {reference_axis} (x,y,z)")
+        rotation_matrix = util.rotation_matrix_3d(
+            axis_to_align=np.asarray(reference_axis),
+            reference_axis=q_com / qnorm,
+        )
+        transfer_matrix = np.matmul(rotation_matrix, transfer_matrix)
+        offset_crystal = util.rotate_vector(
+            vectors=q_offset,
+            axis_to_align=np.asarray(reference_axis),
+            reference_axis=q_com / qnorm,
+        )
+        q_offset = offset_crystal[::-1]  # offset_crystal is in the order z, y, x
+        nx_output, ny_output, nz_output = q_extent(transfer_matrix)
+
+    # crop the output shape in order to fit FFT requirements
+    nz_output, ny_output, nx_output = util.smaller_primes(
+        (nz_output, ny_output, nx_output), maxprime=7, required_dividers=(2,)
+    )
+    dq_along_x, dq_along_y, dq_along_z = np.linalg.norm(transfer_matrix, axis=1)
+    if verbose:
+        print(
+            f"\nSampling in q (z*, y*, x*): ({dq_along_z:.5f} 1/nm,"
+            f" {dq_along_y:.5f} 1/nm, {dq_along_x:.5f} 1/nm)"
+            f"\nInitial shape = {tuple(shape)}"
+            f"\nOutput shape  = ({nz_output},{ny_output},{nx_output})"
+        )
+    qx = np.arange(-nz_output // 2, nz_output // 2, 1) * dq_along_z
+    qz = np.arange(-ny_output // 2, ny_output // 2, 1) * dq_along_y
+    qy = np.arange(-nx_output // 2, nx_output // 2, 1) * dq_along_x
+    return transfer_matrix, np.asarray(q_offset), (qx, qz, qy)
+
+
+def labframe_q_values(q_values, q_offset):
+    """
+    Q values in the laboratory/crystal frame, as returned by bcdi.
+
+    Same conversion as at the end of bcdi Setup.ortho_reciprocal.
+
+    :param q_values: q values (qx, qz, qy) of the grid relative to the center of
+     the data (1/nm), see linearization_geometry
+    :param q_offset: q offset due to the detector angles (x, y, z order, 1/nm)
+    :return: the q values (qx, qz, qy) with the offset, in 1/A
+    """
+    qx, qz, qy = q_values
+    return (
+        (qx + q_offset[2]) / 10,  # along z downstream
+        (qz + q_offset[1]) / 10,  # along y vertical up
+        (qy + q_offset[0]) / 10,  # along x outboard
+    )
+
+
+class Regridder:
+    """
+    Sparse regridding engine from the detector frame to the orthonormal q grid.
+
+    The interpolation is a CSR matrix of shape (size of the q grid, size of the
+    data) built once, each array (data, mask or any other channel) is then
+    gridded with one sparse matrix-vector product. The rows of the matrix are
+    split in blocks of similar number of weights, applied in parallel threads
+    (the scipy product releases the GIL).
+
+    :param weights: CSR matrix of the interpolation weights
+    :param outside: boolean array, True for the voxels of the q grid outside of
+     the data, which are set to the fill value
+    :param output_shape: shape of the q grid
+    """
+
+    def __init__(self, weights, outside, output_shape):
+        self.weights = sparse.csr_matrix(weights)
+        self.outside = np.asarray(outside, dtype=bool)
+        self.output_shape = tuple(int(val) for val in output_shape)
+        if self.weights.shape[0] != int(np.prod(self.output_shape)):
+            raise ValueError("the weights do not match the output shape")
+        self._blocks = {}
+
+    @classmethod
+    def linearization(cls, transfer_matrix, q_values, shape, blocksize=2**20):
+        """
+        Linear interpolation of the data on the q grid of the linearization.
+
+        The voxels of the q grid are expressed in the detector frame with the
+        inverse of the transformation matrix and interpolated linearly between the
+        8 surrounding voxels of the data, like scipy RegularGridInterpolator in
+        bcdi Setup.ortho_reciprocal.
+
+        :param transfer_matrix: transformation matrix from the detector frame to
+         the laboratory/crystal frame
+        :param q_values: q values (qx, qz, qy) of the output grid
+        :param shape: shape of the data in the detector frame
+        :param blocksize: approximate number of voxels of the q grid processed at a
+         time
+        :return: a Regridder instance
+        """
+        qx, qz, qy = q_values
+        output_shape = (len(qx), len(qz), len(qy))
+        size = int(np.prod(output_shape))
+        input_size = int(np.prod(shape))
+        transfer_imatrix = np.linalg.inv(transfer_matrix)
+        # first coordinate of the data grid along z, y, x
+        origin = np.array([-nb // 2 for nb in shape], dtype=float)
+        upper = np.array(shape) - 1
+        # offsets of the 8 neighbours in the flattened data, sorted
+        offsets = np.ravel_multi_index(np.array(list(np.ndindex(2, 2, 2))).T, shape)
+
+        # contributions of qx, qz and qy to the indices in the data (z, y, x),
+        # the transformation is x y z ordered
+        along_z = transfer_imatrix[::-1, 2, None] * qx - origin[:, None]
+        along_y = transfer_imatrix[::-1, 1, None] * qz
+        along_x = transfer_imatrix[::-1, 0, None] * qy
+
+        def positions(planes):
+            """Indices in the data (z, y, x) of the voxels of planes of the q grid"""
+            position = (
+                along_z[:, planes, None, None]
+                + along_y[:, None, :, None]
+                + along_x[:, None, None, :]
+            ).reshape(3, -1)
+            return position, np.any(
+                (position < 0) | (position > upper[:, None]), axis=0
+            )
+
+        # blocks of planes of the q grid along qx
+        step = max(1, blocksize // (output_shape[1] * output_shape[2]))
+        blocks = [
+            slice(start, min(start + step, output_shape[0]))
+            for start in range(0, output_shape[0], step)
+        ]
+        # first pass for the number of weights, 8 per voxel inside the data
+        outside = np.concatenate([positions(planes)[1] for planes in blocks])
+        index_dtype = np.int32 if max(input_size, 8 * size) < 2**31 else np.int64
+        indptr = np.zeros(size + 1, dtype=index_dtype)
+        np.cumsum(np.where(outside, 0, 8), out=indptr[1:])
+        data = np.empty(indptr[-1], dtype=float)
+        indices = np.empty(indptr[-1], dtype=index_dtype)
+
+        plane_size = output_shape[1] * output_shape[2]
+        for planes in blocks:
+            position, out = positions(planes)
+            position = position[:, ~out]
+            # lower neighbour as in RegularGridInterpolator and fractional position
+            lower = np.clip(np.ceil(position).astype(int) - 1, 0, upper[:, None] - 1)
+            # weights of the neighbours along each axis, (n, 2)
+            wz, wy, wx = (
+                np.stack([1 - frac, frac], axis=1) for frac in position - lower
+            )
+            first = indptr[planes.start * plane_size]
+            last = indptr[planes.stop * plane_size]
+            data[first:last].reshape(-1, 2, 2, 2)[...] = (
+                wz[:, :, None, None] * wy[:, None, :, None] * wx[:, None, None, :]
+            )
+            # the weights of each row are sorted by column
+            indices[first:last].reshape(-1, 8)[...] = (
+                np.ravel_multi_index(tuple(lower), shape)[:, None] + offsets
+            )
+
+        # the zero weights are kept, nan values propagate like in the interpolator
+        weights = sparse.csr_matrix(
+            (data, indices, indptr), shape=(size, input_size), copy=False
+        )
+        return cls(weights, outside, output_shape)
+
+    def _row_blocks(self, n_blocks):
+        """Row blocks of the weights with similar numbers of weights (views)."""
+        if n_blocks not in self._blocks:
+            indptr = self.weights.indptr
+            bounds = np.searchsorted(
+                indptr, np.linspace(0, indptr[-1], n_blocks + 1), side="left"
+            )
+            bounds[0], bounds[-1] = 0, len(indptr) - 1
+            blocks = []
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                if last <= first:
+                    continue
+                start, stop = indptr[first], indptr[last]
+                block = sparse.csr_matrix(
+                    (
+                        self.weights.data[start:stop],
+                        self.weights.indices[start:stop],
+                        indptr[first : last + 1] - start,
+                    ),
+                    shape=(last - first, self.weights.shape[1]),
+                    copy=False,
+                )
+                blocks.append((slice(first, last), block))
+            self._blocks[n_blocks] = blocks
+        return self._blocks[n_blocks]
+
+    def apply(self, array, fill_value=0, n_workers=None, executor=None):
+        """
+        Grid one array.
+
+        :param array: array of the data shape in the detector frame
+        :param fill_value: value of the voxels outside of the data
+        :param n_workers: number of threads, default is the number of cpus
+        :param executor: optional ThreadPoolExecutor to use
+        :return: the gridded array (float)
+        """
+        vector = np.asarray(array, dtype=float).reshape(-1)
+        if vector.size != self.weights.shape[1]:
+            raise ValueError(
+                f"array of size {vector.size}, expected {self.weights.shape[1]}"
+            )
+        n_workers = n_workers or os.cpu_count() or 1
+        result = np.empty(self.weights.shape[0])
+        if n_workers == 1 and executor is None:
+            result[:] = self.weights @ vector
+        else:
+
+            def product(item):
+                rows, block = item
+                result[rows] = block @ vector
+
+            blocks = self._row_blocks(4 * n_workers)
+            if executor is None:
+                with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                    list(executor.map(product, blocks))
+            else:
+                list(executor.map(product, blocks))
+        result[self.outside] = fill_value
+        return result.reshape(self.output_shape)
+
+    def __call__(self, *arrays, fill_value=0, n_workers=None):
+        """
+        Grid several arrays, e.g. the data, the mask and other channels.
+
+        :param arrays: arrays of the data shape in the detector frame
+        :param fill_value: value of the voxels outside of the data, one for all
+         the arrays or one per array
+        :param n_workers: number of threads, default is the number of cpus
+        :return: the list of gridded arrays
+        """
+        if np.ndim(fill_value) == 0:
+            fill_value = [fill_value] * len(arrays)
+        if len(fill_value) != len(arrays):
+            raise ValueError("fill_value should have one value per array")
+        n_workers = n_workers or os.cpu_count() or 1
+        if n_workers == 1:
+            return [
+                self.apply(array, fill, n_workers=1)
+                for array, fill in zip(arrays, fill_value)
+            ]
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return [
+                self.apply(array, fill, n_workers=n_workers, executor=executor)
+                for array, fill in zip(arrays, fill_value)
+            ]
+
+
+class GriddingCache:
+    """
+    Directory of cached gridding operators, one npz file per geometry key.
+
+    :param directory: path of the cache directory, created if needed
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """Path of the cache file of a geometry key."""
+        return os.path.join(self.directory, f"gridding_{key[:32]}.npz")
+
+    def load(self, key):
+        """
+        Load the cached operator of a geometry key.
+
+        :return: a dictionary with the transfer_matrix, q_offset, q_values and
+         regridder (a Regridder instance), None if not cached
+        """
+        try:
+            with np.load(self.path(key)) as npz:
+                if str(npz["key"]) != key:  # truncated key collision
+                    return None
+                output_shape = npz["output_shape"]
+                weights = sparse.csr_matrix(
+                    (npz["data"], npz["indices"], npz["indptr"]),
+                    shape=(
+                        int(np.prod(output_shape)),
+                        int(np.prod(npz["input_shape"])),
+                    ),
+                    copy=False,
+                )
+                return {
+                    "transfer_matrix": npz["transfer_matrix"],
+                    "q_offset": npz["q_offset"],
+                    "q_values": (npz["qx"], npz["qz"], npz["qy"]),
+                    "regridder": Regridder(weights, npz["outside"], output_shape),
+                }
+        except (OSError, KeyError, ValueError) as e:
+            if os.path.isfile(self.path(key)):
+                print(f"Could not read the gridding cache {self.path(key)}: {e}")
+            return None
+
+    def save(self, key, entry, input_shape):
+        """Save the operator of a geometry key, see load for the entry."""
+        qx, qz, qy = entry["q_values"]
+        regridder = entry["regridder"]
+        weights = regridder.weights
+        path = self.path(key)
+        # write to a temporary file first, runs may share the cache
+        tmp_path = path[:-4] + f".{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            key=key,
+            transfer_matrix=entry["transfer_matrix"],
+            q_offset=entry["q_offset"],
+            qx=qx,
+            qz=qz,
+            qy=qy,
+            output_shape=regridder.output_shape,
+            input_shape=input_shape,
+            data=weights.data,
+            indices=weights.indices,
+            indptr=weights.indptr,
+            outside=regridder.outside,
+        )
+        os.replace(tmp_path, path)
+        return path
+
+
+def grid_labframe(
+    data,
+    mask,
+    detector,
+    setup,
+    cache_dir=None,
+    align_q=False,
+    reference_axis=(0, 1, 0),
+    fill_value=(0, 0),
+    n_workers=None,
+    verbose=True,
+):
+    """
+    Grid the data and mask in the laboratory frame with the sparse linearization.
+
+    Replaces pru.grid_bcdi_labframe. The Regridder is loaded from cache_dir if the
+    geometry was already gridded, otherwise it is calculated and saved there.
+
+    :param data: the 3D data, already binned in the detector frame
+    :param mask: the corresponding 3D mask
+    :param detector: instance of bcdi Detector
+    :param setup: instance of bcdi Setup, with the angles of the scan
+    :param cache_dir: directory of the gridding cache, None to calculate the
+     Regridder without saving it
+    :param align_q: True to rotate the data so that q is along reference_axis
+    :param reference_axis: 3D vector in the order x y z
+    :param fill_value: values of the data and mask outside of the data range
+    :param n_workers: number of threads of the sparse products, default is the
+     number of cpus
+    :param verbose: True to print comments
+    :return: the data and mask in the laboratory frame and the q values
+     (qx, qz, qy) in 1/A, like pru.grid_bcdi_labframe
+    """
+    key = geometry_key(
+        setup,
+        detector,
+        data.shape,
+        method="linearization",
+        align_q=align_q,
+        reference_axis=np.asarray(reference_axis, dtype=float),
+    )
+    cache = GriddingCache(cache_dir) if cache_dir else None
+    entry = cache.load(key) if cache else None
+    if entry is not None:
+        print(f"\nGridding with the cached operator {cache.path(key)}")
+    else:
+        print(
+            "\nCalculating the sparse gridding operator,"
+            " the result will be in the laboratory frame"
+        )
+        transfer_matrix, q_offset, q_values = linearization_geometry(
+            setup,
+            detector,
+            data.shape,
+            align_q=align_q,
+            reference_axis=reference_axis,
+            verbose=verbose,
+        )
+        entry = {
+            "transfer_matrix": transfer_matrix,
+            "q_offset": q_offset,
+            "q_values": q_values,
+            "regridder": Regridder.linearization(
+                transfer_matrix, q_values, data.shape
+            ),
+        }
+        if cache:
+            print(f"Gridding operator saved in {cache.save(key, entry, data.shape)}")
+
+    interp_data, interp_mask = entry["regridder"](
+        data, mask, fill_value=fill_value, n_workers=n_workers
+    )
+
+    # same post-processing as pru.grid_bcdi_labframe
+    interp_mask[np.isnan(interp_data)] = 1
+    interp_data[np.isnan(interp_data)] = 0
+    interp_mask[np.isnan(interp_mask)] = 1
+    interp_mask[np.nonzero(interp_mask)] = 1
+    interp_mask = interp_mask.astype(int)
+    interp_data[np.nonzero(interp_mask)] = 0
+
+    numz, numy, numx = interp_data.shape
+    final_binning = [
+        detector.preprocessing_binning[idx] * detector.binning[idx] for idx in range(3)
+    ]
+    fig, _, _ = gu.multislices_plot(
+        interp_data,
+        sum_frames=True,
+        scale="log",
+        plot_colorbar=True,
+        vmin=0,
+        title="Regridded data",
+        is_orthogonal=True,
+        reciprocal_space=True,
+    )
+    fig.savefig(
+        detector.savedir
+        + f"linmat_reciprocal_space_sum_pix_{numz}_{numy}_{numx}_"
+        + "_".join(str(val) for val in final_binning)
+        + ".png"
+    )
+    plt.close(fig)
+    return (
+        interp_data,
+        interp_mask,
+        labframe_q_values(entry["q_values"], entry["q_offset"]),
+    )
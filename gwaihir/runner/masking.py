@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""
+Automatic masking of preprocess_bcdi, for the headless and batch runs.
+
+    mask, report = auto_mask(data, mask)
+
+Replaces the interactive alien removal and masking of preprocess_bcdi (or
+prepares it) with two detections on the whole 3D array:
+
+    - detector gaps: the pixels without intensity along the whole axis 0 (the
+      rocking curve for data in the detector frame) are labelled in connected
+      components in the 2D projection. The thin components (stripes of width at
+      most max_gap_width) of at least min_gap_size pixels are masked in all the
+      frames.
+    - aliens: the voxels above a threshold in log-intensity are labelled in
+      connected components. The diffraction pattern is nearly centrosymmetric
+      about the Bragg peak (Friedel's law), so the fringes and speckles of the
+      crystal have a counterpart of similar intensity at the opposite position,
+      while aliens (parasitic scattering, hot pixels) do not. The components
+      (other than the one of the Bragg peak) whose intensity is symmetry_ratio
+      times larger than the intensity around the mirrored voxels are masked.
+      The masked voxels (including the gaps) are not used in this comparison.
+
+The detection only depends on the arrays and the parameters, so the mask is
+the same for every run and can be saved with the other outputs.
+"""
+
+import numpy as np
+from scipy import ndimage
+
+# 26-connectivity in 3D, 8-connectivity in 2D
+STRUCTURE_3D = np.ones((3, 3, 3), dtype=bool)
+STRUCTURE_2D = np.ones((3, 3), dtype=bool)
+
+
+def mirror(array, center, fill_value=np.nan):
+    """
+    Centrosymmetric image of an array about a voxel.
+
+    :param array: 3D array
+    :param center: indices (z, y, x) of the center of symmetry
+    :param fill_value: value of the voxels whose mirror is outside of the array
+    :return: array of the same shape, out[r] = array[2 * center - r]
+    """
+    flipped = array[::-1, ::-1, ::-1]
+    out = np.full(array.shape, fill_value, dtype=np.result_type(array, fill_value))
+    src, dst = [], []
+    for size, idx in zip(array.shape, center):
+        # out[i] = array[2 * idx - i] = flipped[size - 1 - 2 * idx + i]
+        shift = size - 1 - 2 * int(idx)
+        dst.append(slice(max(-shift, 0), size - max(shift, 0)))
+        src.append(slice(max(shift, 0), size - max(-shift, 0)))
+    out[tuple(dst)] = flipped[tuple(src)]
+    return out
+
+
+def detect_aliens(
+    data,
+    mask=None,
+    threshold=1.0,
+    symmetry_ratio=10.0,
+    min_mirror_fraction=0.5,
+    dilation=1,
+    center=None,
+):
+    """
+    Mask of the aliens, bright regions without centrosymmetric counterpart.
+
+    :param data: 3D array of intensities
+    :param mask: 3D array, 1 for the voxels already masked (ignored)
+    :param threshold: threshold in log10(1 + intensity) of the components
+    :param symmetry_ratio: a component is an alien if its intensity is larger than
+     symmetry_ratio times the intensity of its mirror about the Bragg peak
+    :param min_mirror_fraction: minimum fraction of the voxels of a component whose
+     mirror is inside the array and not masked, the components with a smaller
+     fraction are kept (the symmetry cannot be checked)
+    :param dilation: number of voxels added around the aliens
+    :param center: indices of the Bragg peak, default is the maximum of the data
+    :return: the boolean mask of the aliens and a dictionary of statistics
+    """
+    valid = np.ones(data.shape, dtype=bool) if mask is None else mask == 0
+    intensity = np.where(valid, data, 0)
+    if center is None:
+        center = np.unravel_index(np.argmax(intensity), data.shape)
+    labels, nb_components = ndimage.label(
+        np.log10(1 + np.clip(intensity, 0, None)) > threshold, structure=STRUCTURE_3D
+    )
+    aliens = np.zeros(data.shape, dtype=bool)
+    stats = {"center": tuple(int(val) for val in center), "components": nb_components}
+    if nb_components == 0:
+        stats["aliens"] = stats["unchecked"] = 0
+        return aliens, stats
+
+    mirrored = mirror(np.where(valid, intensity, np.nan), center)
+    checked = ~np.isnan(mirrored)
+    index = np.arange(1, nb_components + 1)
+    sizes = ndimage.sum_labels(np.ones(data.shape), labels, index)
+    fraction = ndimage.sum_labels(checked, labels, index) / sizes
+    # intensities of the components and of their mirrors, on the checked voxels.
+    # The mirror is the maximum in the neighbourhood of the mirrored voxel, for
+    # the center on the grid and the shot noise of the weak fringes.
+    own = ndimage.sum_labels(np.where(checked, intensity, 0), labels, index)
+    other = ndimage.sum_labels(
+        np.where(
+            checked,
+            ndimage.maximum_filter(np.nan_to_num(mirrored), footprint=STRUCTURE_3D),
+            0,
+        ),
+        labels,
+        index,
+    )
+
+    is_alien = (fraction >= min_mirror_fraction) & (own > symmetry_ratio * other)
+    if labels[tuple(center)] > 0:  # the Bragg peak itself, unless below threshold
+        is_alien[labels[tuple(center)] - 1] = False
+    aliens = is_alien[labels - 1] & (labels > 0)
+    if dilation and is_alien.any():
+        aliens = ndimage.binary_dilation(
+            aliens, structure=STRUCTURE_3D, iterations=dilation
+        )
+    stats["aliens"] = int(is_alien.sum())
+    stats["unchecked"] = int((fraction < min_mirror_fraction).sum())
+    return aliens, stats
+
+
+def detect_gaps(data, mask=None, min_gap_size=10, max_gap_width=10, dilation=1):
+    """
+    Mask of the detector gaps, thin regions without intensity in all the frames.
+
+    :param data: 3D array of intensities, frames along axis 0
+    :param mask: 3D array, 1 for the voxels already masked
+    :param min_gap_size: minimum number of pixels of a gap
+    :param max_gap_width: maximum width in pixels of a gap (smallest side of its
+     bounding box), larger empty regions are not gaps
+    :param dilation: number of pixels added around the gaps
+    :return: the boolean mask of the gaps (2D, same for all the frames) and a
+     dictionary of statistics
+    """
+    empty = np.sum(data, axis=0) == 0
+    if mask is not None:
+        empty &= np.all(mask == 0, axis=0)  # already masked pixels are not gaps
+    labels, nb_components = ndimage.label(empty, structure=STRUCTURE_2D)
+    gaps = np.zeros(empty.shape, dtype=bool)
+    if nb_components == 0:
+        return gaps, {"gaps": 0}
+
+    index = np.arange(1, nb_components + 1)
+    sizes = ndimage.sum_labels(empty, labels, index)
+    widths = np.array(
+        [min(sl.stop - sl.start for sl in box) for box in ndimage.find_objects(labels)]
+    )
+    is_gap = (sizes >= min_gap_size) & (widths <= max_gap_width)
+    gaps = is_gap[labels - 1] & (labels > 0)
+    if dilation and is_gap.any():
+        gaps = ndimage.binary_dilation(gaps, structure=STRUCTURE_2D, iterations=dilation)
+    return gaps, {"gaps": int(is_gap.sum())}
+
+
+def auto_mask(
+    data,
+    mask=None,
+    threshold=1.0,
+    symmetry_ratio=10.0,
+    min_mirror_fraction=0.5,
+    alien_dilation=1,
+    gaps=True,
+    min_gap_size=10,
+    max_gap_width=10,
+    gap_dilation=1,
+    center=None,
+    verbose=True,
+):
+    """
+    Automatic mask of the aliens and detector gaps, see the module documentation.
+
+    :param data: 3D array of intensities
+    :param mask: 3D array, 1 for the voxels already masked
+    :param threshold: threshold in log10(1 + intensity) of the alien candidates
+    :param symmetry_ratio: ratio between the intensity of an alien and of its mirror
+     about the Bragg peak
+    :param min_mirror_fraction: minimum fraction of mirrored voxels in the array
+    :param alien_dilation: number of voxels added around the aliens
+    :param gaps: True to detect the detector gaps
+    :param min_gap_size: minimum number of pixels of a gap
+    :param max_gap_width: maximum width in pixels of a gap
+    :param gap_dilation: number of pixels added around the gaps
+    :param center: indices of the Bragg peak, default is the maximum of the data
+    :param verbose: True to print the statistics
+    :return: the updated mask (1 for masked voxels, same type as the mask, int8
+     by default) and a dictionary of statistics
+    """
+    data = np.asarray(data)
+    mask = np.zeros(data.shape, dtype=np.int8) if mask is None else np.asarray(mask)
+    new_mask = mask != 0
+    report = {"gaps": 0}
+    if gaps:
+        # the gaps are masked first, so that they are not taken as the missing
+        # mirror of the intensity on the other side of the Bragg peak
+        gap_mask, report = detect_gaps(
+            data,
+            mask,
+            min_gap_size=min_gap_size,
+            max_gap_width=max_gap_width,
+            dilation=gap_dilation,
+        )
+        new_mask = new_mask | gap_mask[np.newaxis, :, :]
+    aliens, alien_report = detect_aliens(
+        data,
+        new_mask,
+        threshold=threshold,
+        symmetry_ratio=symmetry_ratio,
+        min_mirror_fraction=min_mirror_fraction,
+        dilation=alien_dilation,
+        center=center,
+    )
+    report.update(alien_report)
+    new_mask |= aliens
+    report["alien_voxels"] = int(aliens.sum())
+    report["masked_voxels"] = int(new_mask.sum() - np.count_nonzero(mask))
+    if verbose:
+        print(
+            f"\nAutomatic masking: {report['aliens']} aliens"
+            f" ({report['alien_voxels']} voxels) out of {report['components']}"
+            f" components above 10^{threshold}, {report['gaps']} detector gaps,"
+            f" {report['masked_voxels']} voxels masked"
+        )
+    return new_mask.astype(mask.dtype), report
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+"""
+Out-of-core helpers for preprocess_bcdi.
+
+In the out-of-core mode, the data and mask of a scan are kept in chunked HDF5
+files of a scratch directory (one chunk per frame) instead of numpy arrays, and
+the frame-wise stages of the preprocessing (masking, zero-event masking, median
+filtering, photon threshold, nan removal, binning along the rocking axis) run
+over blocks of frames, so that only a few frames are in memory at a time. The
+projections used for the plots are computed the same way, without reading the
+whole stack. The helpers also work on numpy arrays.
+
+The memory used by the process is reported after each stage with MemoryReport.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import h5py
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Default size of a block of frames in bytes
+BLOCK_SIZE = 64e6
+
+
+def memory_usage():
+    """
+    Resident memory of the process.
+
+    :return: the current and the peak resident memory in bytes, nan if unknown.
+     The peak is the maximum since the start of the process.
+    """
+    current = peak = np.nan
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024
+    return current, peak
+
+
+class MemoryReport:
+    """
+    Keep track of the memory used by the process after each stage.
+
+    :param verbose: True to print the memory after each stage
+    """
+
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.stages = []
+
+    def __call__(self, stage):
+        """Record the memory after the stage."""
+        current, peak = memory_usage()
+        self.stages.append((stage, current, peak))
+        if self.verbose:
+            print(
+                f"\nMemory after {stage}: {current / 2**20:.0f} MB"
+                f" (peak {peak / 2**20:.0f} MB)"
+            )
+
+    @property
+    def peak(self):
+        """Peak resident memory in bytes."""
+        return memory_usage()[1]
+
+    def summary(self):
+        """Print the memory after each stage and return the peak in bytes."""
+        peak = self.peak
+        print("\nMemory usage (MB):             current       peak")
+        for stage, current, stage_peak in self.stages:
+            print(f"    {stage:<30} {current / 2**20:>8.0f} {stage_peak / 2**20:>10.0f}")
+        print(f"Peak resident memory: {peak / 2**20:.0f} MB")
+        return peak
+
+
+class ScratchSpace:
+    """
+    Temporary directory holding chunked HDF5 arrays, one file per array.
+
+    :param directory: parent directory of the scratch directory, it should be on a
+     disk with enough space for a few copies of the data. Default is the system
+     temporary directory.
+    """
+
+    def __init__(self, directory=None):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="preprocess_scratch_", dir=directory or None)
+        self.files = {}
+        self.counter = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def _create(self, shape, dtype, name):
+        """New file with an empty dataset chunked by frame"""
+        self.counter += 1
+        h5file = h5py.File(os.path.join(self.path, f"{name}_{self.counter}.h5"), "w")
+        chunks = (1,) + tuple(shape[1:]) if len(shape) > 1 and shape[0] else None
+        return h5file.create_dataset("data", shape=tuple(shape), dtype=dtype, chunks=chunks)
+
+    def _replace(self, name, array):
+        """Keep the array under that name and remove the previous one"""
+        self.remove(name)
+        self.files[name] = array.file
+
+    def remove(self, name):
+        """Close and remove the array of that name, if any."""
+        h5file = self.files.pop(name, None)
+        if h5file is not None:
+            filename = h5file.filename
+            h5file.close()
+            os.remove(filename)
+
+    def empty(self, name, shape, dtype):
+        """
+        Create an array, the previous array of that name is closed and removed.
+
+        :param name: name of the array, e.g. "data"
+        :param shape: shape of the array
+        :param dtype: data type of the array
+        :return: the array, a h5py.Dataset filled with zeros
+        """
+        array = self._create(shape, dtype, name)
+        self._replace(name, array)
+        return array
+
+    def store(self, name, array, blocksize=BLOCK_SIZE):
+        """
+        Copy an array in the scratch directory by blocks of frames, replacing the
+        previous array of that name.
+
+        :param name: name of the array, e.g. "data"
+        :param array: the array to copy, numpy.ndarray or h5py.Dataset. It is
+         returned as it is if it is already the array of that name.
+        :param blocksize: size in bytes of the blocks of frames
+        :return: the copy, a h5py.Dataset
+        """
+        if isinstance(array, h5py.Dataset) and self.files.get(name) == array.file:
+            return array
+        stored = self._create(array.shape, array.dtype, name)
+        for frames in frame_slices(array.shape, array.dtype, blocksize=blocksize):
+            stored[frames] = array[frames]
+        self._replace(name, stored)
+        return stored
+
+    def cleanup(self):
+        """Close the files and remove the scratch directory."""
+        for h5file in self.files.values():
+            h5file.close()
+        self.files = {}
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def load(array):
+    """
+    Read an array of the scratch directory in memory.
+
+    :param array: h5py.Dataset, numpy arrays are returned as they are
+    :return: numpy.ndarray
+    """
+    if isinstance(array, h5py.Dataset):
+        return array[()]
+    return array
+
+
+def sum_dtype(dtype):
+    """Data type of the sum of an array of that type, e.g. int64 for uint16."""
+    return np.sum(np.zeros(1, dtype=dtype)).dtype
+
+
+def frame_slices(shape, dtype, start=0, stop=None, blocksize=BLOCK_SIZE, multiple=1):
+    """
+    Split the frames of a stack in blocks.
+
+    :param shape: shape of the stack, frames along axis 0
+    :param dtype: data type of the stack
+    :param start: first frame
+    :param stop: last frame (excluded), default is the number of frames
+    :param blocksize: approximate size in bytes of a block
+    :param multiple: the number of frames of each block is a multiple of it
+    :return: a list of slices
+    """
+    stop = shape[0] if stop is None else stop
+    frame_size = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+    nframes = max(1, int(blocksize // max(frame_size, 1)))
+    nframes = max(multiple, nframes - nframes % multiple)
+    return [slice(idx, min(idx + nframes, stop)) for idx in range(start, stop, nframes)]
+
+
+def map_frames(func, data, mask, start=0, stop=None, blocksize=BLOCK_SIZE):
+    """
+    Apply a function to the data and mask, by blocks of frames.
+
+    :param func: function (data, mask) -> (data, mask) working on a block of frames
+    :param data: 3D array, frames along axis 0, modified in place
+    :param mask: 3D array of the same shape, modified in place
+    :param start: first frame
+    :param stop: last frame (excluded), default is the number of frames
+    :param blocksize: approximate size in bytes of a block of data
+    """
+    for frames in frame_slices(data.shape, data.dtype, start, stop, blocksize):
+        data[frames], mask[frames] = func(np.asarray(data[frames]), np.asarray(mask[frames]))
+
+
+def apply_mask(data, mask, binarize_mask=True, blocksize=BLOCK_SIZE):
+    """
+    Binarize the mask and set the masked data to 0, by blocks of frames.
+
+    Same as mask[np.nonzero(mask)] = 1 ; data[mask == 1] = 0, or
+    data[np.nonzero(mask)] = 0 if binarize_mask is False.
+    """
+
+    def func(data, mask):
+        if binarize_mask:
+            mask[np.nonzero(mask)] = 1
+            data[mask == 1] = 0
+        else:
+            data[np.nonzero(mask)] = 0
+        return data, mask
+
+    map_frames(func, data, mask, blocksize=blocksize)
+
+
+def binarize(mask, blocksize=BLOCK_SIZE):
+    """
+    Set the non-zero values of the mask to 1, by blocks of frames.
+
+    Same as mask[np.nonzero(mask)] = 1.
+    """
+    for frames in frame_slices(mask.shape, mask.dtype, blocksize=blocksize):
+        block = np.asarray(mask[frames])
+        block[np.nonzero(block)] = 1
+        mask[frames] = block
+
+
+def mask_zero_event(data, mask, blocksize=BLOCK_SIZE):
+    """
+    Mask the pixels without intensity along the whole rocking curve.
+
+    :param data: 3D array, frames along axis 0
+    :param mask: 3D array of the same shape, modified in place
+    """
+    total = np.zeros(data.shape[1:])
+    for frames in frame_slices(data.shape, data.dtype, blocksize=blocksize):
+        total += np.sum(data[frames], axis=0)
+    empty = total == 0
+    for frames in frame_slices(mask.shape, mask.dtype, blocksize=blocksize):
+        block = np.asarray(mask[frames])
+        block[:, empty] = 1
+        mask[frames] = block
+
+
+def photon_threshold(data, mask, threshold, blocksize=BLOCK_SIZE):
+    """
+    Mask and set to 0 the data below the threshold, by blocks of frames.
+    """
+
+    def func(data, mask):
+        mask[data < threshold] = 1
+        data[data < threshold] = 0
+        return data, mask
+
+    map_frames(func, data, mask, blocksize=blocksize)
+
+
+def remove_nan(data, mask, blocksize=BLOCK_SIZE):
+    """
+    Mask and set to 0 the nan and inf values, by blocks of frames.
+
+    Same as bcdi.utils.utilities.remove_nan.
+    """
+
+    def func(data, mask):
+        mask[~np.isfinite(data)] = 1
+        mask[~np.isfinite(mask)] = 1
+        mask[np.nonzero(mask)] = 1
+        data[~np.isfinite(data)] = 0
+        return data, mask
+
+    map_frames(func, data, mask, blocksize=blocksize)
+
+
+def masked_sums(data, mask=None, threshold=None, blocksize=BLOCK_SIZE):
+    """
+    Sums of the data along each axis, the masked points counting as 0.
+
+    :param data: 3D array, frames along axis 0
+    :param mask: optional 3D array of the same shape, 1 for masked points
+    :param threshold: optional, the values below it count as 0
+    :return: the three 2D sums along axis 0, 1 and 2
+    """
+    nz, ny, nx = data.shape
+    sum0 = np.zeros((ny, nx))
+    sum1 = np.zeros((nz, nx))
+    sum2 = np.zeros((nz, ny))
+    for frames in frame_slices(data.shape, data.dtype, blocksize=blocksize):
+        block = np.array(data[frames], dtype=float)
+        if threshold is not None:
+            block[block < threshold] = 0
+        if mask is not None:
+            block[np.asarray(mask[frames]) != 0] = 0
+        sum0 += block.sum(axis=0)
+        sum1[frames] = block.sum(axis=1)
+        sum2[frames] = block.sum(axis=2)
+    return sum0, sum1, sum2
+
+
+def argmax(data, blocksize=BLOCK_SIZE):
+    """
+    Position of the maximum of a 3D array, by blocks of frames.
+
+    :return: the indices (z, y, x) of the first maximum, like
+     np.unravel_index(data.argmax(), data.shape)
+    """
+    best, position = None, (0, 0, 0)
+    for frames in frame_slices(data.shape, data.dtype, blocksize=blocksize):
+        block = np.asarray(data[frames])
+        idx = np.unravel_index(block.argmax(), block.shape)
+        if best is None or block[idx] > best:
+            best = block[idx]
+            position = (idx[0] + frames.start, idx[1], idx[2])
+    return tuple(int(val) for val in position)
+
+
+def center_of_mass(data, blocksize=BLOCK_SIZE):
+    """
+    Center of mass of a 3D array, by blocks of frames.
+
+    Same as scipy.ndimage.center_of_mass, nan if the sum is 0.
+    """
+    nz, ny, nx = data.shape
+    sum_z = np.zeros(nz)
+    sum_y = np.zeros(ny)
+    sum_x = np.zeros(nx)
+    for frames in frame_slices(data.shape, data.dtype, blocksize=blocksize):
+        block = np.asarray(data[frames], dtype=float)
+        sum_z[frames] = block.sum(axis=(1, 2))
+        sum_y += block.sum(axis=(0, 2))
+        sum_x += block.sum(axis=(0, 1))
+    total = sum_z.sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return tuple(
+            float(np.dot(np.arange(len(val)), val) / total)
+            for val in (sum_z, sum_y, sum_x)
+        )
+
+
+def bin_frames(array, binning, out, blocksize=BLOCK_SIZE):
+    """
+    Bin a stack along axis 0 by blocks of frames.
+
+    Same as bcdi.utils.utilities.bin_data(array, (binning, 1, 1)): the frames are
+    summed by groups of binning, the last frames are dropped if the number of frames
+    is not a multiple of binning.
+
+    :param array: 3D array, frames along axis 0
+    :param binning: number of frames summed together
+    :param out: 3D array of shape (array.shape[0] // binning, ny, nx), e.g. created
+     with ScratchSpace.empty, with the data type of the sum (see sum_dtype)
+    :return: out
+    """
+    nz = array.shape[0] - array.shape[0] % binning
+    for frames in frame_slices(
+        array.shape, array.dtype, stop=nz, blocksize=blocksize, multiple=binning
+    ):
+        block = np.asarray(array[frames])
+        out[frames.start // binning : frames.stop // binning] = block.reshape(
+            (-1, binning) + block.shape[1:]
+        ).sum(axis=1)
+    return out
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""
+Output files of preprocess_bcdi and strain_bcdi.
+
+The products (data, mask, q values, object, support...) are written by save in
+one of the formats:
+
+    - "npz": np.savez_compressed, single-threaded zlib (former behaviour)
+    - "h5": HDF5 file with one chunked and compressed dataset per array, with
+      blosc/lz4 from hdf5plugin when it is installed (multithreaded, see
+      BLOSC_NTHREADS), otherwise with the lzf filter of h5py
+    - "npy": directory with one raw .npy file per array, which can be memory
+      mapped when loaded
+
+    path = save(savedir + "S1_pynx", fmt="h5", data=data)   # S1_pynx.h5
+    data = load(path)["data"]
+
+load reads any of these formats (and single .npy files or other HDF5 files
+like CXI files) and returns a dictionary of the arrays with a files attribute,
+like the NpzFile of np.load.
+Values which are not arrays (e.g. dictionaries of parameters) are stored as
+JSON in the "h5" and "npy" formats.
+"""
+
+import json
+import os
+
+try:
+    import hdf5plugin  # should be imported before h5py
+except ModuleNotFoundError:
+    hdf5plugin = None
+import h5py
+import numpy as np
+
+FORMATS = {"npz": ".npz", "h5": ".h5", "npy": ""}
+
+# File types of the outputs in the tkinter file dialogs
+FILETYPES = [("NPZ", "*.npz"), ("HDF5", "*.h5 *.cxi"), ("NPY", "*.npy")]
+
+# Name of the file of the values which are not arrays in the "npy" format
+METADATA = "metadata.json"
+
+
+class Output(dict):
+    """Arrays of an output file, the names are also in files like in NpzFile."""
+
+    @property
+    def files(self):
+        return list(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def filename(path, fmt="npz"):
+    """
+    Name of the output written by save.
+
+    :param path: path of the output without extension
+    :param fmt: format of the output, a key of FORMATS
+    :return: the path with the extension of the format
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt should be one of {sorted(FORMATS)}, got {fmt}")
+    return path + FORMATS[fmt]
+
+
+def _is_array(value):
+    """True if the value can be written as a numeric array"""
+    return not isinstance(value, (dict, str)) and np.asarray(value).dtype != object
+
+
+def _compression(array):
+    """Dataset options of the "h5" format for an array"""
+    if array.ndim == 0 or array.nbytes < 2**16:
+        return {}
+    if array.ndim >= 3:  # one frame per chunk, as read by the out-of-core mode
+        chunks = (1,) * (array.ndim - 2) + array.shape[-2:]
+    else:
+        chunks = True
+    if hdf5plugin is not None:
+        options = dict(
+            hdf5plugin.Blosc(cname="lz4", clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE)
+        )
+    else:
+        options = {"compression": "lzf", "shuffle": True}
+    return dict(options, chunks=chunks)
+
+
+def save(path, fmt="npz", **arrays):
+    """
+    Save arrays in an output file.
+
+    :param path: path of the output without extension
+    :param fmt: "npz", "h5" or "npy", see the module documentation
+    :param arrays: arrays to save, by name
+    :return: the path of the file (directory for "npy")
+    """
+    out = filename(path, fmt)
+    if fmt == "npz":
+        np.savez_compressed(out, **arrays)
+        return out
+
+    metadata = {key: value for key, value in arrays.items() if not _is_array(value)}
+    arrays = {
+        key: np.asarray(value) for key, value in arrays.items() if key not in metadata
+    }
+    if fmt == "h5":
+        # blosc is multithreaded with the BLOSC_NTHREADS environment variable
+        os.environ.setdefault("BLOSC_NTHREADS", str(os.cpu_count() or 1))
+        with h5py.File(out, "w", track_order=True) as h5file:
+            for key, array in arrays.items():
+                h5file.create_dataset(key, data=array, **_compression(array))
+            for key, value in metadata.items():
+                h5file.attrs[key] = json.dumps(value, default=str)
+    else:  # "npy"
+        os.makedirs(out, exist_ok=True)
+        for key, array in arrays.items():
+            np.save(os.path.join(out, key + ".npy"), array)
+        with open(os.path.join(out, METADATA), "w") as f:
+            json.dump(
+                {"order": list(arrays) + list(metadata), "values": metadata},
+                f,
+                default=str,
+            )
+    return out
+
+
+def _datasets(group):
+    """Paths of the datasets of a HDF5 group, in the order of creation if tracked"""
+    for item in group.values():
+        if isinstance(item, h5py.Dataset):
+            yield item.name.lstrip("/")
+        elif isinstance(item, h5py.Group):
+            yield from _datasets(item)
+
+
+def load(path, mmap_mode=None):
+    """
+    Load an output file written by save, in any format.
+
+    :param path: path of a .npz, .h5 (or .cxi) or .npy file or of a directory of
+     .npy files. A path without extension is looked for in all the formats.
+    :param mmap_mode: mmap_mode of np.load for the .npy files, e.g. "r" to map
+     the arrays instead of reading them
+    :return: an Output dictionary of the arrays (and other values) by name, or
+     the NpzFile for a .npz file. A single .npy file gives the array under the
+     name "data".
+    """
+    if not os.path.exists(path):
+        candidates = [filename(path, fmt) for fmt in FORMATS]
+        path = next((name for name in candidates if os.path.exists(name)), path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No output {path} in the formats {sorted(FORMATS)}"
+            )
+
+    if os.path.isdir(path):
+        metadata = {"order": None, "values": {}}
+        if os.path.isfile(os.path.join(path, METADATA)):
+            with open(os.path.join(path, METADATA)) as f:
+                metadata = json.load(f)
+        names = metadata["order"] or sorted(
+            name[:-4] for name in os.listdir(path) if name.endswith(".npy")
+        )
+        output = Output()
+        for name in names:
+            if name in metadata["values"]:
+                output[name] = metadata["values"][name]
+            else:
+                output[name] = np.load(
+                    os.path.join(path, name + ".npy"), mmap_mode=mmap_mode
+                )
+        return output
+
+    if path.endswith(".npy"):
+        return Output(data=np.load(path, mmap_mode=mmap_mode))
+
+    if h5py.is_hdf5(path):
+        output = Output()
+        with h5py.File(path, "r") as h5file:
+            # datasets in groups (e.g. CXI files) by their name if it is unique
+            datasets = list(_datasets(h5file))
+            names = [name.split("/")[-1] for name in datasets]
+            for name, key in zip(datasets, names):
+                output[key if names.count(key) == 1 else name] = h5file[name][()]
+            for key, value in h5file.attrs.items():
+                try:
+                    output[key] = json.loads(value)
+                except (TypeError, ValueError):
+                    output[key] = value
+        return output
+
+    return np.load(path)  # NpzFile, the arrays are read when accessed
+
+
+def load_array(path, names=("data",), mmap_mode=None):
+    """
+    Load one array of an output file, in any format.
+
+    :param path: path of the output, see load
+    :param names: possible names of the array, the first one found is loaded
+    :param mmap_mode: mmap_mode of np.load for the .npy files
+    :return: the array
+    """
+    arrays = load(path, mmap_mode=mmap_mode)
+    for name in names:
+        if name in arrays:
+            return arrays[name]
+    raise KeyError(f"None of the arrays {names} in {path}")
@@ -21,7 +21,6 @@ try:
 except ImportError:
     pass
 import os
-import scipy.signal  # for medfilt2d
 from scipy.ndimage.measurements import center_of_mass
 import sys
 from scipy.io import savemat
@@ -35,6 +34,12 @@ import bcdi.postprocessing.postprocessing_utils as pu
 import bcdi.preprocessing.preprocessing_utils as pru
 import bcdi.utils.utilities as util
 import bcdi.utils.validation as valid
+import gwaihir.runner.out_of_core as ooc
+from gwaihir.runner import checkpoint
+from gwaihir.runner import filtering
+from gwaihir.runner import gridding
+from gwaihir.runner import masking
+from gwaihir.runner import output
 
 helptext = """
 Prepare experimental data for Bragg CDI phasing: crop/pad, center, mask, normalize and
@@ -53,6 +58,42 @@ output files saved in:   /rootdir/S1/pynxraw/ or /rootdir/S1/pynx/ depending on
 'use_rawdata' option
 """
 
+
+def plot_sums(array, title, planes, scale="log", vmax=np.nan, mask=None,
+              threshold=None, is_orthogonal=False):
+    """
+    Plot the sums of a 3D array along each axis without copying the array.
+
+    Same figure as gu.multislices_plot(array, sum_frames=True), which copies the
+    array, used in the out-of-core mode.
+
+    :param array: 3D array, frames along axis 0
+    :param title: title of the plots
+    :param planes: names of the planes for the sums along axis 0, 1 and 2
+    :param scale: 'linear' or 'log'
+    :param vmax: tuple of the higher boundaries of the colorbars, or np.nan
+    :param mask: optional 3D array, the masked points count as 0
+    :param threshold: optional, the values below it count as 0
+    :param is_orthogonal: True if the data is in an orthonormal frame
+    :return: the figure
+    """
+    sums = ooc.masked_sums(array, mask=mask, threshold=threshold)
+    return gu.combined_plots(
+        tuple_array=sums,
+        tuple_sum_frames=False,
+        tuple_sum_axis=0,
+        tuple_width_v=None,
+        tuple_width_h=None,
+        tuple_colorbar=True,
+        tuple_vmin=0,
+        tuple_vmax=vmax,
+        tuple_scale=scale,
+        tuple_title=tuple(f"{title} {plane}" for plane in planes),
+        is_orthogonal=is_orthogonal,
+        reciprocal_space=True,
+    )
+
+
 def preprocess_bcdi(
     scans,
     root_folder,
@@ -122,6 +163,15 @@ def preprocess_bcdi(
     tiltazimuth, 
     tilt,
     GUI,
+    out_of_core=False,
+    scratch_dir=None,
+    headless=False,
+    filter_workers=None,
+    gridding_cache=None,
+    save_format="npz",
+    auto_mask=False,
+    auto_mask_params=None,
+    checkpoint_dir=None,
     ):
     """
     Prepare experimental data for Bragg CDI phasing: crop/pad, center, mask, normalize and
@@ -137,13 +187,73 @@ def preprocess_bcdi(
     data in:                                           /rootdir/S1/data/
 
     output files saved in:   /rootdir/S1/pynxraw/ or /rootdir/S1/pynx/ depending on the
-    'use_rawdata' option"""
-
-    if GUI:
+    'use_rawdata' option
+
+    Out-of-core mode (out_of_core=True): after loading, the data and mask are kept
+    in chunked HDF5 files of a scratch directory created in scratch_dir (default is
+    the saving directory, /tmp is a RAM disk on some systems) and the frame-wise
+    stages run over blocks of frames, see gwaihir.runner.out_of_core. The gridding,
+    the cropping/centering, the interactive masking and the final crop still need
+    the whole stack in memory, the copies made for the plots and masks are avoided.
+    The loading itself, with the hotpixels, flatfield and background corrections
+    done by pru.load_bcdi_data, is not streamed: the peak memory of the loading is
+    the same in both modes. The scratch directory is removed at the end of each
+    scan, also when it fails.
+    The memory used after each stage and the peak memory are reported at the end of
+    each scan in both modes.
+
+    Headless mode (headless=True): the figures are only saved (Agg backend), without
+    Tk window nor interactive masking, used by gwaihir.runner.batch to preprocess
+    scans in worker processes.
+
+    The isolated pixels and median filters run on filter_workers workers (default
+    is the number of cpus, 1 in a worker process, 1 for the former sequential
+    loop), see
+    gwaihir.runner.filtering. The result does not depend on the number of workers.
+
+    Gridding cache (gridding_cache=directory, linearization only): the sparse
+    interpolation operator of the linearization is saved in this directory under a
+    hash of the geometry and reused by the next runs with the same geometry, see
+    gwaihir.runner.gridding.
+
+    The data, mask and q values are saved with gwaihir.runner.output in the
+    save_format format: "npz" (np.savez_compressed, default), "h5" (HDF5 with a
+    fast multithreaded codec) or "npy" (directory of raw .npy files). save_to_npz
+    enables the saving in this format.
+
+    Automatic masking (auto_mask=True): before the interactive masking (or
+    instead of it in headless mode), the aliens are detected by their lack of
+    centrosymmetric counterpart about the Bragg peak and the detector gaps as thin
+    regions without intensity, see gwaihir.runner.masking.auto_mask whose
+    parameters can be given in the auto_mask_params dictionary. The resulting mask
+    is saved in S<scan>_automask.
+
+    Checkpoints (checkpoint_dir=directory): the preprocessing of each scan is split
+    in the stages load (with the hotpixels, flatfield and background corrections),
+    gridding, center_fft, masking, filtering, binning and save. The output of each
+    stage is saved in directory/S<scan> under a hash of the content of its inputs
+    and of its parameters. A rerun restores the unchanged stages from their
+    checkpoints (their plots are not made again) and computes the following ones,
+    see gwaihir.runner.checkpoint. The interactive masking is always done again.
+    Not used with reload_previous.
+
+    Returns a dictionary {scan number: outputs} where outputs is a dictionary with
+    the saving directory, the data and mask files (None if not saved in npz), the
+    automatic mask file (None without auto_mask), the final shape, the stages
+    restored from the checkpoints of the data and the peak resident memory in bytes."""
+
+    if headless:
+        plt.switch_backend("Agg")
+        if flag_interact:
+            print("Headless mode: defaulting flag_interact to False")
+        flag_interact = False
+        if reload_previous:
+            raise ValueError("reload_previous needs the file dialogs, not available in headless mode")
+    elif GUI:
         plt.switch_backend(
             'module://ipykernel.pylab.backend_inline'
         )
-    if not GUI:
+    else:
         plt.switch_backend(
             "Qt5Agg"
         )
@@ -315,6 +425,10 @@ def preprocess_bcdi(
         print("'fix_size' parameter provided, defaulting 'center_fft' to 'skip'")
         center_fft = "skip"
 
+    if reload_previous and checkpoint_dir:
+        print("The checkpoints are not used with reload_previous")
+        checkpoint_dir = None
+
     if photon_filter == "loading":
         loading_threshold = photon_threshold
     else:
@@ -361,6 +475,8 @@ def preprocess_bcdi(
             )
         save_dirname = "pynx"
         print(f"Output will be orthogonalized using {interp_method}")
+        if gridding_cache and interp_method != "linearization":
+            print("The gridding cache is only used with interp_method='linearization'")
         plot_title = ["QzQx", "QyQx", "QyQz"]
 
     if isinstance(sample_name, str):
@@ -451,11 +567,14 @@ def preprocess_bcdi(
     ############################
     # start looping over scans #
     ############################
-    try:
-        root = tk.Tk()
-        root.withdraw()
-    except tk.TclError:
-        pass
+    if not headless:
+        try:
+            root = tk.Tk()
+            root.withdraw()
+        except tk.TclError:
+            pass
+
+    outputs = {}
 
     for scan_idx, scan_nb in enumerate(scans, start=1):
         plt.ion()
@@ -514,6 +633,24 @@ def preprocess_bcdi(
         if normalize_flux:
             comment = comment + "_norm"
 
+        if checkpoint_dir:
+            # the files of this scan only (the whole data directory if they are not
+            # found), the spec file is left out as it is appended by the next scans
+            raw_files = checkpoint.scan_files(
+                detector.datadir, detector.template_imagefile, scan_nb
+            )
+            checkpoints = checkpoint.Checkpoints(
+                os.path.join(checkpoint_dir, f"S{scan_nb}"),
+                inputs=checkpoint.fingerprint(
+                    *(raw_files or [detector.datadir]),
+                    flatfield_file,
+                    hotpixels_file,
+                    background_file,
+                ),
+            )
+        else:
+            checkpoints = checkpoint.Checkpoints(None)
+
         #############
         # Load data #
         #############
@@ -522,9 +659,9 @@ def preprocess_bcdi(
             file_path = filedialog.askopenfilename(
                 initialdir=detector.scandir,
                 title="Select data file",
-                filetypes=[("NPZ", "*.npz")],
+                filetypes=output.FILETYPES,
             )
-            data = np.load(file_path)
+            data = output.load(file_path)
             npz_key = data.files
             data = data[npz_key[0]]
             nz, ny, nx = np.shape(data)
@@ -540,9 +677,9 @@ def preprocess_bcdi(
             file_path = filedialog.askopenfilename(
                 initialdir=os.path.dirname(file_path) + "/",
                 title="Select mask file",
-                filetypes=[("NPZ", "*.npz")],
+                filetypes=output.FILETYPES,
             )
-            mask = np.load(file_path)
+            mask = output.load(file_path)
             npz_key = mask.files
             mask = mask[npz_key[0]]
 
@@ -552,9 +689,9 @@ def preprocess_bcdi(
                     file_path = filedialog.askopenfilename(
                         initialdir=detector.savedir,
                         title="Select q values",
-                        filetypes=[("NPZ", "*.npz")],
+                        filetypes=output.FILETYPES,
                     )
-                    reload_qvalues = np.load(file_path)
+                    reload_qvalues = output.load(file_path)
                     q_values = [
                         reload_qvalues["qx"],
                         reload_qvalues["qz"],
@@ -612,757 +749,1155 @@ def preprocess_bcdi(
 
         else:  # new masking process
             reload_orthogonal = False  # the data is in the detector plane
-            flatfield = util.load_flatfield(flatfield_file)
-            hotpix_array = util.load_hotpixels(hotpixels_file)
-            background = util.load_background(background_file)
-
-            data, mask, frames_logical, monitor = pru.load_bcdi_data(
-                logfile=logfile,
-                scan_number=scan_nb,
-                detector=detector,
-                setup=setup,
-                flatfield=flatfield,
-                hotpixels=hotpix_array,
-                background=background,
-                normalize=normalize_flux,
-                debugging=debug,
-                photon_threshold=loading_threshold,
+            state = checkpoints.restore(
+                "load",
+                dict(
+                    scan=scan_nb,
+                    sample_name=sample_name[scan_idx - 1],
+                    beamline=beamline,
+                    detector=detector.name,
+                    roi=detector.roi,
+                    binning=detector.binning,
+                    preprocessing_binning=detector.preprocessing_binning,
+                    linearity_func=linearity_func,
+                    rocking_angle=rocking_angle,
+                    actuators=actuators,
+                    is_series=is_series,
+                    custom_scan=custom_scan,
+                    custom_images=custom_images,
+                    custom_monitor=custom_monitor,
+                    normalize_flux=normalize_flux,
+                    loading_threshold=loading_threshold,
+                ),
             )
+            if state is None:
+                flatfield = util.load_flatfield(flatfield_file)
+                hotpix_array = util.load_hotpixels(hotpixels_file)
+                background = util.load_background(background_file)
+
+                data, mask, frames_logical, monitor = pru.load_bcdi_data(
+                    logfile=logfile,
+                    scan_number=scan_nb,
+                    detector=detector,
+                    setup=setup,
+                    flatfield=flatfield,
+                    hotpixels=hotpix_array,
+                    background=background,
+                    normalize=normalize_flux,
+                    debugging=debug,
+                    photon_threshold=loading_threshold,
+                )
+                checkpoints.store(
+                    "load",
+                    data=data,
+                    mask=mask,
+                    frames_logical=frames_logical,
+                    monitor=monitor,
+                )
+            else:
+                data, mask = state["data"], state["mask"]
+                frames_logical, monitor = state["frames_logical"], state["monitor"]
 
         nz, ny, nx = np.shape(data)
         print("\nInput data shape:", nz, ny, nx)
+        memory = ooc.MemoryReport(verbose=out_of_core)
+        memory("loading")
 
-        binning_comment = (
-            f"_{detector.preprocessing_binning[0]*detector.binning[0]}"
-            f"_{detector.preprocessing_binning[1]*detector.binning[1]}"
-            f"_{detector.preprocessing_binning[2]*detector.binning[2]}"
-        )
+        scratch = None
+        try:
+            if out_of_core:
+                scratch = ooc.ScratchSpace(scratch_dir or detector.savedir)
+                print("\nScratch directory:", scratch.path)
+                data = scratch.store("data", data)
+                mask = scratch.store("mask", mask)
+                gc.collect()
+                memory("copy to the scratch directory")
+
+            binning_comment = (
+                f"_{detector.preprocessing_binning[0]*detector.binning[0]}"
+                f"_{detector.preprocessing_binning[1]*detector.binning[1]}"
+                f"_{detector.preprocessing_binning[2]*detector.binning[2]}"
+            )
 
-        if not reload_orthogonal:
-            if save_rawdata:
-                np.savez_compressed(
-                    detector.savedir + "S" + str(scan_nb) + "_data_before_masking_stack",
+            state = checkpoints.restore(
+                "gridding",
+                dict(
+                    use_rawdata=use_rawdata,
+                    interp_method=interp_method,
+                    fill_value_mask=fill_value_mask,
+                    beam_direction=beam_direction,
+                    sample_offsets=sample_offsets,
+                    sdd=sdd,
+                    energy=energy,
+                    custom_motors=custom_motors,
+                    align_q=align_q,
+                    ref_axis_q=ref_axis_q,
+                    inplane_angle=setup.inplane_angle,
+                    outofplane_angle=setup.outofplane_angle,
+                    sample_inplane=sample_inplane,
+                    sample_outofplane=sample_outofplane,
+                    offset_inplane=offset_inplane,
+                    cch1=cch1,
+                    cch2=cch2,
+                    detrot=detrot,
+                    tiltazimuth=tiltazimuth,
+                    tilt=tilt,
+                    follow_bragg=follow_bragg,
+                    save_rawdata=save_rawdata,
+                    # q values of the gridding cache
+                    gridding_version=gridding.CACHE_VERSION if gridding_cache else None,
+                ),
+            )
+            if state is None:
+                if not reload_orthogonal:
+                    if save_rawdata:
+                        output.save(
+                            detector.savedir + "S" + str(scan_nb) + "_data_before_masking_stack",
+                            fmt=save_format,
+                            data=data,
+                        )
+                        if save_to_mat:
+                            # save to .mat, the new order is x y z
+                            # (outboard, vertical up, downstream)
+                            savemat(
+                                detector.savedir
+                                + "S"
+                                + str(scan_nb)
+                                + "_data_before_masking_stack.mat",
+                                {"data": np.moveaxis(data, [0, 1, 2], [-1, -2, -3])},
+                            )
+
+                    if use_rawdata:
+                        q_values = []
+                        # binning along axis 0 is done after masking
+                        if out_of_core:
+                            ooc.apply_mask(data, mask, binarize_mask=False)
+                        else:
+                            data[np.nonzero(mask)] = 0
+                    else:
+                        if out_of_core:
+                            fig = plot_sums(
+                                data,
+                                title="Data before gridding\n",
+                                planes=plot_title[::-1],
+                                mask=mask,
+                            )
+                        else:
+                            tmp_data = np.copy(
+                                data
+                            )  # do not modify the raw data before the interpolation
+                            tmp_data[mask == 1] = 0
+                            fig, _, _ = gu.multislices_plot(
+                                tmp_data,
+                                sum_frames=True,
+                                scale="log",
+                                plot_colorbar=True,
+                                vmin=0,
+                                title="Data before gridding\n",
+                                is_orthogonal=False,
+                                reciprocal_space=True,
+                            )
+                            del tmp_data
+                        plt.savefig(
+                            detector.savedir
+                            + f"data_before_gridding_S{scan_nb}_{nz}_{ny}_{nx}"
+                            + binning_comment
+                            + ".png"
+                        )
+                        plt.close(fig)
+                        gc.collect()
+
+                        if out_of_core:  # the gridding needs the whole stack in memory
+                            data, mask = ooc.load(data), ooc.load(mask)
+                        if interp_method == "xrayutilities":
+                            qconv, offsets = setup.init_qconversion()
+                            detector.offsets = offsets
+                            hxrd = xu.experiment.HXRD(
+                                sample_inplane, sample_outofplane, en=energy, qconv=qconv
+                            )
+                            # the first 2 arguments in HXRD are the inplane reference direction
+                            # along the beam and surface normal of the sample
+
+                            # Update the direct beam vertical position,
+                            # take into account the roi and binning
+                            cch1 = (cch1 - detector.roi[0]) / (
+                                detector.preprocessing_binning[1] * detector.binning[1]
+                            )
+                            # Update the direct beam horizontal position,
+                            # take into account the roi and binning
+                            cch2 = (cch2 - detector.roi[2]) / (
+                                detector.preprocessing_binning[2] * detector.binning[2]
+                            )
+                            # number of pixels after taking into account the roi and binning
+                            nch1 = (detector.roi[1] - detector.roi[0]) // (
+                                detector.preprocessing_binning[1] * detector.binning[1]
+                            ) + (detector.roi[1] - detector.roi[0]) % (
+                                detector.preprocessing_binning[1] * detector.binning[1]
+                            )
+                            nch2 = (detector.roi[3] - detector.roi[2]) // (
+                                detector.preprocessing_binning[2] * detector.binning[2]
+                            ) + (detector.roi[3] - detector.roi[2]) % (
+                                detector.preprocessing_binning[2] * detector.binning[2]
+                            )
+                            # detector init_area method, pixel sizes are the binned ones
+                            hxrd.Ang2Q.init_area(
+                                setup.detector_ver_xrutil,
+                                setup.detector_hor_xrutil,
+                                cch1=cch1,
+                                cch2=cch2,
+                                Nch1=nch1,
+                                Nch2=nch2,
+                                pwidth1=detector.pixelsize_y,
+                                pwidth2=detector.pixelsize_x,
+                                distance=setup.distance,
+                                detrot=detrot,
+                                tiltazimuth=tiltazimuth,
+                                tilt=tilt,
+                            )
+                            # first two arguments in init_area are the direction of the detector,
+                            # checked for ID01 and SIXS
+
+                            data, mask, q_values, frames_logical = pru.grid_bcdi_xrayutil(
+                                data=data,
+                                mask=mask,
+                                scan_number=scan_nb,
+                                logfile=logfile,
+                                detector=detector,
+                                setup=setup,
+                                frames_logical=frames_logical,
+                                hxrd=hxrd,
+                                follow_bragg=follow_bragg,
+                                debugging=debug,
+                            )
+                        else:  # 'linearization'
+                            # for q values, the frame used is
+                            # (qx downstream, qy outboard, qz vertical up)
+                            # for reference_axis, the frame is z downstream, y vertical up,
+                            # x outboard but the order must be x,y,z
+                            if gridding_cache:
+                                data, mask, q_values = gridding.grid_labframe(
+                                    data=data,
+                                    mask=mask,
+                                    detector=detector,
+                                    setup=setup,
+                                    cache_dir=gridding_cache,
+                                    align_q=align_q,
+                                    reference_axis=axis_to_array_xyz[ref_axis_q],
+                                    fill_value=(0, fill_value_mask),
+                                )
+                            else:
+                                data, mask, q_values = pru.grid_bcdi_labframe(
+                                    data=data,
+                                    mask=mask,
+                                    detector=detector,
+                                    setup=setup,
+                                    align_q=align_q,
+                                    reference_axis=axis_to_array_xyz[ref_axis_q],
+                                    debugging=debug,
+                                    follow_bragg=follow_bragg,
+                                    fill_value=(0, fill_value_mask),
+                                )
+                        nz, ny, nx = data.shape
+                        print(
+                            "\nData size after interpolation into an orthonormal frame:", nz, ny, nx
+                        )
+                        memory("gridding")
+                        if out_of_core:
+                            data = scratch.store("data", data)
+                            mask = scratch.store("mask", mask)
+                            gc.collect()
+
+                        # plot normalization by incident monitor for the gridded data
+                        if normalize_flux:
+                            plt.ion()
+                            if out_of_core:
+                                # sum along axis 1, thresholded at 5 and masked
+                                tmp_data = ooc.masked_sums(data, mask=mask, threshold=5)[1]
+                            else:
+                                tmp_data = np.copy(
+                                    data
+                                )  # do not modify the raw data before the interpolation
+                                tmp_data[tmp_data < 5] = 0  # threshold the background
+                                tmp_data[mask == 1] = 0
+                            fig = gu.combined_plots(
+                                tuple_array=(monitor, tmp_data),
+                                tuple_sum_frames=(False, not out_of_core),
+                                tuple_sum_axis=(0, 1),
+                                tuple_width_v=None,
+                                tuple_width_h=None,
+                                tuple_colorbar=(False, False),
+                                tuple_vmin=(np.nan, 0),
+                                tuple_vmax=(np.nan, np.nan),
+                                tuple_title=(
+                                    "monitor.min() / monitor",
+                                    "Gridded normed data (threshold 5)\n",
+                                ),
+                                tuple_scale=("linear", "log"),
+                                xlabel=("Frame number", "Q$_y$"),
+                                ylabel=("Counts (a.u.)", "Q$_x$"),
+                                position=(323, 122),
+                                is_orthogonal=not use_rawdata,
+                                reciprocal_space=True,
+                            )
+
+                            fig.savefig(
+                                detector.savedir
+                                + f"monitor_gridded_S{scan_nb}_{nz}_{ny}_{nx}"
+                                + binning_comment
+                                + ".png"
+                            )
+                            if flag_interact:
+                                fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
+                                cid = plt.connect("close_event", close_event)
+                                fig.waitforbuttonpress()
+                                plt.disconnect(cid)
+                            plt.close(fig)
+                            plt.ioff()
+                            del tmp_data
+                            gc.collect()
+
+                checkpoints.store(
+                    "gridding",
                     data=data,
+                    mask=mask,
+                    frames_logical=frames_logical,
+                    **dict(zip(("qx", "qz", "qy"), q_values)),
                 )
-                if save_to_mat:
-                    # save to .mat, the new order is x y z
-                    # (outboard, vertical up, downstream)
-                    savemat(
-                        detector.savedir
-                        + "S"
-                        + str(scan_nb)
-                        + "_data_before_masking_stack.mat",
-                        {"data": np.moveaxis(data, [0, 1, 2], [-1, -2, -3])},
-                    )
-
-            if use_rawdata:
-                q_values = []
-                # binning along axis 0 is done after masking
-                data[np.nonzero(mask)] = 0
             else:
-                tmp_data = np.copy(
-                    data
-                )  # do not modify the raw data before the interpolation
-                tmp_data[mask == 1] = 0
-                fig, _, _ = gu.multislices_plot(
-                    tmp_data,
-                    sum_frames=True,
-                    scale="log",
-                    plot_colorbar=True,
-                    vmin=0,
-                    title="Data before gridding\n",
-                    is_orthogonal=False,
-                    reciprocal_space=True,
+                data, mask = state["data"], state["mask"]
+                frames_logical = state["frames_logical"]
+                q_values = [state[key] for key in ("qx", "qz", "qy") if key in state]
+                nz, ny, nx = data.shape
+                if out_of_core:
+                    data = scratch.store("data", data)
+                    mask = scratch.store("mask", mask)
+
+            ########################
+            # crop/pad/center data #
+            ########################
+            state = checkpoints.restore(
+                "center_fft",
+                dict(
+                    centering=centering,
+                    center_fft=center_fft,
+                    pad_size=pad_size,
+                    fix_bragg=fix_bragg,
+                    fix_size=fix_size,
+                ),
+            )
+            if state is None:
+                if out_of_core:
+                    data, mask = ooc.load(data), ooc.load(mask)
+                data, mask, pad_width, q_values, frames_logical = pru.center_fft(
+                    data=data,
+                    mask=mask,
+                    detector=detector,
+                    frames_logical=frames_logical,
+                    centering=centering,
+                    fft_option=center_fft,
+                    pad_size=pad_size,
+                    fix_bragg=fix_bragg,
+                    fix_size=fix_size,
+                    q_values=q_values,
                 )
-                plt.savefig(
-                    detector.savedir
-                    + f"data_before_gridding_S{scan_nb}_{nz}_{ny}_{nx}"
-                    + binning_comment
-                    + ".png"
+                checkpoints.store(
+                    "center_fft",
+                    data=data,
+                    mask=mask,
+                    pad_width=np.asarray(pad_width),
+                    frames_logical=frames_logical,
+                    **dict(zip(("qx", "qz", "qy"), q_values)),
                 )
-                plt.close(fig)
-                del tmp_data
+            else:
+                data, mask = state["data"], state["mask"]
+                pad_width = [int(val) for val in state["pad_width"]]
+                frames_logical = state["frames_logical"]
+                q_values = [state[key] for key in ("qx", "qz", "qy") if key in state]
+
+            starting_frame = [
+                pad_width[0],
+                pad_width[2],
+                pad_width[4],
+            ]  # no need to check padded frames
+            print("\nPad width:", pad_width)
+            nz, ny, nx = data.shape
+            print("\nData size after cropping / padding:", nz, ny, nx)
+            memory("cropping / padding")
+            if out_of_core:
+                data = scratch.store("data", data)
+                mask = scratch.store("mask", mask)
                 gc.collect()
 
-                if interp_method == "xrayutilities":
-                    qconv, offsets = setup.init_qconversion()
-                    detector.offsets = offsets
-                    hxrd = xu.experiment.HXRD(
-                        sample_inplane, sample_outofplane, en=energy, qconv=qconv
+            if not use_rawdata and len(q_values) != 0:
+                qx, qz, qy = q_values
+
+            # the interactive masking is always done again, its result is stored for
+            # the next stages
+            state = checkpoints.restore(
+                "masking",
+                dict(
+                    mask_zero_event=mask_zero_event,
+                    auto_mask=auto_mask,
+                    auto_mask_params=auto_mask_params,
+                    save_to_vti=save_to_vti,
+                ),
+                cache=not flag_interact,
+            )
+            if state is None:
+                ##########################################
+                # optional masking of zero photon events #
+                ##########################################
+                if mask_zero_event:
+                    # mask points when there is no intensity along the whole rocking curve
+                    # probably dead pixels
+                    if out_of_core:
+                        ooc.mask_zero_event(data, mask)
+                    else:
+                        temp_mask = np.zeros((ny, nx))
+                        temp_mask[np.sum(data, axis=0) == 0] = 1
+                        mask[np.repeat(temp_mask[np.newaxis, :, :], repeats=nz, axis=0) == 1] = 1
+                        del temp_mask
+
+                ###########################################
+                # save data and mask before alien removal #
+                ###########################################
+                if out_of_core:
+                    fig = plot_sums(
+                        data,
+                        title="Data before aliens removal\n",
+                        planes=plot_title[::-1],
+                        is_orthogonal=not use_rawdata,
                     )
-                    # the first 2 arguments in HXRD are the inplane reference direction
-                    # along the beam and surface normal of the sample
-
-                    # Update the direct beam vertical position,
-                    # take into account the roi and binning
-                    cch1 = (cch1 - detector.roi[0]) / (
-                        detector.preprocessing_binning[1] * detector.binning[1]
+                else:
+                    fig, _, _ = gu.multislices_plot(
+                        data,
+                        sum_frames=True,
+                        scale="log",
+                        plot_colorbar=True,
+                        vmin=0,
+                        title="Data before aliens removal\n",
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
                     )
-                    # Update the direct beam horizontal position,
-                    # take into account the roi and binning
-                    cch2 = (cch2 - detector.roi[2]) / (
-                        detector.preprocessing_binning[2] * detector.binning[2]
+                if debug:
+                    plt.savefig(
+                        detector.savedir + f"data_before_masking_sum_S{scan_nb}_{nz}_{ny}_{nx}_"
+                        f"{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}.png"
                     )
-                    # number of pixels after taking into account the roi and binning
-                    nch1 = (detector.roi[1] - detector.roi[0]) // (
-                        detector.preprocessing_binning[1] * detector.binning[1]
-                    ) + (detector.roi[1] - detector.roi[0]) % (
-                        detector.preprocessing_binning[1] * detector.binning[1]
+                if flag_interact:
+                    fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
+                    cid = plt.connect("close_event", close_event)
+                    fig.waitforbuttonpress()
+                    plt.disconnect(cid)
+                plt.close(fig)
+
+                if out_of_core:
+                    piz, piy, pix = ooc.argmax(data)
+                else:
+                    piz, piy, pix = np.unravel_index(data.argmax(), data.shape)
+                fig = gu.combined_plots(
+                    (data[piz, :, :], data[:, piy, :], data[:, :, pix]),
+                    tuple_sum_frames=False,
+                    tuple_sum_axis=0,
+                    tuple_width_v=None,
+                    tuple_width_h=None,
+                    tuple_colorbar=True,
+                    tuple_vmin=0,
+                    tuple_vmax=np.nan,
+                    tuple_scale="log",
+                    tuple_title=("data at max in xy", "data at max in xz", "data at max in yz"),
+                    is_orthogonal=not use_rawdata,
+                    reciprocal_space=False,
+                )
+                if debug:
+                    plt.savefig(
+                        detector.savedir
+                        + f"data_before_masking_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}.png"
                     )
-                    nch2 = (detector.roi[3] - detector.roi[2]) // (
-                        detector.preprocessing_binning[2] * detector.binning[2]
-                    ) + (detector.roi[3] - detector.roi[2]) % (
-                        detector.preprocessing_binning[2] * detector.binning[2]
+                if flag_interact:
+                    fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
+                    cid = plt.connect("close_event", close_event)
+                    fig.waitforbuttonpress()
+                    plt.disconnect(cid)
+                plt.close(fig)
+
+                if out_of_core:
+                    fig = plot_sums(
+                        mask,
+                        title="Mask before aliens removal\n",
+                        planes=plot_title[::-1],
+                        scale="linear",
+                        vmax=(nz, ny, nx),
+                        is_orthogonal=not use_rawdata,
+                    )
+                else:
+                    fig, _, _ = gu.multislices_plot(
+                        mask,
+                        sum_frames=True,
+                        scale="linear",
+                        plot_colorbar=True,
+                        vmin=0,
+                        vmax=(nz, ny, nx),
+                        title="Mask before aliens removal\n",
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
                     )
-                    # detector init_area method, pixel sizes are the binned ones
-                    hxrd.Ang2Q.init_area(
-                        setup.detector_ver_xrutil,
-                        setup.detector_hor_xrutil,
-                        cch1=cch1,
-                        cch2=cch2,
-                        Nch1=nch1,
-                        Nch2=nch2,
-                        pwidth1=detector.pixelsize_y,
-                        pwidth2=detector.pixelsize_x,
-                        distance=setup.distance,
-                        detrot=detrot,
-                        tiltazimuth=tiltazimuth,
-                        tilt=tilt,
+                if debug:
+                    plt.savefig(
+                        detector.savedir
+                        + f"mask_before_masking_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}.png"
                     )
-                    # first two arguments in init_area are the direction of the detector,
-                    # checked for ID01 and SIXS
 
-                    data, mask, q_values, frames_logical = pru.grid_bcdi_xrayutil(
-                        data=data,
+                if flag_interact:
+                    fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
+                    cid = plt.connect("close_event", close_event)
+                    fig.waitforbuttonpress()
+                    plt.disconnect(cid)
+                plt.close(fig)
+
+                ###############################################
+                # save the orthogonalized diffraction pattern #
+                ###############################################
+                if not use_rawdata and len(q_values) != 0:
+                    if save_to_vti:
+                        # save diffraction pattern to vti
+                        (
+                            nqx,
+                            nqz,
+                            nqy,
+                        ) = (
+                            data.shape
+                        )  # in nexus z downstream, y vertical / in q z vertical, x downstream
+                        print("\ndqx, dqy, dqz = ", qx[1] - qx[0], qy[1] - qy[0], qz[1] - qz[0])
+                        # in nexus z downstream, y vertical / in q z vertical, x downstream
+                        qx0 = qx.min()
+                        dqx = (qx.max() - qx0) / nqx
+                        qy0 = qy.min()
+                        dqy = (qy.max() - qy0) / nqy
+                        qz0 = qz.min()
+                        dqz = (qz.max() - qz0) / nqz
+
+                        gu.save_to_vti(
+                            filename=os.path.join(
+                                detector.savedir, f"S{scan_nb}_ortho_int" + comment + ".vti"
+                            ),
+                            voxel_size=(dqx, dqz, dqy),
+                            tuple_array=data,
+                            tuple_fieldnames="int",
+                            origin=(qx0, qz0, qy0),
+                        )
+
+                ######################################
+                # automatic masking of aliens & gaps #
+                ######################################
+                automask_file = None
+                if auto_mask:
+                    if out_of_core:
+                        print("\nAutomatic masking: loading the data and mask in memory")
+                        data, mask = ooc.load(data), ooc.load(mask)
+                    mask, _ = masking.auto_mask(data, mask, **(auto_mask_params or {}))
+                    automask_file = output.save(
+                        detector.savedir + f"S{scan_nb}_automask" + comment,
+                        fmt=save_format,
                         mask=mask,
-                        scan_number=scan_nb,
-                        logfile=logfile,
-                        detector=detector,
-                        setup=setup,
-                        frames_logical=frames_logical,
-                        hxrd=hxrd,
-                        follow_bragg=follow_bragg,
-                        debugging=debug,
                     )
-                else:  # 'linearization'
-                    # for q values, the frame used is
-                    # (qx downstream, qy outboard, qz vertical up)
-                    # for reference_axis, the frame is z downstream, y vertical up,
-                    # x outboard but the order must be x,y,z
-                    data, mask, q_values = pru.grid_bcdi_labframe(
-                        data=data,
-                        mask=mask,
-                        detector=detector,
-                        setup=setup,
-                        align_q=align_q,
-                        reference_axis=axis_to_array_xyz[ref_axis_q],
-                        debugging=debug,
-                        follow_bragg=follow_bragg,
-                        fill_value=(0, fill_value_mask),
+                    memory("automatic masking")
+
+                    if out_of_core:
+                        data = scratch.store("data", data)
+                        mask = scratch.store("mask", mask)
+                        gc.collect()
+
+                if flag_interact:
+                    if out_of_core:
+                        print("\nInteractive masking: loading the data and mask in memory")
+                        data, mask = ooc.load(data), ooc.load(mask)
+                        gc.collect()
+                    plt.ioff()
+                    #############################################
+                    # remove aliens
+                    #############################################
+                    nz, ny, nx = np.shape(data)
+                    width = 5
+                    max_colorbar = 5
+                    flag_mask = False
+                    flag_aliens = True
+
+                    fig_mask, ((ax0, ax1), (ax2, ax3)) = plt.subplots(
+                        nrows=2, ncols=2, figsize=(12, 6)
                     )
-                nz, ny, nx = data.shape
-                print(
-                    "\nData size after interpolation into an orthonormal frame:", nz, ny, nx
-                )
+                    fig_mask.canvas.mpl_disconnect(fig_mask.canvas.manager.key_press_handler_id)
+                    original_data = np.copy(data)
+                    original_mask = np.copy(mask)
+                    frame_index = starting_frame
+                    ax0.imshow(data[frame_index[0], :, :], vmin=0, vmax=max_colorbar, cmap=my_cmap)
+                    ax1.imshow(data[:, frame_index[1], :], vmin=0, vmax=max_colorbar, cmap=my_cmap)
+                    ax2.imshow(data[:, :, frame_index[2]], vmin=0, vmax=max_colorbar, cmap=my_cmap)
+                    ax3.set_visible(False)
+                    ax0.axis("scaled")
+                    ax1.axis("scaled")
+                    ax2.axis("scaled")
+                    if not use_rawdata:
+                        ax0.invert_yaxis()  # detector Y is vertical down
+                    ax0.set_title(f"XY - Frame {frame_index[0] + 1} / {nz}")
+                    ax1.set_title(f"XZ - Frame {frame_index[1] + 1} / {ny}")
+                    ax2.set_title(f"YZ - Frame {frame_index[2] + 1} / {nx}")
+                    fig_mask.text(
+                        0.60, 0.30, "m mask ; b unmask ; u next frame ; d previous frame", size=12
+                    )
+                    fig_mask.text(
+                        0.60,
+                        0.25,
+                        "up larger ; down smaller ; right darker ; left brighter",
+                        size=12,
+                    )
+                    fig_mask.text(0.60, 0.20, "p plot full image ; q quit", size=12)
+                    plt.tight_layout()
+                    plt.connect("key_press_event", press_key)
+                    fig_mask.set_facecolor(background_plot)
+                    plt.show()
+                    del fig_mask, original_data, original_mask
+                    gc.collect()
 
-                # plot normalization by incident monitor for the gridded data
-                if normalize_flux:
-                    plt.ion()
-                    tmp_data = np.copy(
-                        data
-                    )  # do not modify the raw data before the interpolation
-                    tmp_data[tmp_data < 5] = 0  # threshold the background
-                    tmp_data[mask == 1] = 0
-                    fig = gu.combined_plots(
-                        tuple_array=(monitor, tmp_data),
-                        tuple_sum_frames=(False, True),
-                        tuple_sum_axis=(0, 1),
-                        tuple_width_v=None,
-                        tuple_width_h=None,
-                        tuple_colorbar=(False, False),
-                        tuple_vmin=(np.nan, 0),
-                        tuple_vmax=(np.nan, np.nan),
-                        tuple_title=(
-                            "monitor.min() / monitor",
-                            "Gridded normed data (threshold 5)\n",
-                        ),
-                        tuple_scale=("linear", "log"),
-                        xlabel=("Frame number", "Q$_y$"),
-                        ylabel=("Counts (a.u.)", "Q$_x$"),
-                        position=(323, 122),
+                    mask[np.nonzero(mask)] = 1
+
+                    fig, _, _ = gu.multislices_plot(
+                        data,
+                        sum_frames=True,
+                        scale="log",
+                        plot_colorbar=True,
+                        vmin=0,
+                        title="Data after aliens removal\n",
                         is_orthogonal=not use_rawdata,
                         reciprocal_space=True,
                     )
 
-                    fig.savefig(
-                        detector.savedir
-                        + f"monitor_gridded_S{scan_nb}_{nz}_{ny}_{nx}"
-                        + binning_comment
-                        + ".png"
-                    )
-                    if flag_interact:
-                        fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
-                        cid = plt.connect("close_event", close_event)
-                        fig.waitforbuttonpress()
-                        plt.disconnect(cid)
+                    fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
+                    cid = plt.connect("close_event", close_event)
+                    fig.waitforbuttonpress()
+                    plt.disconnect(cid)
                     plt.close(fig)
-                    plt.ioff()
-                    del tmp_data
-                    gc.collect()
 
-        ########################
-        # crop/pad/center data #
-        ########################
-        data, mask, pad_width, q_values, frames_logical = pru.center_fft(
-            data=data,
-            mask=mask,
-            detector=detector,
-            frames_logical=frames_logical,
-            centering=centering,
-            fft_option=center_fft,
-            pad_size=pad_size,
-            fix_bragg=fix_bragg,
-            fix_size=fix_size,
-            q_values=q_values,
-        )
-
-        starting_frame = [
-            pad_width[0],
-            pad_width[2],
-            pad_width[4],
-        ]  # no need to check padded frames
-        print("\nPad width:", pad_width)
-        nz, ny, nx = data.shape
-        print("\nData size after cropping / padding:", nz, ny, nx)
-
-        ##########################################
-        # optional masking of zero photon events #
-        ##########################################
-        if mask_zero_event:
-            # mask points when there is no intensity along the whole rocking curve
-            # probably dead pixels
-            temp_mask = np.zeros((ny, nx))
-            temp_mask[np.sum(data, axis=0) == 0] = 1
-            mask[np.repeat(temp_mask[np.newaxis, :, :], repeats=nz, axis=0) == 1] = 1
-            del temp_mask
-
-        ###########################################
-        # save data and mask before alien removal #
-        ###########################################
-        fig, _, _ = gu.multislices_plot(
-            data,
-            sum_frames=True,
-            scale="log",
-            plot_colorbar=True,
-            vmin=0,
-            title="Data before aliens removal\n",
-            is_orthogonal=not use_rawdata,
-            reciprocal_space=True,
-        )
-        if debug:
-            plt.savefig(
-                detector.savedir + f"data_before_masking_sum_S{scan_nb}_{nz}_{ny}_{nx}_"
-                f"{detector.binning[0]}_"
-                f"{detector.binning[1]}_{detector.binning[2]}.png"
-            )
-        if flag_interact:
-            fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
-            cid = plt.connect("close_event", close_event)
-            fig.waitforbuttonpress()
-            plt.disconnect(cid)
-        plt.close(fig)
-
-        piz, piy, pix = np.unravel_index(data.argmax(), data.shape)
-        fig = gu.combined_plots(
-            (data[piz, :, :], data[:, piy, :], data[:, :, pix]),
-            tuple_sum_frames=False,
-            tuple_sum_axis=0,
-            tuple_width_v=None,
-            tuple_width_h=None,
-            tuple_colorbar=True,
-            tuple_vmin=0,
-            tuple_vmax=np.nan,
-            tuple_scale="log",
-            tuple_title=("data at max in xy", "data at max in xz", "data at max in yz"),
-            is_orthogonal=not use_rawdata,
-            reciprocal_space=False,
-        )
-        if debug:
-            plt.savefig(
-                detector.savedir
-                + f"data_before_masking_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
-                f"{detector.binning[1]}_{detector.binning[2]}.png"
-            )
-        if flag_interact:
-            fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
-            cid = plt.connect("close_event", close_event)
-            fig.waitforbuttonpress()
-            plt.disconnect(cid)
-        plt.close(fig)
-
-        fig, _, _ = gu.multislices_plot(
-            mask,
-            sum_frames=True,
-            scale="linear",
-            plot_colorbar=True,
-            vmin=0,
-            vmax=(nz, ny, nx),
-            title="Mask before aliens removal\n",
-            is_orthogonal=not use_rawdata,
-            reciprocal_space=True,
-        )
-        if debug:
-            plt.savefig(
-                detector.savedir
-                + f"mask_before_masking_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
-                f"{detector.binning[1]}_{detector.binning[2]}.png"
-            )
+                    fig, _, _ = gu.multislices_plot(
+                        mask,
+                        sum_frames=True,
+                        scale="linear",
+                        plot_colorbar=True,
+                        vmin=0,
+                        vmax=(nz, ny, nx),
+                        title="Mask after aliens removal\n",
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
+                    )
 
-        if flag_interact:
-            fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
-            cid = plt.connect("close_event", close_event)
-            fig.waitforbuttonpress()
-            plt.disconnect(cid)
-        plt.close(fig)
-
-        ###############################################
-        # save the orthogonalized diffraction pattern #
-        ###############################################
-        if not use_rawdata and len(q_values) != 0:
-            qx = q_values[0]
-            qz = q_values[1]
-            qy = q_values[2]
-
-            if save_to_vti:
-                # save diffraction pattern to vti
-                (
-                    nqx,
-                    nqz,
-                    nqy,
-                ) = (
-                    data.shape
-                )  # in nexus z downstream, y vertical / in q z vertical, x downstream
-                print("\ndqx, dqy, dqz = ", qx[1] - qx[0], qy[1] - qy[0], qz[1] - qz[0])
-                # in nexus z downstream, y vertical / in q z vertical, x downstream
-                qx0 = qx.min()
-                dqx = (qx.max() - qx0) / nqx
-                qy0 = qy.min()
-                dqy = (qy.max() - qy0) / nqy
-                qz0 = qz.min()
-                dqz = (qz.max() - qz0) / nqz
-
-                gu.save_to_vti(
-                    filename=os.path.join(
-                        detector.savedir, f"S{scan_nb}_ortho_int" + comment + ".vti"
-                    ),
-                    voxel_size=(dqx, dqz, dqy),
-                    tuple_array=data,
-                    tuple_fieldnames="int",
-                    origin=(qx0, qz0, qy0),
-                )
+                    fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
+                    cid = plt.connect("close_event", close_event)
+                    fig.waitforbuttonpress()
+                    plt.disconnect(cid)
+                    plt.close(fig)
 
-        if flag_interact:
-            plt.ioff()
-            #############################################
-            # remove aliens
-            #############################################
-            nz, ny, nx = np.shape(data)
-            width = 5
-            max_colorbar = 5
-            flag_mask = False
-            flag_aliens = True
+                    #############################################
+                    # define mask
+                    #############################################
+                    width = 0
+                    max_colorbar = 5
+                    flag_aliens = False
+                    flag_mask = True
+                    flag_pause = False  # press x to pause for pan/zoom
+                    previous_axis = None
+                    xy = []  # list of points for mask
+
+                    fig_mask, ((ax0, ax1), (ax2, ax3)) = plt.subplots(
+                        nrows=2, ncols=2, figsize=(12, 6)
+                    )
+                    fig_mask.canvas.mpl_disconnect(fig_mask.canvas.manager.key_press_handler_id)
+                    original_data = np.copy(data)
+                    updated_mask = np.zeros((nz, ny, nx))
+                    data[mask == 1] = 0  # will appear as grey in the log plot (nan)
+                    ax0.imshow(
+                        np.log10(abs(data).sum(axis=0)), vmin=0, vmax=max_colorbar, cmap=my_cmap
+                    )
+                    ax1.imshow(
+                        np.log10(abs(data).sum(axis=1)), vmin=0, vmax=max_colorbar, cmap=my_cmap
+                    )
+                    ax2.imshow(
+                        np.log10(abs(data).sum(axis=2)), vmin=0, vmax=max_colorbar, cmap=my_cmap
+                    )
+                    ax3.set_visible(False)
+                    ax0.axis("scaled")
+                    ax1.axis("scaled")
+                    ax2.axis("scaled")
+                    if not use_rawdata:
+                        ax0.invert_yaxis()  # detector Y is vertical down
+                    ax0.set_title("XY")
+                    ax1.set_title("XZ")
+                    ax2.set_title("YZ")
+                    fig_mask.text(
+                        0.60, 0.45, "click to select the vertices of a polygon mask", size=12
+                    )
+                    fig_mask.text(
+                        0.60, 0.40, "x to pause/resume polygon masking for pan/zoom", size=12
+                    )
+                    fig_mask.text(0.60, 0.35, "p plot mask ; r reset current points", size=12)
+                    fig_mask.text(
+                        0.60,
+                        0.30,
+                        "m square mask ; b unmask ; right darker ; left brighter",
+                        size=12,
+                    )
+                    fig_mask.text(
+                        0.60, 0.25, "up larger masking box ; down smaller masking box", size=12
+                    )
+                    fig_mask.text(0.60, 0.20, "a restart ; q quit", size=12)
+                    info_text = fig_mask.text(0.60, 0.05, "masking enabled", size=16)
+                    plt.tight_layout()
+                    plt.connect("key_press_event", press_key)
+                    plt.connect("button_press_event", on_click)
+                    fig_mask.set_facecolor(background_plot)
+                    plt.show()
+
+                    mask[np.nonzero(updated_mask)] = 1
+                    data = original_data
+
+                    del fig_mask, flag_pause, flag_mask, original_data, updated_mask
+                    gc.collect()
+                    memory("interactive masking")
 
-            fig_mask, ((ax0, ax1), (ax2, ax3)) = plt.subplots(
-                nrows=2, ncols=2, figsize=(12, 6)
-            )
-            fig_mask.canvas.mpl_disconnect(fig_mask.canvas.manager.key_press_handler_id)
-            original_data = np.copy(data)
-            original_mask = np.copy(mask)
-            frame_index = starting_frame
-            ax0.imshow(data[frame_index[0], :, :], vmin=0, vmax=max_colorbar, cmap=my_cmap)
-            ax1.imshow(data[:, frame_index[1], :], vmin=0, vmax=max_colorbar, cmap=my_cmap)
-            ax2.imshow(data[:, :, frame_index[2]], vmin=0, vmax=max_colorbar, cmap=my_cmap)
-            ax3.set_visible(False)
-            ax0.axis("scaled")
-            ax1.axis("scaled")
-            ax2.axis("scaled")
-            if not use_rawdata:
-                ax0.invert_yaxis()  # detector Y is vertical down
-            ax0.set_title(f"XY - Frame {frame_index[0] + 1} / {nz}")
-            ax1.set_title(f"XZ - Frame {frame_index[1] + 1} / {ny}")
-            ax2.set_title(f"YZ - Frame {frame_index[2] + 1} / {nx}")
-            fig_mask.text(
-                0.60, 0.30, "m mask ; b unmask ; u next frame ; d previous frame", size=12
-            )
-            fig_mask.text(
-                0.60,
-                0.25,
-                "up larger ; down smaller ; right darker ; left brighter",
-                size=12,
-            )
-            fig_mask.text(0.60, 0.20, "p plot full image ; q quit", size=12)
-            plt.tight_layout()
-            plt.connect("key_press_event", press_key)
-            fig_mask.set_facecolor(background_plot)
-            plt.show()
-            del fig_mask, original_data, original_mask
-            gc.collect()
+                    if out_of_core:
+                        data = scratch.store("data", data)
+                        mask = scratch.store("mask", mask)
+                        gc.collect()
 
-            mask[np.nonzero(mask)] = 1
-
-            fig, _, _ = gu.multislices_plot(
-                data,
-                sum_frames=True,
-                scale="log",
-                plot_colorbar=True,
-                vmin=0,
-                title="Data after aliens removal\n",
-                is_orthogonal=not use_rawdata,
-                reciprocal_space=True,
+                if out_of_core:
+                    ooc.apply_mask(data, mask)
+                else:
+                    mask[np.nonzero(mask)] = 1
+                    data[mask == 1] = 0
+                checkpoints.store(
+                    "masking",
+                    data=data,
+                    mask=mask,
+                    automask_file=automask_file,
+                    files=[automask_file] if automask_file else [],
+                )
+            else:
+                data, mask = state["data"], state["mask"]
+                automask_file = state["automask_file"]
+                if out_of_core:
+                    data = scratch.store("data", data)
+                    mask = scratch.store("mask", mask)
+
+            state = checkpoints.restore(
+                "filtering",
+                dict(
+                    flag_medianfilter=flag_medianfilter,
+                    medfilt_order=medfilt_order,
+                    photon_threshold=photon_threshold,
+                ),
             )
+            if state is None:
+                #############################################
+                # mask or median filter isolated empty pixels
+                #############################################
+                if flag_medianfilter in {"mask_isolated", "interp_isolated", "median"}:
+                    if flag_medianfilter == "median":
+                        print("\nApplying median filtering")
+                    else:
+                        print("\nFiltering isolated pixels")
+                    nb_pix = filtering.filter_frames(
+                        data,
+                        mask,
+                        flag_medianfilter,
+                        start=pad_width[0],
+                        stop=nz - pad_width[1],  # filter only frames whith data (not padded)
+                        nb_neighbours=medfilt_order,
+                        n_workers=filter_workers,
+                        debugging=debug,
+                    )
+                    if flag_medianfilter != "median":
+                        print("Total number of filtered pixels: ", nb_pix)
+                else:
+                    print("\nSkipping median filtering")
+
+                ##########################
+                # apply photon threshold #
+                ##########################
+                if photon_threshold != 0:
+                    if out_of_core:
+                        ooc.photon_threshold(data, mask, photon_threshold)
+                    else:
+                        mask[data < photon_threshold] = 1
+                        data[data < photon_threshold] = 0
+                    print("\nApplying photon threshold < ", photon_threshold)
 
-            fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
-            cid = plt.connect("close_event", close_event)
-            fig.waitforbuttonpress()
-            plt.disconnect(cid)
-            plt.close(fig)
-
-            fig, _, _ = gu.multislices_plot(
-                mask,
-                sum_frames=True,
-                scale="linear",
-                plot_colorbar=True,
-                vmin=0,
-                vmax=(nz, ny, nx),
-                title="Mask after aliens removal\n",
-                is_orthogonal=not use_rawdata,
-                reciprocal_space=True,
-            )
+                ################################################
+                # check for nans and infs in the data and mask #
+                ################################################
+                nz, ny, nx = data.shape
+                print("\nData size after masking:", nz, ny, nx)
 
-            fig.canvas.mpl_disconnect(fig.canvas.manager.key_press_handler_id)
-            cid = plt.connect("close_event", close_event)
-            fig.waitforbuttonpress()
-            plt.disconnect(cid)
-            plt.close(fig)
-
-            #############################################
-            # define mask
-            #############################################
-            width = 0
-            max_colorbar = 5
-            flag_aliens = False
-            flag_mask = True
-            flag_pause = False  # press x to pause for pan/zoom
-            previous_axis = None
-            xy = []  # list of points for mask
-
-            fig_mask, ((ax0, ax1), (ax2, ax3)) = plt.subplots(
-                nrows=2, ncols=2, figsize=(12, 6)
-            )
-            fig_mask.canvas.mpl_disconnect(fig_mask.canvas.manager.key_press_handler_id)
-            original_data = np.copy(data)
-            updated_mask = np.zeros((nz, ny, nx))
-            data[mask == 1] = 0  # will appear as grey in the log plot (nan)
-            ax0.imshow(
-                np.log10(abs(data).sum(axis=0)), vmin=0, vmax=max_colorbar, cmap=my_cmap
-            )
-            ax1.imshow(
-                np.log10(abs(data).sum(axis=1)), vmin=0, vmax=max_colorbar, cmap=my_cmap
-            )
-            ax2.imshow(
-                np.log10(abs(data).sum(axis=2)), vmin=0, vmax=max_colorbar, cmap=my_cmap
-            )
-            ax3.set_visible(False)
-            ax0.axis("scaled")
-            ax1.axis("scaled")
-            ax2.axis("scaled")
-            if not use_rawdata:
-                ax0.invert_yaxis()  # detector Y is vertical down
-            ax0.set_title("XY")
-            ax1.set_title("XZ")
-            ax2.set_title("YZ")
-            fig_mask.text(
-                0.60, 0.45, "click to select the vertices of a polygon mask", size=12
-            )
-            fig_mask.text(
-                0.60, 0.40, "x to pause/resume polygon masking for pan/zoom", size=12
-            )
-            fig_mask.text(0.60, 0.35, "p plot mask ; r reset current points", size=12)
-            fig_mask.text(
-                0.60,
-                0.30,
-                "m square mask ; b unmask ; right darker ; left brighter",
-                size=12,
-            )
-            fig_mask.text(
-                0.60, 0.25, "up larger masking box ; down smaller masking box", size=12
-            )
-            fig_mask.text(0.60, 0.20, "a restart ; q quit", size=12)
-            info_text = fig_mask.text(0.60, 0.05, "masking enabled", size=16)
-            plt.tight_layout()
-            plt.connect("key_press_event", press_key)
-            plt.connect("button_press_event", on_click)
-            fig_mask.set_facecolor(background_plot)
-            plt.show()
-
-            mask[np.nonzero(updated_mask)] = 1
-            data = original_data
-
-            del fig_mask, flag_pause, flag_mask, original_data, updated_mask
-            gc.collect()
+                if out_of_core:
+                    ooc.remove_nan(data, mask)
+                    ooc.apply_mask(data, mask)
+                else:
+                    data, mask = util.remove_nan(data=data, mask=mask)
 
-        mask[np.nonzero(mask)] = 1
-        data[mask == 1] = 0
-
-        #############################################
-        # mask or median filter isolated empty pixels
-        #############################################
-        if flag_medianfilter in {"mask_isolated", "interp_isolated"}:
-            print("\nFiltering isolated pixels")
-            nb_pix = 0
-            for idx in range(
-                pad_width[0], nz - pad_width[1]
-            ):  # filter only frames whith data (not padded)
-                data[idx, :, :], processed_pix, mask[idx, :, :] = pru.mean_filter(
-                    data=data[idx, :, :],
-                    nb_neighbours=medfilt_order,
-                    mask=mask[idx, :, :],
-                    interpolate=flag_medianfilter,
-                    min_count=3,
-                    debugging=debug,
-                )
-                nb_pix += processed_pix
-                sys.stdout.write(
-                    f"\rImage {idx}, number of filtered pixels: {processed_pix}"
-                )
-                sys.stdout.flush()
-            print("\nTotal number of filtered pixels: ", nb_pix)
-        elif flag_medianfilter == "median":  # apply median filter
-            print("\nApplying median filtering")
-            for idx in range(
-                pad_width[0], nz - pad_width[1]
-            ):  # filter only frames whith data (not padded)
-                data[idx, :, :] = scipy.signal.medfilt2d(data[idx, :, :], [3, 3])
-        else:
-            print("\nSkipping median filtering")
+                    data[mask == 1] = 0
+                memory("masking and filtering")
 
-        ##########################
-        # apply photon threshold #
-        ##########################
-        if photon_threshold != 0:
-            mask[data < photon_threshold] = 1
-            data[data < photon_threshold] = 0
-            print("\nApplying photon threshold < ", photon_threshold)
+                ####################
+                # debugging plots  #
+                ####################
+                plt.ion()
+                if debug and out_of_core:
+                    z0, y0, x0 = map(int, ooc.center_of_mass(data))
+                    fig = gu.combined_plots(
+                        (data[z0, :, :], data[:, y0, :], data[:, :, x0]),
+                        tuple_sum_frames=False,
+                        tuple_sum_axis=0,
+                        tuple_width_v=None,
+                        tuple_width_h=None,
+                        tuple_colorbar=True,
+                        tuple_vmin=0,
+                        tuple_vmax=np.nan,
+                        tuple_scale="log",
+                        tuple_title=tuple(f"Masked data {plane}" for plane in plot_title[::-1]),
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
+                    )
+                    plt.savefig(
+                        detector.savedir
+                        + f"middle_frame_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                    )
+                    if not flag_interact:
+                        plt.close(fig)
 
-        ################################################
-        # check for nans and infs in the data and mask #
-        ################################################
-        nz, ny, nx = data.shape
-        print("\nData size after masking:", nz, ny, nx)
+                    fig = plot_sums(
+                        data,
+                        title="Masked data",
+                        planes=plot_title[::-1],
+                        is_orthogonal=not use_rawdata,
+                    )
+                    plt.savefig(
+                        detector.savedir + f"sum_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                    )
+                    if not flag_interact:
+                        plt.close(fig)
 
-        data, mask = util.remove_nan(data=data, mask=mask)
+                    fig = plot_sums(
+                        mask,
+                        title="Mask",
+                        planes=plot_title[::-1],
+                        scale="linear",
+                        vmax=(nz, ny, nx),
+                        is_orthogonal=not use_rawdata,
+                    )
+                    plt.savefig(
+                        detector.savedir + f"mask_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                    )
+                    if not flag_interact:
+                        plt.close(fig)
 
-        data[mask == 1] = 0
+                elif debug:
+                    z0, y0, x0 = center_of_mass(data)
+                    fig, _, _ = gu.multislices_plot(
+                        data,
+                        sum_frames=False,
+                        scale="log",
+                        plot_colorbar=True,
+                        vmin=0,
+                        title="Masked data",
+                        slice_position=[int(z0), int(y0), int(x0)],
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
+                    )
+                    plt.savefig(
+                        detector.savedir
+                        + f"middle_frame_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                    )
+                    if not flag_interact:
+                        plt.close(fig)
 
-        ####################
-        # debugging plots  #
-        ####################
-        plt.ion()
-        if debug:
-            z0, y0, x0 = center_of_mass(data)
-            fig, _, _ = gu.multislices_plot(
-                data,
-                sum_frames=False,
-                scale="log",
-                plot_colorbar=True,
-                vmin=0,
-                title="Masked data",
-                slice_position=[int(z0), int(y0), int(x0)],
-                is_orthogonal=not use_rawdata,
-                reciprocal_space=True,
-            )
-            plt.savefig(
-                detector.savedir
-                + f"middle_frame_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
-                f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
-            )
-            if not flag_interact:
-                plt.close(fig)
+                    fig, _, _ = gu.multislices_plot(
+                        data,
+                        sum_frames=True,
+                        scale="log",
+                        plot_colorbar=True,
+                        vmin=0,
+                        title="Masked data",
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
+                    )
+                    plt.savefig(
+                        detector.savedir + f"sum_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                    )
+                    if not flag_interact:
+                        plt.close(fig)
 
-            fig, _, _ = gu.multislices_plot(
-                data,
-                sum_frames=True,
-                scale="log",
-                plot_colorbar=True,
-                vmin=0,
-                title="Masked data",
-                is_orthogonal=not use_rawdata,
-                reciprocal_space=True,
-            )
-            plt.savefig(
-                detector.savedir + f"sum_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
-                f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
-            )
-            if not flag_interact:
-                plt.close(fig)
+                    fig, _, _ = gu.multislices_plot(
+                        mask,
+                        sum_frames=True,
+                        scale="linear",
+                        plot_colorbar=True,
+                        vmin=0,
+                        vmax=(nz, ny, nx),
+                        title="Mask",
+                        is_orthogonal=not use_rawdata,
+                        reciprocal_space=True,
+                    )
+                    plt.savefig(
+                        detector.savedir + f"mask_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
+                        f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                    )
+                    if not flag_interact:
+                        plt.close(fig)
 
-            fig, _, _ = gu.multislices_plot(
-                mask,
-                sum_frames=True,
-                scale="linear",
-                plot_colorbar=True,
-                vmin=0,
-                vmax=(nz, ny, nx),
-                title="Mask",
-                is_orthogonal=not use_rawdata,
-                reciprocal_space=True,
-            )
-            plt.savefig(
-                detector.savedir + f"mask_S{scan_nb}_{nz}_{ny}_{nx}_{detector.binning[0]}_"
-                f"{detector.binning[1]}_{detector.binning[2]}" + comment + ".png"
+                checkpoints.store("filtering", data=data, mask=mask)
+            else:
+                data, mask = state["data"], state["mask"]
+                nz, ny, nx = data.shape
+                if out_of_core:
+                    data = scratch.store("data", data)
+                    mask = scratch.store("mask", mask)
+
+            ##################################################
+            # bin the stacking axis if needed, the detector  #
+            # plane was already binned when loading the data #
+            ##################################################
+            state = checkpoints.restore(
+                "binning", dict(binning=detector.binning[0], reload_orthogonal=reload_orthogonal)
             )
-            if not flag_interact:
-                plt.close(fig)
-
-        ##################################################
-        # bin the stacking axis if needed, the detector  #
-        # plane was already binned when loading the data #
-        ##################################################
-        if (
-            detector.binning[0] != 1 and not reload_orthogonal
-        ):  # data was already binned for reload_orthogonal
-            data = util.bin_data(data, (detector.binning[0], 1, 1), debugging=False)
-            mask = util.bin_data(mask, (detector.binning[0], 1, 1), debugging=False)
-            mask[np.nonzero(mask)] = 1
-            if not use_rawdata and len(q_values) != 0:
-                numz = len(qx)
-                qx = qx[
-                    : numz - (numz % detector.binning[0]) : detector.binning[0]
-                ]  # along Z
-                del numz
-        print("\nData size after binning the stacking dimension:", data.shape)
-
-        ##################################################################
-        # final check of the shape to comply with FFT shape requirements #
-        ##################################################################
-        final_shape = util.smaller_primes(data.shape, maxprime=7, required_dividers=(2,))
-        com = tuple(map(lambda x: int(np.rint(x)), center_of_mass(data)))
-        crop_center = pu.find_crop_center(
-            array_shape=data.shape, crop_shape=final_shape, pivot=com
-        )
-        data = util.crop_pad(data, output_shape=final_shape, crop_center=crop_center)
-        mask = util.crop_pad(mask, output_shape=final_shape, crop_center=crop_center)
-        print("\nData size after considering FFT shape requirements:", data.shape)
-        nz, ny, nx = data.shape
-        comment = f"{comment}_{nz}_{ny}_{nx}" + binning_comment
-
-        ############################
-        # save final data and mask #
-        ############################
-        print("\nSaving directory:", detector.savedir)
-        if save_asint:
-            data = data.astype(int)
-        print("Data type before saving:", data.dtype)
-        mask[np.nonzero(mask)] = 1
-        mask = mask.astype(int)
-        print("Mask type before saving:", mask.dtype)
-        if not use_rawdata and len(q_values) != 0:
-            if save_to_npz:
-                np.savez_compressed(
-                    detector.savedir + f"QxQzQy_S{scan_nb}" + comment, qx=qx, qz=qz, qy=qy
+            if state is None:
+                if (
+                    detector.binning[0] != 1 and not reload_orthogonal
+                ):  # data was already binned for reload_orthogonal
+                    if out_of_core:
+                        binned_shape = (nz // detector.binning[0], ny, nx)
+                        data = ooc.bin_frames(
+                            data,
+                            detector.binning[0],
+                            out=scratch.empty("binned_data", binned_shape, ooc.sum_dtype(data.dtype)),
+                        )
+                        mask = ooc.bin_frames(
+                            mask,
+                            detector.binning[0],
+                            out=scratch.empty("binned_mask", binned_shape, ooc.sum_dtype(mask.dtype)),
+                        )
+                        ooc.binarize(mask)
+                        scratch.remove("data")
+                        scratch.remove("mask")
+                    else:
+                        data = util.bin_data(data, (detector.binning[0], 1, 1), debugging=False)
+                        mask = util.bin_data(mask, (detector.binning[0], 1, 1), debugging=False)
+                        mask[np.nonzero(mask)] = 1
+                    if not use_rawdata and len(q_values) != 0:
+                        numz = len(qx)
+                        qx = qx[
+                            : numz - (numz % detector.binning[0]) : detector.binning[0]
+                        ]  # along Z
+                        del numz
+                print("\nData size after binning the stacking dimension:", data.shape)
+
+                ##################################################################
+                # final check of the shape to comply with FFT shape requirements #
+                ##################################################################
+                final_shape = util.smaller_primes(data.shape, maxprime=7, required_dividers=(2,))
+                if out_of_core:
+                    com = tuple(map(lambda x: int(np.rint(x)), ooc.center_of_mass(data)))
+                    data, mask = ooc.load(data), ooc.load(mask)
+                else:
+                    com = tuple(map(lambda x: int(np.rint(x)), center_of_mass(data)))
+                crop_center = pu.find_crop_center(
+                    array_shape=data.shape, crop_shape=final_shape, pivot=com
                 )
-            if save_to_mat:
-                savemat(detector.savedir + f"S{scan_nb}_qx.mat", {"qx": qx})
-                savemat(detector.savedir + f"S{scan_nb}_qz.mat", {"qz": qz})
-                savemat(detector.savedir + f"S{scan_nb}_qy.mat", {"qy": qy})
-            max_z = data.sum(axis=0).max()
-            fig, _, _ = gu.contour_slices(
-                data,
-                (qx, qz, qy),
-                sum_frames=True,
-                title="Final data",
-                plot_colorbar=True,
-                scale="log",
-                is_orthogonal=True,
-                levels=np.linspace(0, np.ceil(np.log10(max_z)), 150, endpoint=False),
-                reciprocal_space=True,
+                data = util.crop_pad(data, output_shape=final_shape, crop_center=crop_center)
+                mask = util.crop_pad(mask, output_shape=final_shape, crop_center=crop_center)
+                print("\nData size after considering FFT shape requirements:", data.shape)
+                memory("binning and final cropping")
+                checkpoints.store(
+                    "binning",
+                    data=data,
+                    mask=mask,
+                    **({"qx": qx} if not use_rawdata and len(q_values) != 0 else {}),
+                )
+            else:
+                data, mask = state["data"], state["mask"]
+                if "qx" in state:
+                    qx = state["qx"]
+            nz, ny, nx = data.shape
+            comment = f"{comment}_{nz}_{ny}_{nx}" + binning_comment
+
+            ############################
+            # save final data and mask #
+            ############################
+            data_file, mask_file = (
+                output.filename(detector.savedir + f"S{scan_nb}_pynx" + comment, save_format),
+                output.filename(detector.savedir + f"S{scan_nb}_maskpynx" + comment, save_format),
             )
-            fig.savefig(
-                detector.savedir + f"final_reciprocal_space_S{scan_nb}" + comment + ".png"
+            state = checkpoints.restore(
+                "save",
+                dict(
+                    savedir=detector.savedir,
+                    comment=comment,
+                    save_asint=save_asint,
+                    save_to_npz=save_to_npz,
+                    save_to_mat=save_to_mat,
+                    save_format=save_format,
+                ),
             )
-            plt.close(fig)
+            if state is None:
+                print("\nSaving directory:", detector.savedir)
+                if save_asint:
+                    data = data.astype(int)
+                print("Data type before saving:", data.dtype)
+                mask[np.nonzero(mask)] = 1
+                mask = mask.astype(int)
+                print("Mask type before saving:", mask.dtype)
+                if not use_rawdata and len(q_values) != 0:
+                    if save_to_npz:
+                        output.save(
+                            detector.savedir + f"QxQzQy_S{scan_nb}" + comment,
+                            fmt=save_format,
+                            qx=qx,
+                            qz=qz,
+                            qy=qy,
+                        )
+                    if save_to_mat:
+                        savemat(detector.savedir + f"S{scan_nb}_qx.mat", {"qx": qx})
+                        savemat(detector.savedir + f"S{scan_nb}_qz.mat", {"qz": qz})
+                        savemat(detector.savedir + f"S{scan_nb}_qy.mat", {"qy": qy})
+                    max_z = data.sum(axis=0).max()
+                    fig, _, _ = gu.contour_slices(
+                        data,
+                        (qx, qz, qy),
+                        sum_frames=True,
+                        title="Final data",
+                        plot_colorbar=True,
+                        scale="log",
+                        is_orthogonal=True,
+                        levels=np.linspace(0, np.ceil(np.log10(max_z)), 150, endpoint=False),
+                        reciprocal_space=True,
+                    )
+                    fig.savefig(
+                        detector.savedir + f"final_reciprocal_space_S{scan_nb}" + comment + ".png"
+                    )
+                    plt.close(fig)
 
-        if save_to_npz:
-            np.savez_compressed(detector.savedir + f"S{scan_nb}_pynx" + comment, data=data)
-            np.savez_compressed(
-                detector.savedir + f"S{scan_nb}_maskpynx" + comment, mask=mask
-            )
+                if save_to_npz:
+                    output.save(
+                        detector.savedir + f"S{scan_nb}_pynx" + comment, fmt=save_format, data=data
+                    )
+                    output.save(
+                        detector.savedir + f"S{scan_nb}_maskpynx" + comment,
+                        fmt=save_format,
+                        mask=mask,
+                    )
 
-        if save_to_mat:
-            # save to .mat, the new order is x y z (outboard, vertical up, downstream)
-            savemat(
-                detector.savedir + f"S{scan_nb}_data.mat",
-                {"data": np.moveaxis(data.astype(np.float32), [0, 1, 2], [-1, -2, -3])},
-            )
-            savemat(
-                detector.savedir + f"S{scan_nb}_mask.mat",
-                {"data": np.moveaxis(mask.astype(np.int8), [0, 1, 2], [-1, -2, -3])},
-            )
+                if save_to_mat:
+                    # save to .mat, the new order is x y z (outboard, vertical up, downstream)
+                    savemat(
+                        detector.savedir + f"S{scan_nb}_data.mat",
+                        {"data": np.moveaxis(data.astype(np.float32), [0, 1, 2], [-1, -2, -3])},
+                    )
+                    savemat(
+                        detector.savedir + f"S{scan_nb}_mask.mat",
+                        {"data": np.moveaxis(mask.astype(np.int8), [0, 1, 2], [-1, -2, -3])},
+                    )
 
-        ############################
-        # plot final data and mask #
-        ############################
-        data[np.nonzero(mask)] = 0
-        fig, _, _ = gu.multislices_plot(
-            data,
-            sum_frames=True,
-            scale="log",
-            plot_colorbar=True,
-            vmin=0,
-            title="Final data",
-            is_orthogonal=not use_rawdata,
-            reciprocal_space=True,
-        )
-        plt.savefig(detector.savedir + f"finalsum_S{scan_nb}" + comment + ".png")
-        if not flag_interact:
-            plt.close(fig)
-
-        fig, _, _ = gu.multislices_plot(
-            mask,
-            sum_frames=True,
-            scale="linear",
-            plot_colorbar=True,
-            vmin=0,
-            vmax=(nz, ny, nx),
-            title="Final mask",
-            is_orthogonal=not use_rawdata,
-            reciprocal_space=True,
-        )
-        plt.savefig(detector.savedir + f"finalmask_S{scan_nb}" + comment + ".png")
-        if not flag_interact:
-            plt.close(fig)
+                ############################
+                # plot final data and mask #
+                ############################
+                data[np.nonzero(mask)] = 0
+                fig, _, _ = gu.multislices_plot(
+                    data,
+                    sum_frames=True,
+                    scale="log",
+                    plot_colorbar=True,
+                    vmin=0,
+                    title="Final data",
+                    is_orthogonal=not use_rawdata,
+                    reciprocal_space=True,
+                )
+                plt.savefig(detector.savedir + f"finalsum_S{scan_nb}" + comment + ".png")
+                if not flag_interact:
+                    plt.close(fig)
 
-        del data, mask
-        gc.collect()
+                fig, _, _ = gu.multislices_plot(
+                    mask,
+                    sum_frames=True,
+                    scale="linear",
+                    plot_colorbar=True,
+                    vmin=0,
+                    vmax=(nz, ny, nx),
+                    title="Final mask",
+                    is_orthogonal=not use_rawdata,
+                    reciprocal_space=True,
+                )
+                plt.savefig(detector.savedir + f"finalmask_S{scan_nb}" + comment + ".png")
+                if not flag_interact:
+                    plt.close(fig)
+                checkpoints.store(
+                    "save", files=[data_file, mask_file] if save_to_npz else []
+                )
 
-        if len(scans) > 1:
-            plt.close("all")
+            del data, mask
+            gc.collect()
+            if out_of_core:
+                scratch.cleanup()
+            memory("saving")
+            outputs[scan_nb] = {
+                "savedir": detector.savedir,
+                "data_file": data_file if save_to_npz else None,
+                "mask_file": mask_file if save_to_npz else None,
+                "automask_file": automask_file,
+                "shape": (nz, ny, nx),
+                "peak_memory": memory.summary(),
+                "cached_stages": [
+                    stage
+                    for stage, status in checkpoints.status.items()
+                    if status == "cached"
+                ],
+            }
+            if checkpoint_dir:
+                print("\n" + checkpoints.report())
+
+            if len(scans) > 1:
+                plt.close("all")
+        finally:
+            # remove the scratch files also when the scan fails
+            if scratch is not None:
+                scratch.cleanup()
 
     print("\nEnd of script")
     plt.ioff()
     plt.show()
 
     ############################################################## ADDED SCRIPT ################################################################
-    if not GUI:
+    if not GUI and not headless:
         # Modify file for phase retrieval
         print("Saving in pynx run ...")
 
         with open(f"{detector.savedir}pynx_run.txt", "r") as f:
             text_file = f.readlines()
             
-            text_file[1] = f"data = \"{detector.savedir}S{scan_nb}_pynx{comment}.npz\"\n"
-            text_file[2] = f"mask = \"{detector.savedir}S{scan_nb}_maskpynx{comment}.npz\"\n"
+            pynx_data, pynx_mask = data_file, mask_file
+            if save_format == "npy":
+                # pynx reads the .npy files, not the directory of the "npy" format
+                pynx_data = os.path.join(data_file, "data.npy")
+                pynx_mask = os.path.join(mask_file, "mask.npy")
+            text_file[1] = f"data = \"{pynx_data}\"\n"
+            text_file[2] = f"mask = \"{pynx_mask}\"\n"
 
             with open(f"{save_dir}pynx_run.txt", "w") as v:
                 new_file_contents = "".join(text_file)
                 v.write(new_file_contents)
+
+    return outputs
@@ -30,6 +30,7 @@ import bcdi.preprocessing.preprocessing_utils as pru
 import bcdi.simulation.simulation_utils as simu
 import bcdi.utils.utilities as util
 import bcdi.utils.validation as valid
+from gwaihir.runner import output
 
 def strain_bcdi(
     scan, 
@@ -112,6 +113,7 @@ def strain_bcdi(
     alpha,
     reconstruction_file,
     GUI,
+    save_format="npz",
     ):
     """
     Interpolate the output of the phase retrieval into an orthonormal frame,
@@ -131,6 +133,10 @@ def strain_bcdi(
     second the column (horizontal axis). Therefore the data structure is data[qx, qz,
     qy] for reciprocal space, or data[z, y, x] for real space
 
+    The arrays are saved with gwaihir.runner.output in the save_format format:
+    "npz" (np.savez_compressed, default), "h5" (HDF5 with a fast multithreaded
+    codec) or "npy" (directory of raw .npy files). In the "h5" format, the
+    amplitude, phase and strain are only saved in the .h5 results file.
 
     Remember to delete the waitforbuttonpress, root tk and file path
     """
@@ -558,8 +564,9 @@ def strain_bcdi(
     # save the phase with the ramp for PRTF calculations,          #
     # otherwise the object will be misaligned with the measurement #
     ################################################################
-    np.savez_compressed(
+    output.save(
         detector.savedir + "S" + str(scan) + "_avg_obj_prtf" + comment,
+        fmt=save_format,
         obj=amp * np.exp(1j * phase),
     )
 
@@ -595,15 +602,18 @@ def strain_bcdi(
         support = np.zeros((numz, numy, numx))
         support[abs(avg_obj) / abs(avg_obj).max() > 0.01] = 1
         # low threshold because support will be cropped by shrinkwrap during phasing
-        np.savez_compressed(
-            detector.savedir + "S" + str(scan) + "_support" + comment, obj=support
+        output.save(
+            detector.savedir + "S" + str(scan) + "_support" + comment,
+            fmt=save_format,
+            obj=support,
         )
         del support
         gc.collect()
 
     if save_raw:
-        np.savez_compressed(
+        output.save(
             detector.savedir + "S" + str(scan) + "_raw_amp-phase" + comment,
+            fmt=save_format,
             amp=abs(avg_obj),
             phase=np.angle(avg_obj),
         )
@@ -709,9 +719,9 @@ def strain_bcdi(
             file_path = filedialog.askopenfilename(
                 title="Select the file containing QxQzQy",
                 initialdir=detector.savedir,
-                filetypes=[("NPZ", "*.npz")],
+                filetypes=output.FILETYPES,
             )
-            npzfile = np.load(file_path)
+            npzfile = output.load(file_path)
             qx = npzfile["qx"]
             qy = npzfile["qy"]
             qz = npzfile["qz"]
@@ -1027,18 +1037,20 @@ def strain_bcdi(
     bulk = pu.find_bulk(amp=amp, support_threshold=isosurface_strain, method="threshold")
     if save:
         params["comment"] = comment
-        np.savez_compressed(
-            f"{detector.savedir}S{scan}_amp{phase_fieldname}strain{comment}",
-            amp=amp,
-            phase=phase,
-            bulk=bulk,
-            strain=strain,
-            q_com=q_final,
-            voxel_sizes=voxel_size,
-            detector=detector.params,
-            setup=setup.params,
-            params=params,
-        )
+        if save_format != "h5":  # same name as the results file
+            output.save(
+                f"{detector.savedir}S{scan}_amp{phase_fieldname}strain{comment}",
+                fmt=save_format,
+                amp=amp,
+                phase=phase,
+                bulk=bulk,
+                strain=strain,
+                q_com=q_final,
+                voxel_sizes=voxel_size,
+                detector=detector.params,
+                setup=setup.params,
+                params=params,
+            )
 
         # save results in hdf5 file
         with h5py.File(
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+Scaling of the per-facet extraction with the number of facets:
+former cell rescan for each facet versus the facet index built at load time.
+
+Usage: python bench_facet_index.py [n_points]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gwaihir.facet_analysis import Facets
+from synthetic_mesh import make_synthetic_mesh
+
+
+def legacy_extract_all(vtk_data, nb_facets):
+    """Former extract_facet, called for every facet: rescans all the cells each time."""
+    facet_id = list(vtk_data['facet_id'])
+    x0, y0, z0 = list(vtk_data['x0']), list(vtk_data['y0']), list(vtk_data['z0'])
+    strain = list(vtk_data['strain'])
+    means = np.zeros(nb_facets + 1)
+    for ind in range(nb_facets + 1):
+        voxel_indices = []
+        for i in range(len(facet_id)):
+            if int(facet_id[i]) == ind:
+                voxel_indices.append(x0[i])
+                voxel_indices.append(y0[i])
+                voxel_indices.append(z0[i])
+        voxel_indices = list(set(voxel_indices))
+        means[ind] = np.mean([strain[int(j)] for j in voxel_indices])
+    return means
+
+
+def indexed_extract_all(facets):
+    """Index build, one slice per facet and segmented statistics."""
+    facets.build_facet_index()
+    for ind in range(facets.nb_facets + 1):
+        facets.extract_facet(ind, plot = False)
+    means, _ = facets.facet_mean_std('strain')
+    return means
+
+
+if __name__ == "__main__":
+    n_points = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"{n_points} points")
+    print(f"{'facets':>8} {'legacy (s)':>12} {'index (s)':>12} {'speed-up':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_facets in [10, 25, 50, 100, 200, 400]:
+            filename = make_synthetic_mesh(os.path.join(tmp, f"mesh_{n_facets}.vtk"), n_points = n_points, n_facets = n_facets)
+
+            facets = Facets.__new__(Facets)
+            facets.pathsave = tmp + "/facets_analysis/"
+            facets.path_to_data = filename
+            facets.load_vtk()
+
+            t0 = time.perf_counter()
+            old_means = legacy_extract_all(facets.vtk_data, facets.nb_facets)
+            t_old = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            new_means = indexed_extract_all(facets)
+            t_new = time.perf_counter() - t0
+
+            assert np.allclose(old_means, new_means, equal_nan = True)
+            print(f"{facets.nb_facets:>8} {t_old:>12.3f} {t_new:>12.4f} {t_old / t_new:>9.0f}x")
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+"""
+Frames per second of the filtering stage of preprocess_bcdi, the former
+sequential loop against gwaihir.runner.filtering with several numbers of
+workers, on a synthetic detector stack, and check that the filtered data and
+mask are bit-identical.
+
+Usage: python bench_filtering.py [n_frames] [n_pixels] [method] [workers ...]
+    method: median, interp_isolated or mask_isolated (default is all of them)
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.signal
+import bcdi.preprocessing.preprocessing_utils as pru
+
+from gwaihir.runner import filtering
+
+
+def make_stack(n_frames, n_pixels, seed=0):
+    """Bragg peak on a noisy background with isolated empty pixels, and a mask"""
+    rng = np.random.default_rng(seed)
+    z, y, x = np.ogrid[:n_frames, :n_pixels, :n_pixels]
+    center = n_pixels / 2
+    peak = 1e4 * np.exp(
+        -((z - n_frames / 2) ** 2 / 50 + (y - center) ** 2 / 200 + (x - center) ** 2 / 200)
+    )
+    data = rng.poisson(peak + 5).astype(float)
+    data[rng.random(data.shape) < 1e-3] = 0
+    mask = np.zeros(data.shape)
+    mask[:, :10, :10] = 1
+    return data, mask
+
+
+def sequential(data, mask, method, nb_neighbours):
+    """Former loop of preprocess_bcdi"""
+    nb_pix = 0
+    for idx in range(data.shape[0]):
+        if method == "median":
+            data[idx, :, :] = scipy.signal.medfilt2d(data[idx, :, :], [3, 3])
+        else:
+            data[idx, :, :], processed_pix, mask[idx, :, :] = pru.mean_filter(
+                data=data[idx, :, :],
+                nb_neighbours=nb_neighbours,
+                mask=mask[idx, :, :],
+                interpolate=method,
+                min_count=3,
+            )
+            nb_pix += processed_pix
+    return nb_pix
+
+
+def main(n_frames=64, n_pixels=256, methods=None, workers=None):
+    methods = methods or ["median", "interp_isolated", "mask_isolated"]
+    workers = workers or sorted({1, 2, os.cpu_count() or 1})
+    data, mask = make_stack(n_frames, n_pixels)
+    print(f"{n_frames} frames of {n_pixels}x{n_pixels} pixels, {os.cpu_count()} cpus")
+
+    for method in methods:
+        ref_data, ref_mask = data.copy(), mask.copy()
+        start = time.perf_counter()
+        ref_pix = sequential(ref_data, ref_mask, method, nb_neighbours=7)
+        duration = time.perf_counter() - start
+        print(f"\n{method}: sequential loop {n_frames / duration:.1f} frames/s")
+
+        for n_workers in workers:
+            new_data, new_mask = data.copy(), mask.copy()
+            start = time.perf_counter()
+            nb_pix = filtering.filter_frames(
+                new_data, new_mask, method, nb_neighbours=7, n_workers=n_workers
+            )
+            new_duration = time.perf_counter() - start
+            assert nb_pix == ref_pix
+            assert np.array_equal(new_data, ref_data) and np.array_equal(new_mask, ref_mask)
+            print(
+                f"{method}: {n_workers} workers {n_frames / new_duration:.1f} frames/s,"
+                f" x{duration / new_duration:.2f}, identical output"
+            )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        n_frames=int(args[0]) if len(args) > 0 else 64,
+        n_pixels=int(args[1]) if len(args) > 1 else 256,
+        methods=[args[2]] if len(args) > 2 else None,
+        workers=[int(arg) for arg in args[3:]] or None,
+    )
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+"""
+Follow a synthetic FLY scan written in a loop by another process with LiveROI,
+then check the live curves against calcROI_new2 on the finished scan.
+Reports the time of each update, only the new frames being read.
+
+Usage: python bench_live_roi.py [n_frames] [frames_per_write]
+"""
+
+import os
+# The writer and the reader open the file at the same time
+os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+
+import multiprocessing
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gwaihir.sixs import ReadNxs4 as rd
+from gwaihir.sixs.live_roi import LiveROI
+from synthetic_nxs import make_synthetic_scan, append_frames
+
+
+def writer(filename, n_frames, frames_per_write, interval):
+    """Append frames_per_write points every interval seconds"""
+    for seed in range(1, n_frames // frames_per_write):
+        time.sleep(interval)
+        append_frames(filename, frames_per_write, seed = seed)
+
+
+if __name__ == "__main__":
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    frames_per_write = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = make_synthetic_scan(
+            os.path.join(tmp, "live_scan.nxs"),
+            n_frames = frames_per_write,
+            n_rois = 10,
+            extendable = True,
+            )
+
+        process = multiprocessing.Process(target = writer, args = (filename, n_frames, frames_per_write, 0.5))
+        process.start()
+
+        live = LiveROI(filename)
+        times = []
+
+        def report(live):
+            print(f"{live.npts:>6} points, {live.curves[live.roinames[0]][-1]:.1f} on {live.roinames[0]}")
+
+        last = time.time()
+        while process.is_alive() or time.time() - last < 1:
+            start = time.perf_counter()
+            new = live.update()
+            if new:
+                times.append((new, time.perf_counter() - start))
+                report(live)
+                last = time.time()
+            else:
+                time.sleep(0.1)
+        process.join()
+        live.update()
+
+        frames = sum(el[0] for el in times)
+        total = sum(el[1] for el in times)
+        print(f"{len(times)} updates, {frames} frames, {total / len(times) * 1e3:.1f} ms per update, {frames / total:.0f} frames/s")
+
+        # Same curves as the full scan
+        data = rd.DataSet(filename)
+        data.calcROI_new2()
+        for name in live.roinames:
+            assert np.allclose(live.curves[name], getattr(data, name), equal_nan = True), name
+        print(f"{len(live.roinames)} live ROI curves equal to calcROI_new2 on {live.npts} points")
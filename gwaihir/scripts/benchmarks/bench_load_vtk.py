@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+"""
+Compare the vectorized Facets.load_vtk with the former per point / per cell loader
+on a synthetic FacetAnalyser mesh, and check that both give the same data.
+
+Usage: python bench_load_vtk.py [n_points] [n_facets]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import vtk
+
+from gwaihir.facet_analysis import Facets
+from synthetic_mesh import make_synthetic_mesh
+
+
+def legacy_load_vtk(path_to_data):
+    """Former loader, one vtk call per point, per cell and per facet."""
+    reader = vtk.vtkGenericDataObjectReader()
+    reader.SetFileName(path_to_data)
+    reader.ReadAllScalarsOn()
+    reader.ReadAllVectorsOn()
+    reader.ReadAllTensorsOn()
+    reader.Update()
+    vtkdata = reader.GetOutput()
+    pointData = vtkdata.GetPointData()
+    cellData = vtkdata.GetCellData()
+    fieldData = vtkdata.GetFieldData()
+
+    n_points = vtkdata.GetNumberOfPoints()
+    n_cells = vtkdata.GetNumberOfCells()
+
+    vtk_data = {}
+    vtk_data['x'] = [vtkdata.GetPoint(i)[0] for i in range(n_points)]
+    vtk_data['y'] = [vtkdata.GetPoint(i)[1] for i in range(n_points)]
+    vtk_data['z'] = [vtkdata.GetPoint(i)[2] for i in range(n_points)]
+    vtk_data['strain'] = [pointData.GetArray('strain').GetValue(i) for i in range(n_points)]
+    vtk_data['disp'] = [pointData.GetArray('disp').GetValue(i) for i in range(n_points)]
+    vtk_data['facet_probabilities'] = [cellData.GetArray('FacetProbabilities').GetValue(i) for i in range(n_cells)]
+    vtk_data['facet_id'] = [cellData.GetArray('FacetIds').GetValue(i) for i in range(n_cells)]
+    vtk_data['x0'] = [vtkdata.GetCell(i).GetPointId(0) for i in range(n_cells)]
+    vtk_data['y0'] = [vtkdata.GetCell(i).GetPointId(1) for i in range(n_cells)]
+    vtk_data['z0'] = [vtkdata.GetCell(i).GetPointId(2) for i in range(n_cells)]
+
+    nb_facets = int(max(vtk_data['facet_id']))
+
+    stats = {k: np.zeros(nb_facets) for k in ['strain_mean', 'strain_std', 'disp_mean', 'disp_std']}
+    for ind in range(1, nb_facets + 1):
+        voxel_indices = []
+        for i in range(len(vtk_data['facet_id'])):
+            if int(vtk_data['facet_id'][i]) == ind:
+                voxel_indices.append(vtk_data['x0'][i])
+                voxel_indices.append(vtk_data['y0'][i])
+                voxel_indices.append(vtk_data['z0'][i])
+        voxel_indices = list(set(voxel_indices))
+        strain = np.array([vtk_data['strain'][int(j)] for j in voxel_indices])
+        disp = np.array([vtk_data['disp'][int(j)] for j in voxel_indices])
+        stats['strain_mean'][ind-1] = np.mean(strain)
+        stats['strain_std'][ind-1] = np.std(strain)
+        stats['disp_mean'][ind-1] = np.mean(disp)
+        stats['disp_std'][ind-1] = np.std(disp)
+
+    field_data = pd.DataFrame()
+    field_data['facet_id'] = [fieldData.GetArray('FacetIds').GetValue(i) for i in range(nb_facets)]
+    for k, v in stats.items():
+        field_data[k] = v
+    field_data['n0'] = [fieldData.GetArray('facetNormals').GetValue(3*i) for i in range(nb_facets)]
+    field_data['n1'] = [fieldData.GetArray('facetNormals').GetValue(3*i+1) for i in range(nb_facets)]
+    field_data['n2'] = [fieldData.GetArray('facetNormals').GetValue(3*i+2) for i in range(nb_facets)]
+    field_data['rel_facet_size'] = [fieldData.GetArray('relFacetSize').GetValue(i) for i in range(nb_facets)]
+
+    return vtk_data, field_data
+
+
+def new_load_vtk(path_to_data):
+    """Vectorized loader, without building the widgets of Facets.__init__"""
+    facets = Facets.__new__(Facets)
+    facets.pathsave = os.path.dirname(path_to_data) + "/facets_analysis/"
+    facets.path_to_data = path_to_data
+    facets.load_vtk()
+    return facets.vtk_data, facets.field_data
+
+
+if __name__ == "__main__":
+    n_points = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_facets = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = make_synthetic_mesh(os.path.join(tmp, "mesh.vtk"), n_points = n_points, n_facets = n_facets)
+
+        t0 = time.perf_counter()
+        old_vtk_data, old_field_data = legacy_load_vtk(filename)
+        t_old = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        new_vtk_data, new_field_data = new_load_vtk(filename)
+        t_new = time.perf_counter() - t0
+
+    for key, values in old_vtk_data.items():
+        assert np.allclose(values, new_vtk_data[key]), key
+    for key in old_field_data.columns:
+        assert np.allclose(old_field_data[key], new_field_data[key]), key
+
+    print(f"{n_points} points, {n_facets} facets")
+    print(f"Legacy loader:     {t_old:8.3f} s")
+    print(f"Vectorized loader: {t_new:8.3f} s")
+    print(f"Speed-up:          {t_old / t_new:8.1f}x")
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+"""
+ROI integration of a 1000-frame detector stack with 10 to 50 ROIs:
+former calcROI_new2 (one pass over the stack and one masked copy of the stack per ROI)
+versus the single-pass engine (DataSet.roi_sums), from memory and from the file.
+
+Usage: python bench_multi_roi.py [n_frames]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gwaihir.sixs import ReadNxs4 as rd
+from synthetic_nxs import make_synthetic_scan
+
+
+def legacy_roi_sum_mask(stack, roi, mask):
+    """Former roi_sum_mask: masked copy of the whole stack for each ROI."""
+    _stack = stack[:]*(1-mask.astype('uint16'))
+    return _stack[:,roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]].sum(axis=1).sum(axis=1)
+
+
+def legacy_calc_rois(data, detname):
+    """Former calcROI_new2 loop for one detector, returns the corrected ROIs."""
+    stack = np.asarray(data.getStack(detname))
+    mask = data.__getattribute__('_mask_' + detname)
+    data.calcFattenuation()
+    f_shi = np.concatenate((data._fattenuations[2:], data._fattenuations[-1:], data._fattenuations[-1:]))
+    results = {}
+    for pos, roi in enumerate(data.__getattribute__('_roi_limits_' + detname)):
+        integrals = legacy_roi_sum_mask(stack, roi, mask)
+        name = data.__getattribute__('_roi_names_' + detname)[pos] + '_' + detname + '_new'
+        results[name] = (integrals*f_shi)/data._integration_time
+    return results
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    print(f"{n_frames} frames of 240 x 560 pixels, masked ROIs")
+    print(f"{'ROIs':>6} {'former (s)':>12} {'memory (s)':>12} {'file (s)':>10} {'speed-up':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rois in [10, 20, 30, 50]:
+            filename = make_synthetic_scan(os.path.join(tmp, f"scan_{n_rois}.nxs"), n_frames = n_frames, n_rois = n_rois)
+
+            # Stack in memory for both
+            data = rd.DataSet(filename, lazy = False)
+            t_legacy, expected = timed(legacy_calc_rois, data, 'xpad140')
+            t_memory, _ = timed(data.calcROI_new2)
+
+            # Stack read from the file by blocks of frames
+            lazy_data = rd.DataSet(filename, lazy = True)
+            t_file, _ = timed(lazy_data.calcROI_new2)
+
+            for name, values in expected.items():
+                assert np.array_equal(values, getattr(data, name)), name
+                assert np.array_equal(values, getattr(lazy_data, name)), name
+
+            print(f"{n_rois:>6} {t_legacy:>12.2f} {t_memory:>12.2f} {t_file:>10.2f} {t_legacy / t_memory:>9.1f}x")
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+"""
+Peak memory and time of the frame-wise stages of preprocess_bcdi, in memory
+(numpy expressions of preprocess_bcdi) and out of core (gwaihir.runner.out_of_core),
+on a synthetic detector stack, and check that both give the same data and mask.
+
+Each mode runs in its own process so that the peak resident memory is its own.
+
+Usage: python bench_out_of_core.py [n_frames] [n_pixels] [binning]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from gwaihir.runner import out_of_core as ooc
+
+
+def make_stack(filename, n_frames, n_pixels, seed=0):
+    """Bragg peak on a noisy background, with nan and dead columns, written by
+    blocks of frames in a HDF5 file, with a mask"""
+    rng = np.random.default_rng(seed)
+    h5file = h5py.File(filename, "w")
+    shape = (n_frames, n_pixels, n_pixels)
+    data = h5file.create_dataset("data", shape=shape, dtype=np.float32, chunks=(1,) + shape[1:])
+    y, x = np.ogrid[:n_pixels, :n_pixels]
+    center = n_pixels / 2
+    for frames in ooc.frame_slices(data.shape, data.dtype):
+        z = np.arange(frames.start, frames.stop)[:, None, None]
+        peak = 1e4 * np.exp(
+            -((z - n_frames / 2) ** 2 / 50 + (y - center) ** 2 / 200 + (x - center) ** 2 / 200)
+        )
+        block = rng.poisson(peak + 0.5).astype(np.float32)
+        block[:, :, :3] = 0
+        block[rng.random(block.shape) < 1e-5] = np.nan
+        data[frames] = block
+    mask = h5file.create_dataset("mask", shape=shape, dtype=np.float32, chunks=(1,) + shape[1:])
+    mask[:, :10, :10] = 1
+    h5file.close()
+
+
+def in_memory(filename, binning, threshold):
+    """Same expressions as preprocess_bcdi"""
+    with h5py.File(filename, "r") as h5file:
+        data = h5file["data"][()]
+        mask = h5file["mask"][()]
+    nz, ny, nx = data.shape
+
+    temp_mask = np.zeros((ny, nx))
+    temp_mask[np.sum(data, axis=0) == 0] = 1
+    mask[np.repeat(temp_mask[np.newaxis, :, :], repeats=nz, axis=0) == 1] = 1
+    del temp_mask
+
+    mask[np.nonzero(mask)] = 1
+    data[mask == 1] = 0
+
+    mask[data < threshold] = 1
+    data[data < threshold] = 0
+
+    # bcdi.utils.utilities.remove_nan
+    mask[np.isnan(data)] = 1
+    mask[np.isnan(mask)] = 1
+    mask[np.isinf(data)] = 1
+    mask[np.isinf(mask)] = 1
+    mask[np.nonzero(mask)] = 1
+    data[np.isnan(data)] = 0
+    data[np.isinf(data)] = 0
+    data[mask == 1] = 0
+
+    # bcdi.utils.utilities.bin_data along axis 0
+    nz = nz - nz % binning
+    data = data[:nz].reshape((-1, binning, ny, nx)).sum(axis=1)
+    mask = mask[:nz].reshape((-1, binning, ny, nx)).sum(axis=1)
+    mask[np.nonzero(mask)] = 1
+    return data, mask
+
+
+def out_of_core(filename, binning, threshold, scratch):
+    """Same stages with the out-of-core helpers"""
+    with h5py.File(filename, "r") as h5file:
+        data = scratch.store("data", h5file["data"])
+        mask = scratch.store("mask", h5file["mask"])
+    nz, ny, nx = data.shape
+
+    ooc.mask_zero_event(data, mask)
+    ooc.apply_mask(data, mask)
+    ooc.photon_threshold(data, mask, threshold)
+    ooc.remove_nan(data, mask)
+    ooc.apply_mask(data, mask)
+
+    binned_shape = (nz // binning, ny, nx)
+    data = ooc.bin_frames(
+        data, binning, out=scratch.empty("binned_data", binned_shape, ooc.sum_dtype(data.dtype))
+    )
+    mask = ooc.bin_frames(
+        mask, binning, out=scratch.empty("binned_mask", binned_shape, ooc.sum_dtype(mask.dtype))
+    )
+    ooc.binarize(mask)
+    scratch.remove("data")
+    scratch.remove("mask")
+    return data, mask
+
+
+def run(mode, directory, binning, threshold=1):
+    filename = os.path.join(directory, "stack.h5")
+    start = time.perf_counter()
+    if mode == "memory":
+        data, mask = in_memory(filename, binning, threshold)
+    else:
+        scratch = ooc.ScratchSpace(directory)
+        data, mask = out_of_core(filename, binning, threshold, scratch)
+    duration = time.perf_counter() - start
+    peak = ooc.memory_usage()[1]
+    with h5py.File(os.path.join(directory, f"result_{mode}.h5"), "w") as h5file:
+        for name, array in (("data", data), ("mask", mask)):
+            out = h5file.create_dataset(name, shape=array.shape, dtype=array.dtype)
+            for frames in ooc.frame_slices(array.shape, array.dtype):
+                out[frames] = array[frames]
+    print(duration, peak)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit()
+
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n_pixels = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    binning = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_stack(os.path.join(directory, "stack.h5"), n_frames, n_pixels)
+        size = n_frames * n_pixels**2 * 4 / 2**20
+        print(f"{n_frames} frames of {n_pixels}x{n_pixels} float32, {size:.0f} MB")
+
+        for mode in ("memory", "out-of-core"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--run", mode, directory, str(binning)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split()
+            duration, peak = float(output[-2]), float(output[-1])
+            print(f"{mode:>12}: {duration:6.2f} s, peak memory {peak / 2**20:6.0f} MB")
+
+        with h5py.File(os.path.join(directory, "result_memory.h5"), "r") as expected, \
+                h5py.File(os.path.join(directory, "result_out-of-core.h5"), "r") as result:
+            for name in ("data", "mask"):
+                assert expected[name].shape == result[name].shape, name
+                for frames in ooc.frame_slices(result[name].shape, result[name].dtype):
+                    assert np.array_equal(expected[name][frames], result[name][frames]), name
+        print("same data and mask")
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+Write and read times and file sizes of the output formats of
+gwaihir.runner.output (np.savez_compressed, HDF5 with blosc/lz4 or lzf, raw
+.npy files) on a synthetic detector stack, and check that the arrays read back
+are identical.
+
+Usage: python bench_output.py [n_frames] [n_pixels]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gwaihir.runner import output
+
+
+def make_stack(n_frames, n_pixels, seed=0):
+    """Bragg peak on a noisy background and a mask of detector gaps"""
+    rng = np.random.default_rng(seed)
+    z, y, x = np.ogrid[:n_frames, :n_pixels, :n_pixels]
+    center = n_pixels / 2
+    peak = 1e4 * np.exp(
+        -((z - n_frames / 2) ** 2 / 50 + (y - center) ** 2 / 200 + (x - center) ** 2 / 200)
+    )
+    data = rng.poisson(peak + 1).astype(float)
+    mask = np.zeros(data.shape)
+    mask[:, n_pixels // 3 : n_pixels // 3 + 4, :] = 1
+    return data, mask
+
+
+def size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def main(n_frames=64, n_pixels=256):
+    data, mask = make_stack(n_frames, n_pixels)
+    print(
+        f"{n_frames} frames of {n_pixels}x{n_pixels} pixels"
+        f" ({(data.nbytes + mask.nbytes) / 2**20:.0f} MB),"
+        f" h5 compression: {'blosc/lz4' if output.hdf5plugin else 'lzf'}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in output.FORMATS:
+            start = time.perf_counter()
+            path = output.save(os.path.join(directory, fmt), fmt=fmt, data=data, mask=mask)
+            write = time.perf_counter() - start
+
+            start = time.perf_counter()
+            arrays = output.load(path)
+            new_data, new_mask = np.asarray(arrays["data"]), np.asarray(arrays["mask"])
+            read = time.perf_counter() - start
+
+            assert np.array_equal(new_data, data) and np.array_equal(new_mask, mask)
+            print(
+                f"{fmt:>4}: write {write:6.2f} s, read {read:6.2f} s,"
+                f" {size(path) / 2**20:6.1f} MB, identical arrays"
+            )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        n_frames=int(args[0]) if len(args) > 0 else 64,
+        n_pixels=int(args[1]) if len(args) > 1 else 256,
+    )
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+"""
+Batch gaussian fits of sixs.peak_fit against one utilities3.fitgauss1d
+(scipy leastsq) per curve, on synthetic rocking curves.
+
+Usage: python bench_peak_fit.py [n_curves] [n_points] [n_workers]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from gwaihir.sixs import utilities3 as ut
+from gwaihir.sixs.peak_fit import fit_curves, moment_guess, PARAMETERS
+
+
+def rocking_curves(n_curves, n_points, seed = 0):
+    """Gaussian peaks on a linear background with poisson noise, and their parameters"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1, 1, n_points)
+    p = np.column_stack([
+        rng.uniform(200, 2000, n_curves),    # area
+        rng.uniform(-0.3, 0.3, n_curves),    # center
+        rng.uniform(0.05, 0.2, n_curves),    # sigma
+        rng.uniform(50, 200, n_curves),      # bkg
+        rng.uniform(-20, 20, n_curves),      # slope
+        ])
+    y = p[:, 0, None]/(p[:, 2, None]*np.sqrt(2*np.pi))*np.exp(-(x-p[:, 1, None])**2/(2*p[:, 2, None]**2))
+    y += p[:, 3, None] + p[:, 4, None]*x
+    return x, rng.poisson(y).astype(float), p
+
+
+if __name__ == "__main__":
+    n_curves = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 101
+    n_workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    x, y, _ = rocking_curves(n_curves, n_points)
+    print(f"{n_curves} curves of {n_points} points")
+
+    start = time.perf_counter()
+    guess = moment_guess(x, y)
+    t_guess = time.perf_counter() - start
+
+    start = time.perf_counter()
+    p_loop = np.array([ut.fitgauss1d(x, curve, p = list(p0))[0] for curve, p0 in zip(y, guess)])
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = fit_curves(x, y)
+    t_lm = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table_pool = fit_curves(x, y, method = "pool", n_workers = n_workers)
+    t_pool = time.perf_counter() - start
+
+    print(f"moment guesses         {t_guess:8.4f} s")
+    print(f"fitgauss1d loop        {t_loop:8.3f} s")
+    print(f"fit_curves 'lm'        {t_lm:8.3f} s  {t_loop / t_lm:5.1f}x")
+    print(f"fit_curves 'pool'      {t_pool:8.3f} s  {t_loop / t_pool:5.1f}x")
+
+    errors = [name + "_err" for name in PARAMETERS]
+    p_lm = table[PARAMETERS].to_numpy()
+    p_pool = table_pool[PARAMETERS].to_numpy()
+    err = table[errors].to_numpy()
+    # fitgauss1d does not fix the sign of sigma
+    p_loop[:, [0, 2]] = np.abs(p_loop[:, [0, 2]])
+    assert table["success"].all() and table_pool["success"].all()
+    # the minimizers stop at different tolerances, compare in units of the errors
+    assert np.all(np.abs(p_lm - p_loop) < 1e-2 * err), np.max(np.abs(p_lm - p_loop) / err, axis = 0)
+    assert np.all(np.abs(p_lm - p_pool) < 1e-2 * err)
+    assert np.allclose(err, table_pool[errors], rtol = 1e-3)
+    print("same parameters as fitgauss1d, same errors as curve_fit")
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+"""
+Time to draw the particle in 3D: one scatter per facet at full resolution (former plot_strain)
+versus a single scatter over the decimated points of Facets.decimate_facets.
+
+Usage: python bench_plot_lod.py [n_points] [lod_max_points]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from gwaihir.facet_analysis import Facets
+from synthetic_mesh import make_synthetic_mesh
+
+
+def draw(fig):
+    start = time.perf_counter()
+    fig.canvas.draw()
+    plt.close(fig)
+    return time.perf_counter() - start
+
+
+def legacy_plot(facets):
+    """One scatter call per facet, all the points."""
+    fig = plt.figure(figsize = (12, 10))
+    ax = fig.add_subplot(projection = '3d')
+    for ind in range(1, facets.nb_facets):
+        results = facets.extract_facet(ind, plot = False)
+        ax.scatter(results['x'], results['y'], results['z'], s = 50, c = results['strain'])
+    return fig
+
+
+def lod_plot(facets):
+    """Single scatter call, decimated points."""
+    fig = plt.figure(figsize = (12, 10))
+    ax = fig.add_subplot(projection = '3d')
+    points, _ = facets.facet_points(range(1, facets.nb_facets))
+    ax.scatter(
+        np.asarray(facets.vtk_data['x'])[points],
+        np.asarray(facets.vtk_data['y'])[points],
+        np.asarray(facets.vtk_data['z'])[points],
+        s = 50,
+        c = np.asarray(facets.vtk_data['strain'])[points],
+        )
+    return fig
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore", category = RuntimeWarning)
+
+    n_points = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lod_max_points = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = make_synthetic_mesh(os.path.join(tmp, "mesh.vtk"), n_points = n_points, n_facets = 40)
+        facets = Facets.__new__(Facets)
+        facets.pathsave = tmp + "/facets_analysis/"
+        facets.path_to_data = filename
+        facets.load_vtk()
+        facets.init_plot_options()
+        facets.lod_max_points = lod_max_points
+
+        start = time.perf_counter()
+        facets.decimate_facets()
+        t_decimate = time.perf_counter() - start
+        n_lod = len(facets.decimate_facets())
+
+        start = time.perf_counter()
+        fig = legacy_plot(facets)
+        t_legacy = time.perf_counter() - start + draw(fig)
+
+        start = time.perf_counter()
+        fig = lod_plot(facets)
+        t_lod = time.perf_counter() - start + draw(fig)
+
+        print(f"{len(facets.facet_index_points)} points, {n_lod} after decimation ({t_decimate:.3f} s, cached)")
+        print(f"full resolution, one scatter per facet: {t_legacy:.2f} s")
+        print(f"decimated, single scatter: {t_lod:.2f} s ({t_legacy / t_lod:.1f}x)")
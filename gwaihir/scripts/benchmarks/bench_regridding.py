@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+"""
+Time and peak memory of the gridding of the data and mask in the orthonormal
+laboratory frame of a synthetic rocking curve stack on a bcdi Setup (ID01,
+Maxipix), with:
+
+    - bcdi: pru.grid_bcdi_labframe (Setup.ortho_reciprocal, one
+      RegularGridInterpolator per array)
+    - computed: gwaihir.runner.gridding.grid_labframe, with the sparse operator
+      built and saved in the gridding cache
+    - cached: gwaihir.runner.gridding.grid_labframe, with the operator restored
+      from the gridding cache
+
+and check that the data, mask and q values of grid_labframe are the same as the
+ones of bcdi.
+
+Each mode runs in its own process so that the peak resident memory is its own.
+
+Usage: python bench_regridding.py [size] [n_workers] [align_q]
+"""
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import numpy as np
+import bcdi.preprocessing.preprocessing_utils as pru
+from bcdi.experiment.detector import create_detector
+from bcdi.experiment.setup import Setup
+
+from gwaihir.runner import gridding
+from gwaihir.runner import out_of_core as ooc
+
+MODES = ("bcdi", "computed", "cached")
+
+
+def make_stack(size, seed=0):
+    """Bragg peak on a noisy background and a mask of detector gaps"""
+    rng = np.random.default_rng(seed)
+    z, y, x = np.ogrid[:size, :size, :size]
+    peak = 1e4 * np.exp(-((z - size / 2) ** 2 + (y - size / 2) ** 2 + (x - size / 2) ** 2) / 200)
+    data = rng.poisson(peak + 1).astype(float)
+    mask = np.zeros(data.shape)
+    mask[:, size // 3 : size // 3 + 4, :] = 1
+    return data, mask
+
+
+def make_setup(shape, directory):
+    """ID01 setup of an out-of-plane rocking curve on a Maxipix ROI of the data shape"""
+    detector = create_detector(
+        name="Maxipix",
+        roi=[0, shape[1], 0, shape[2]],
+        binning=(1, 1, 1),
+        preprocessing_binning=(1, 1, 1),
+    )
+    detector.savedir = directory + "/"
+    setup = Setup(
+        beamline="ID01",
+        detector=detector,
+        energy=9000,
+        distance=0.5,
+        rocking_angle="outofplane",
+        outofplane_angle=35.0,
+        inplane_angle=2.0,
+        tilt_angle=0.01,
+        grazing_angle=(0.0,),
+    )
+    return detector, setup
+
+
+def run(mode, directory, size, n_workers, align_q):
+    data, mask = make_stack(size)
+    detector, setup = make_setup(data.shape, directory)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "bcdi":
+            data, mask, q_values = pru.grid_bcdi_labframe(
+                data, mask, detector, setup, align_q=align_q, fill_value=(0, 1)
+            )
+        else:
+            data, mask, q_values = gridding.grid_labframe(
+                data,
+                mask,
+                detector,
+                setup,
+                cache_dir=os.path.join(directory, "cache"),
+                align_q=align_q,
+                fill_value=(0, 1),
+                n_workers=n_workers,
+            )
+    duration = time.perf_counter() - start
+    peak = ooc.memory_usage()[1]
+    np.savez(
+        os.path.join(directory, f"{mode}.npz"),
+        data=data,
+        mask=mask,
+        **dict(zip(("qx", "qz", "qy"), q_values)),
+    )
+    print(duration, peak)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run(
+            sys.argv[2],
+            sys.argv[3],
+            int(sys.argv[4]),
+            int(sys.argv[5]),
+            sys.argv[6] == "True",
+        )
+        sys.exit()
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    align_q = len(sys.argv) > 3 and sys.argv[3].lower() in ("1", "true", "align_q")
+    print(f"{size}^3 stack, align_q={align_q}, {n_workers} threads")
+
+    with tempfile.TemporaryDirectory() as directory:
+        done = []
+        for mode in MODES:  # computed before cached
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--run",
+                    mode,
+                    directory,
+                    str(size),
+                    str(n_workers),
+                    str(align_q),
+                ],
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode != 0:  # e.g. killed when out of memory
+                print(f"{mode:>8}: failed with return code {process.returncode}")
+                continue
+            duration, peak = (float(val) for val in process.stdout.split()[-2:])
+            print(f"{mode:>8}: {duration:6.2f} s, peak memory {peak / 2**20:6.0f} MB")
+            done.append(mode)
+
+        if "bcdi" in done:
+            with np.load(os.path.join(directory, "bcdi.npz")) as npz:
+                expected = dict(npz)
+            shape = expected["data"].shape
+            print(f"q grid of {'x'.join(str(val) for val in shape)} voxels")
+            for mode in done[1:]:
+                with np.load(os.path.join(directory, f"{mode}.npz")) as npz:
+                    for name, reference in expected.items():
+                        assert np.allclose(
+                            npz[name], reference, rtol=1e-12, atol=1e-12
+                        ), f"{name}, {mode} operator"
+                print(
+                    f"{mode:>8}: same data, mask and q values as bcdi"
+                    " (relative difference < 1e-12)"
+                )
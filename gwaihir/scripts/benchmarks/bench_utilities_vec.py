@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+"""
+Equivalence and timing of the vectorized helpers of sixs.utilities_vec
+against the loops of sixs.utilities3, on synthetic rocking curves.
+
+Usage: python bench_utilities_vec.py [n_curves] [n_points]
+"""
+
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from gwaihir.sixs import utilities3 as ut
+from gwaihir.sixs import utilities_vec as utv
+
+
+def rocking_curves(n_curves, n_points, seed = 0):
+    """Gaussian peaks on a linear background, with noise and a few spikes"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1, 1, n_points)
+    center = rng.uniform(-0.3, 0.3, (n_curves, 1))
+    width = rng.uniform(0.05, 0.2, (n_curves, 1))
+    y = 1e4 * np.exp(-0.5 * ((x - center) / width)**2) + 100 + 20 * x
+    y = rng.poisson(y).astype(float)
+    spikes = rng.integers(0, n_points, (n_curves, 3))
+    np.put_along_axis(y, spikes, 1e5, axis = 1)
+    return x, y
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    n_curves = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 201
+    x, y = rocking_curves(n_curves, n_points)
+
+    # bintoM leaves empty bins as nan
+    warnings.filterwarnings("ignore", category = RuntimeWarning)
+
+    print(f"{n_curves} curves of {n_points} points")
+    print(f"{'function':>14} {'loops (s)':>10} {'vectorized (s)':>15} {'speed-up':>9}")
+
+    cases = {
+        "smoothGauss": (
+            lambda: [ut.smoothGauss(curve) for curve in y],
+            lambda: utv.smoothGauss(y),
+            ),
+        "numint": (
+            lambda: [ut.numint(x, curve) for curve in y],
+            lambda: utv.numint(x, y),
+            ),
+        "filterOutlier": (
+            lambda: [ut.filterOutlier(x, curve) for curve in y],
+            lambda: [utv.filterOutlier(x, curve) for curve in y],
+            ),
+        "bintoM": (
+            lambda: ut.bintoM(x, y.T, n_points // 3),
+            lambda: utv.bintoM(x, y.T, n_points // 3),
+            ),
+        }
+
+    for name, (loops, vectorized) in cases.items():
+        t_loops, expected = timed(loops)
+        t_vectorized, result = timed(vectorized)
+
+        if name == "filterOutlier":
+            for (xe, ye), (xr, yr) in zip(expected, result):
+                assert np.array_equal(xe, xr) and np.array_equal(ye, yr), name
+        elif name == "bintoM":
+            assert np.array_equal(expected[0], result[0]), name
+            assert np.allclose(expected[1], result[1], rtol = 1e-12, equal_nan = True), name
+        else:
+            assert np.allclose(np.squeeze(expected), np.squeeze(result), rtol = 1e-12), name
+
+        print(f"{name:>14} {t_loops:>10.3f} {t_vectorized:>15.4f} {t_loops / t_vectorized:>8.0f}x")
+
+    # Single curves, same output shapes
+    assert np.shape(utv.numint(x, y[0])) == np.shape(ut.numint(x, y[0]))
+    assert np.shape(utv.smoothGauss(y[0], 3)) == np.shape(ut.smoothGauss(y[0], 3))
+    assert np.allclose(utv.smoothGauss(list(y[0]), 6), ut.smoothGauss(list(y[0]), 6))
+    x_nan = x.copy()
+    x_nan[::7] = np.nan
+    assert np.allclose(ut.bintoM(x_nan, y[:5].T, 17)[1], utv.bintoM(x_nan, y[:5].T, 17)[1], equal_nan = True)
+    print("same results as utilities3")
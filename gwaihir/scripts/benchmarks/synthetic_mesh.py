@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+"""
+Write synthetic FacetAnalyser-like meshes (.vtk) used by the facet benchmarks.
+The files have the same arrays as the ones saved from ParaView:
+    point data: strain, disp
+    cell data: FacetProbabilities, FacetIds
+    field data: FacetIds, facetNormals, FacetCenters, interplanarAngles, absFacetSize, relFacetSize
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+def make_synthetic_mesh(
+    filename,
+    n_points = 100000,
+    n_facets = 30,
+    seed = 0,
+    ):
+    """
+    Save a random triangulated point cloud on a sphere in filename.
+    Cells get a facet id according to the closest of n_facets random directions,
+    cells far from every direction are set as edges and corners (id 0).
+    """
+    rng = np.random.default_rng(seed)
+
+    # Points on a sphere
+    points = rng.normal(size = (n_points, 3))
+    points /= np.linalg.norm(points, axis = 1)[:, None]
+    points *= 50
+
+    # Triangles made with neighbouring points in a random order
+    n_cells = 2 * n_points
+    order = np.argsort(np.arctan2(points[:, 1], points[:, 0]) + 10 * np.round(points[:, 2]))
+    first = rng.integers(0, n_points - 2, n_cells)
+    cells = np.stack([order[first], order[first + 1], order[first + 2]], axis = 1)
+
+    # Facets
+    facet_normals = rng.normal(size = (n_facets, 3))
+    facet_normals /= np.linalg.norm(facet_normals, axis = 1)[:, None]
+    centers = points[cells].mean(axis = 1)
+    scores = centers @ facet_normals.T / 50
+    facet_ids = np.argmax(scores, axis = 1) + 1
+    facet_ids[scores.max(axis = 1) < 0.9] = 0
+
+    # Build the poly data
+    polydata = vtk.vtkPolyData()
+
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points.astype(np.float32), deep = True))
+    polydata.SetPoints(vtk_points)
+
+    legacy_cells = np.hstack([np.full((n_cells, 1), 3), cells]).astype(np.int64).ravel()
+    polys = vtk.vtkCellArray()
+    polys.SetCells(n_cells, numpy_support.numpy_to_vtkIdTypeArray(legacy_cells, deep = True))
+    polydata.SetPolys(polys)
+
+    def add_array(data, name, target, n_components = 1):
+        array = numpy_support.numpy_to_vtk(data, deep = True)
+        array.SetName(name)
+        array.SetNumberOfComponents(n_components)
+        target.AddArray(array)
+
+    add_array(rng.normal(0, 1e-3, n_points), "strain", polydata.GetPointData())
+    add_array(rng.normal(0, 1e-1, n_points), "disp", polydata.GetPointData())
+
+    add_array(rng.random(n_cells), "FacetProbabilities", polydata.GetCellData())
+    add_array(facet_ids.astype(np.int32), "FacetIds", polydata.GetCellData())
+
+    field = polydata.GetFieldData()
+    sizes = np.bincount(facet_ids, minlength = n_facets + 1)[1:].astype(float)
+    add_array(np.arange(1, n_facets + 1, dtype = np.int32), "FacetIds", field)
+    add_array(facet_normals, "facetNormals", field, 3)
+    add_array(50 * facet_normals, "FacetCenters", field, 3)
+    add_array(np.rad2deg(np.arccos(np.clip(facet_normals[:, 2], -1, 1))), "interplanarAngles", field)
+    add_array(sizes, "absFacetSize", field)
+    add_array(sizes / sizes.sum(), "relFacetSize", field)
+
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(filename)
+    writer.SetInputData(polydata)
+    writer.SetFileTypeToBinary()
+    writer.Write()
+
+    return filename
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+"""
+Write synthetic SIXS NeXus files (.nxs) used by the ReadNxs4 benchmarks.
+The files have the nodes read by ReadNxs4.DataSet for a FLY scan:
+    scan_data: delta, mu, attenuation, attenuation_old, epoch and a 2D detector stack
+    SIXS: monochromator, attenuator coefficients, integration time and the detector
+    publisher (roi_limits, roi_name, ifmask, mask, distance_xpad)
+With extendable = True, the scan_data arrays can be extended with append_frames,
+to mimic a scan being recorded.
+"""
+
+import warnings
+
+import numpy as np
+import tables
+
+# Detector shape: (publisher name, node name)
+DETECTORS = {
+    (240, 560): ("i14-c-c00-ex-config-xpads140", "xpad_image"),
+    (120, 560): ("i14-c-c00-ex-config-xpads70", "xpad_image"),
+    (515, 515): ("i14-c-c00-ex-config-merlin", "merlin_image"),
+    }
+
+
+def make_synthetic_scan(
+    filename,
+    n_frames = 1000,
+    n_rois = 10,
+    detector_shape = (240, 560),
+    masked = True,
+    start_time = 1.7e9,
+    extendable = False,
+    seed = 0,
+    ):
+    """
+    Save a FLY scan with a stack of n_frames random images, chunked by frame,
+    and n_rois random ROIs in the detector publisher.
+    """
+    rng = np.random.default_rng(seed)
+    publisher, node = DETECTORS[tuple(detector_shape)]
+    ny, nx = detector_shape
+
+    width = rng.integers(5, nx // 2, n_rois)
+    height = rng.integers(5, ny // 2, n_rois)
+    rois = np.stack([
+        rng.integers(0, nx - width),
+        rng.integers(0, ny - height),
+        width,
+        height,
+        ], axis = 1)
+    mask = rng.random(detector_shape) < 0.02
+
+    # The SIXS node names are not python identifiers
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+
+        with tables.open_file(filename, "w") as f:
+            root = f.create_group("/", "scan_0001")
+            f.create_array(root, "start_time", np.array([start_time]))
+            f.create_array(root, "end_time", np.array([start_time + n_frames]))
+
+            scan_data = f.create_group(root, "scan_data")
+            if extendable:
+                for name in ["delta", "mu", "attenuation", "attenuation_old", "epoch"]:
+                    f.create_earray(scan_data, name, atom = tables.Float64Atom(), shape = (0,))
+                f.create_earray(
+                    scan_data,
+                    node,
+                    atom = tables.UInt16Atom(),
+                    shape = (0, ny, nx),
+                    chunkshape = (1, ny, nx),
+                    )
+            else:
+                for name in ["delta", "mu", "attenuation", "attenuation_old", "epoch"]:
+                    f.create_carray(scan_data, name, atom = tables.Float64Atom(), shape = (n_frames,))
+                f.create_carray(
+                    scan_data,
+                    node,
+                    atom = tables.UInt16Atom(),
+                    shape = (n_frames, ny, nx),
+                    chunkshape = (1, ny, nx),
+                    )
+
+            sixs = f.create_group(root, "SIXS")
+            mono = f.create_group(sixs, "i14-c-c02-op-mono")
+            f.create_array(mono, "lambda", np.array([0.8]))
+            f.create_array(mono, "energy", np.array([15.5]))
+            att = f.create_group(sixs, "i14-c-c00-ex-config-att")
+            f.create_array(att, "att_coef", np.array([2.1]))
+            att_old = f.create_group(sixs, "i14-c-c00-ex-config-att-old")
+            f.create_array(att_old, "att_coef", np.array([1.5]))
+            config = f.create_group(sixs, "i14-c-c00-ex-config-publisher")
+            f.create_array(config, "integration_time", np.array([0.1]))
+
+            config = f.create_group(sixs, publisher)
+            f.create_array(config, "roi_limits", rois)
+            f.create_array(config, "roi_name", np.array("\n".join(f"roi{i}" for i in range(n_rois)).encode()))
+            f.create_array(config, "distance_xpad", np.array([1.2]))
+            f.create_array(config, "ifmask", np.array([int(masked)]))
+            f.create_array(config, "mask", mask)
+
+    append_frames(filename, n_frames, seed = seed)
+    return filename
+
+
+def append_frames(
+    filename,
+    n_frames,
+    seed = 0,
+    ):
+    """
+    Write n_frames more points in a scan made by make_synthetic_scan, extending the
+    arrays if the scan is extendable. The attenuation changes every 25 points.
+    """
+    rng = np.random.default_rng((seed, n_frames))
+
+    with tables.open_file(filename, "a") as f:
+        scan_data = f.list_nodes("/")[0].scan_data
+        stack = [leaf for leaf in scan_data if len(leaf.shape) == 3][0]
+        start = scan_data.delta.nrows if isinstance(scan_data.delta, tables.EArray) else 0
+        points = np.arange(start, start + n_frames)
+
+        values = {
+            "delta": 10 + points * 0.002,
+            "mu": 5 + points * 0.001,
+            "attenuation": (points // 25 % 4).astype(float),
+            "attenuation_old": np.zeros(n_frames),
+            "epoch": 1.7e9 + points.astype(float),
+            }
+        for first in range(0, n_frames, 100):
+            last = min(first + 100, n_frames)
+            images = rng.poisson(5, (last - first,) + stack.shape[1:])
+            if isinstance(stack, tables.EArray):
+                stack.append(images)
+            else:
+                stack[first:last] = images
+
+        for name, value in values.items():
+            if isinstance(scan_data._f_get_child(name), tables.EArray):
+                scan_data._f_get_child(name).append(value)
+            else:
+                scan_data._f_get_child(name)[:] = value
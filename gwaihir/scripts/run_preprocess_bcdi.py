@@ -113,6 +113,8 @@ flag_interact = False  # True to interact with plots, False to close it automati
 background_plot = (
     "0.5"  # in level of grey in [0,1], 0 being dark. For visual comfort during masking
 )
+auto_mask = False  # True to mask the aliens and detector gaps automatically, e.g. for unattended runs
+auto_mask_params = None  # dictionary of parameters of gwaihir.runner.masking.auto_mask, e.g. {'threshold': 1.0}
 
 #########################################################
 # parameters related to data cropping/padding/centering #
@@ -146,6 +148,7 @@ flag_medianfilter = 'skip'
 # set to 'mask_isolated' it will mask isolated empty pixels
 # set to 'skip' will skip filtering
 medfilt_order = 7   # for custom median filter, number of pixels with intensity surrounding the empty pixel
+filter_workers = None  # number of workers of the filtering, None for the number of cpus, 1 for sequential
 
 #################################################
 # parameters used when reloading processed data #
@@ -159,9 +162,13 @@ preprocessing_binning = (1, 1, 1)  # binning factors in each dimension of the bi
 ##################
 save_rawdata = True  # save also the raw data when use_rawdata is False
 save_to_npz = True  # True to save the processed data in npz format
+save_format = 'npz'  # format of the saved data: 'npz', 'h5' (compressed, multithreaded) or 'npy' (memory mappable)
 save_to_mat = False  # True to save also in .mat format
 save_to_vti = False  # save the orthogonalized diffraction pattern to VTK file
 save_asint = (False)  # if True, the result will be saved as an array of integers (save space)
+out_of_core = False  # True to keep the data and mask in scratch files processed by blocks of frames (large stacks)
+scratch_dir = None  # directory of the scratch files when out_of_core is True, None for the saving directory
+checkpoint_dir = None  # directory of the checkpoints of the stages, reruns restore the unchanged stages. None to disable
 
 ######################################
 # define beamline related parameters #
@@ -227,6 +234,7 @@ nb_pixel_y = None  # fix to declare a known detector but with less pixels (e.g.
 ################################################################################
 use_rawdata = False  # False for using data gridded in laboratory frame/ True for using data in detector frame
 interp_method = 'linearization'  # 'xrayutilities' or 'linearization'
+gridding_cache = None  # directory where the linearization operator is cached for the next runs, None to disable
 fill_value_mask = 0  # 0 (not masked) or 1 (masked). It will define how the pixels outside of the data range are
 # processed during the interpolation. Because of the large number of masked pixels, phase retrieval converges better if
 # the pixels are not masked (0 intensity imposed). The data is by default set to 0 outside of the defined range.
@@ -349,7 +357,15 @@ preprocess.preprocess_bcdi(
     detrot, 
     tiltazimuth, 
     tilt,
-    GUI = False
+    GUI = False,
+    out_of_core = out_of_core,
+    scratch_dir = scratch_dir,
+    filter_workers = filter_workers,
+    gridding_cache = gridding_cache,
+    save_format = save_format,
+    auto_mask = auto_mask,
+    auto_mask_params = auto_mask_params,
+    checkpoint_dir = checkpoint_dir,
     )
 
 
@@ -265,6 +265,7 @@ threshold_gradient = (
     1.0  # upper threshold of the gradient of the phase, use for ramp removal
 )
 save_raw = False  # True to save the amp-phase.vti before orthogonalization
+save_format = 'npz'  # format of the saved arrays: 'npz', 'h5' (compressed, multithreaded) or 'npy' (memory mappable)
 save_support = (
     True  # True to save the non-orthogonal support for later phase retrieval
 )
@@ -409,4 +410,5 @@ strain.strain_bcdi(
     alpha,
     h5_data = None,
     GUI = False,
+    save_format = save_format,
 )
\ No newline at end of file
@@ -24,6 +24,204 @@ class emptyO(object):
     '''Empty class used as container in the nxs2spec case. '''
     pass
 
+class LazyLeaf(object):
+    '''Placeholder for a large leaf (e.g. a 2D detector stack) of the nxs file
+    that is only read when it is used.
+    Slicing reads the requested part only (eg: stack[:, 10:50, 20:60]) from the 
+    hdf5 dataset, iter_blocks() reads the stack by blocks of frames following the 
+    chunks of the dataset, any other use (numpy functions, methods, iteration) 
+    reads the whole leaf once and keeps it in memory.'''
+    def __init__(self, fullpath, nodepath, shape, dtype, name, times = None, chunkshape = None):
+        self._fullpath = fullpath
+        self._nodepath = nodepath
+        self.shape = tuple(int(el) for el in shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+        self.chunkshape = tuple(int(el) for el in chunkshape) if chunkshape else None
+        self._name = name
+        self._times = times if times is not None else {}
+        self._data = None
+
+    def read(self):
+        '''Read the whole leaf, only the first time'''
+        if self._data is None:
+            t0 = time.perf_counter()
+            with tables.open_file(self._fullpath, 'r') as ff:
+                self._data = ff.get_node(self._nodepath)[:]
+            self._times[self._name] = time.perf_counter() - t0
+        return self._data
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return self._data[key]
+        with tables.open_file(self._fullpath, 'r') as ff:
+            return ff.get_node(self._nodepath)[key]
+
+    def iter_blocks(self, nframes = None):
+        '''Yield (first frame, block of frames) over the whole stack, the file 
+        is opened once. By default the blocks are about 64 MB, aligned on the chunks.'''
+        if self._data is not None:
+            for el in frame_blocks(self._data, nframes):
+                yield el
+            return
+        nframes = nframes or _block_frames(self.shape, self.dtype, self.chunkshape)
+        with tables.open_file(self._fullpath, 'r') as ff:
+            node = ff.get_node(self._nodepath)
+            for start in range(0, self.shape[0], nframes):
+                yield start, node[start:start + nframes]
+
+    def __array__(self, dtype = None, copy = None):
+        if dtype is None:
+            return self.read()
+        return self.read().astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self.read())
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_data':
+            raise AttributeError(name)
+        return getattr(self.read(), name)
+
+    def __repr__(self):
+        return 'LazyLeaf(%s, shape=%s, dtype=%s)' % (self._nodepath, self.shape, self.dtype)
+
+
+def _block_frames(shape, dtype, chunkshape = None, blocksize = 64e6):
+    '''Number of frames read at once by frame_blocks, a multiple of the chunk size along the frames.'''
+    nframes = max(1, int(blocksize // (np.prod(shape[1:]) * np.dtype(dtype).itemsize)))
+    if chunkshape:
+        nframes = max(chunkshape[0], nframes - nframes % chunkshape[0])
+    return nframes
+
+
+def frame_blocks(stack, nframes = None):
+    '''Iterate over a stack of images (numpy array or LazyLeaf) by blocks of frames,
+    yields (first frame, block).'''
+    if isinstance(stack, LazyLeaf):
+        for el in stack.iter_blocks(nframes):
+            yield el
+        return
+    nframes = nframes or _block_frames(np.shape(stack), stack.dtype)
+    for start in range(0, len(stack), nframes):
+        yield start, stack[start:start + nframes]
+
+
+# Alias dictionary files, the first one found is used (then the one of phdutils)
+ALIAS_DICT_PATHS = [
+    '/home/andrea/MyPy3/sixs_nxsread/alias_dict.txt',
+    ]
+
+_alias_dict_cache = {}
+_schema_cache = {}
+
+
+def load_alias_dict():
+    '''Return (path, alias dictionary), the file is only unpickled once per process.
+    Returns (None, None) if no alias file is found.'''
+    if 'alias_dict' not in _alias_dict_cache:
+        _alias_dict_cache['alias_dict'] = (None, None)
+        paths = list(ALIAS_DICT_PATHS)
+        try:
+            paths.append(inspect.getfile(phdutils).split("__")[0] + 'sixs/alias_dict_2021.txt')
+        except TypeError:
+            pass
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    _alias_dict_cache['alias_dict'] = (path, pickle.load(f))
+                break
+            except (OSError, pickle.UnpicklingError, EOFError):
+                continue
+        else:
+            print('NO ALIAS FILE')
+    return _alias_dict_cache['alias_dict']
+
+
+def scan_data_schema(scan_data, scantype, alias_dict = None):
+    '''Return the list of (leaf name, attribute name) of the scan_data group, 
+    in the order of the file, following the naming rules of DataSet:
+        FLY: the leaf name
+        SBS with an alias dictionary: the alias of the long_name of the leaf, or 
+            the long_name if it has no alias, leaves with an alias already used are skipped
+        SBS without alias dictionary: the last part of the long_name (sensorsTimestamps 
+            is renamed epoch), the two last parts joined by '_' if already used
+    The result is cached for each layout signature: the leaf names and shapes 
+    and, for SBS scans, the long_name of the leaves (the leaves are named data_01, 
+    data_02, ... whatever the sensor).'''
+    leaves = list(scan_data)
+    if scantype == 'SBS':
+        long_names = [leaf.attrs.long_name for leaf in leaves]
+    else:
+        long_names = [None] * len(leaves)
+    signature = (
+        scantype,
+        id(alias_dict) if alias_dict else None,
+        tuple((leaf.name, tuple(leaf.shape), long_name) for leaf, long_name in zip(leaves, long_names)),
+        )
+    if signature in _schema_cache:
+        return _schema_cache[signature]
+
+    schema = []
+    if scantype == 'FLY':
+        schema = [(leaf.name, leaf.name) for leaf in leaves]
+    
+    elif scantype == 'SBS' and alias_dict:
+        aliases = []
+        for leaf, long_name in zip(leaves, long_names):
+            long_name = long_name.decode('UTF-8')
+            if long_name not in alias_dict:
+                aliases.append(long_name)
+                schema.append((leaf.name, long_name))
+            elif alias_dict[long_name] not in aliases:
+                aliases.append(alias_dict[long_name])
+                schema.append((leaf.name, alias_dict[long_name]))
+    
+    elif scantype == 'SBS':
+        attlist = []
+        for leaf, long_name in zip(leaves, long_names):
+            attr = long_name.decode('UTF-8')
+            attrshort = attr.split('/')[-1]
+            attrlong = attr.split('/')[-2:]
+            if attrshort not in attlist:
+                if attrshort == 'sensorsTimestamps':   ### rename the sensortimestamps as epoch
+                    attlist.append('epoch')
+                else:
+                    attlist.append(attrshort)
+            else: ### Dealing with for double naming
+                attlist.append('_'.join(attrlong))
+            schema.append((leaf.name, attlist[-1]))
+    
+    _schema_cache[signature] = schema
+    return schema
+
+
+def correct_roi(integrals, fattenuations, acqTime, scantype, spec_nans = False):
+    '''Correct ROI integrals (one value per image, or one column per ROI) 
+    by the attenuation factors and the acquisition time.
+    SBS: the points where the filters change are set to NaN (0 if spec_nans, 
+         PyMCA do not like NaNs)
+    FLY: the filters are shifted of two points with respect to the images'''
+    integrals = np.asarray(integrals)
+    fattenuations = np.asarray(fattenuations)
+    _filterchanges = np.flatnonzero((fattenuations[1:]-fattenuations[:-1])!=0)
+    fattenuations = fattenuations.reshape((-1,) + (1,) * (integrals.ndim - 1))
+    if scantype == 'SBS':   # here handling the data shift between data and filters SBS
+        roiC = (integrals[:]*fattenuations)/acqTime
+        if spec_nans:  ## PyMCA do not like NaNs in the last column
+            roiC[_filterchanges+1] = 0
+        if not spec_nans: ## but for data analysis NaNs are better
+            roiC[_filterchanges+1] = np.nan
+        return roiC
+    
+    if scantype == 'FLY':
+        f_shi = np.concatenate((fattenuations[2:],fattenuations[-1:],fattenuations[-1:]))    # here handling the data shift between data and filters FLY
+        return (integrals[:]*(f_shi[:len(integrals)]))/acqTime
+
+
 class DataSet(object):
     '''Dataset read the file and store it in an object, from this object we can 
     retrive the data to use it.
@@ -42,8 +240,13 @@ class DataSet(object):
     The object will also contains some basic methods for data reuction such as 
     ROI extraction, attenuation correction and plotting.
     Meant to be used on the data produced after the 11/03/2019 moment of the 
-    upgrade of the datarecorder''' 
-    def __init__(self, filename, directory = '', verbose='NO',Nxs2Spec = False):
+    upgrade of the datarecorder
+    
+    With lazy = True, the 2D detector stacks are not read when the file is 
+    opened, they are read from the file when they are used (see LazyLeaf), by 
+    default they are read at once. The time spent reading each leaf is kept in 
+    self._leaf_times, use leaf_times() to print it.''' 
+    def __init__(self, filename, directory = '', verbose='NO',Nxs2Spec = False, lazy = False):
         
         self.directory = directory 
         self.filename = filename
@@ -53,21 +256,13 @@ class DataSet(object):
         self._list2D = []
         self._SpecNaNs = Nxs2Spec  # Remove the NaNs if the spec file need to be generated
         attlist = []  # used for self generated file attribute list 
-        aliases = [] # used for SBS imported with alias_dict file
         self. _coefPz = 1 # assigned just in case
         self. _coefPn = 1 # assigned just in case
         self.verbose = verbose
+        self._lazy = lazy
+        self._leaf_times = {}
 
-        try:
-            self._alias_dict = pickle.load(open('/home/andrea/MyPy3/sixs_nxsread/alias_dict.txt','rb'))
-
-        except FileNotFoundError:
-            try:
-                self._alias_dict_path = inspect.getfile(phdutils).split("__")[0] + 'sixs/alias_dict_2021.txt'
-                self._alias_dict = pickle.load(open(self._alias_dict_path, 'rb'))
-            except:
-                print('NO ALIAS FILE')
-                self._alias_dict = None
+        self._alias_dict_path, self._alias_dict = load_alias_dict()
             
         def is_empty(any_structure):
             '''Quick function to determine if an array, tuple or string is 
@@ -78,6 +273,7 @@ class DataSet(object):
                 return True
         ## Load the file 
         fullpath = os.path.join(self.directory,self.filename)
+        self._fullpath = fullpath
         ff = tables.open_file(fullpath,'r') 
         f = ff.list_nodes('/')[0]
         ################  check if any scanned data a are present  
@@ -99,14 +295,16 @@ class DataSet(object):
             self.scantype = 'FLY'
             
         
+        #### leaf -> attribute names, computed once for each file layout
+        schema = scan_data_schema(f.scan_data, self.scantype, self._alias_dict)
+        
         ########################## Reading FLY ################################        
         if self.scantype == 'FLY':
             ### generating the attributes with the recorded scanned data
             
-            for leaf in f.scan_data:
-                list.append(attlist,leaf.name) 
-                self.__dict__[leaf.name] = leaf[:]
-                time.sleep(0.1)
+            for leafname, attr in schema:
+                list.append(attlist,attr) 
+                self.__dict__[attr] = self._read_leaf(f.scan_data._f_get_child(leafname), attr)
             self.attlist = attlist
             try:   #####                     adding just in case eventual missing attenuation 
                 if not hasattr(self, 'attenuation'):
@@ -125,37 +323,10 @@ class DataSet(object):
 
        ###################### Reading SBS ####################################
         if self.scantype == 'SBS':
-            if  self._alias_dict:  #### Reading with dictionary
-                for leaf in f.scan_data:
-                        try :
-                            alias = self._alias_dict[leaf.attrs.long_name.decode('UTF-8')]
-                            if alias not in aliases:
-                                aliases.append(alias)
-                                self.__dict__[alias]=leaf[:]
-                            
-                        except :
-                            self.__dict__[leaf.attrs.long_name.decode('UTF-8')]=leaf[:]
-                            aliases.append(leaf.attrs.long_name.decode('UTF-8'))
-                            pass
-                self.attlist = aliases
-            
-            else:
-                for leaf in f.scan_data: #### Reading with dictionary
-                    ### generating the attributes with the recorded scanned data    
-                    attr = leaf.attrs.long_name.decode('UTF-8')
-                    attrshort = leaf.attrs.long_name.decode('UTF-8').split('/')[-1]
-                    attrlong = leaf.attrs.long_name.decode('UTF-8').split('/')[-2:]
-                    if attrshort not in attlist:
-                        if attr.split('/')[-1] == 'sensorsTimestamps':   ### rename the sensortimestamps as epoch
-                            list.append(attlist, 'epoch')
-                            self.__dict__['epoch'] = leaf[:]
-                        else:
-                            list.append(attlist,attr.split('/')[-1])
-                            self.__dict__[attr.split('/')[-1]] = leaf[:]
-                    else: ### Dealing with for double naming
-                        list.append(attlist, '_'.join(attrlong))
-                        self.__dict__['_'.join(attrlong)] = leaf[:]
-                self.attlist = attlist
+            for leafname, attr in schema:
+                list.append(attlist, attr)
+                self.__dict__[attr] = self._read_leaf(f.scan_data._f_get_child(leafname), attr)
+            self.attlist = attlist
                 
             try: #######                adding just in case eventual missing attenuation 
                 self.attenuation = self.att_sbs_xpad[:]
@@ -358,6 +529,26 @@ class DataSet(object):
         ff.close()
     ########################################################################################
     ##################### down here useful function in the NxsRead #########################
+    def _read_leaf(self, leaf, name):
+        '''Read a leaf of scan_data and keep the reading time.
+        In lazy mode the image stacks are replaced by a LazyLeaf'''
+        if self._lazy and len(leaf.shape) == 3:
+            self._leaf_times[name] = 0
+            return LazyLeaf(self._fullpath, leaf._v_pathname, leaf.shape, leaf.dtype, name, self._leaf_times, leaf.chunkshape)
+        t0 = time.perf_counter()
+        data = leaf[:]
+        self._leaf_times[name] = time.perf_counter() - t0
+        return data
+
+    def leaf_times(self):
+        '''Print and return the time spent reading each leaf of scan_data, 
+        the slowest first. The stacks not read yet in lazy mode are at 0.'''
+        times = sorted(self._leaf_times.items(), key = lambda el: el[1], reverse = True)
+        for name, t in times:
+            print('%-30s %8.4f s' % (name, t))
+        print('%-30s %8.4f s' % ('total', sum(self._leaf_times.values())))
+        return dict(times)
+
     def getStack(self, Det2D_name):
         '''For a given  2D detector name given as string it check in the 
         attribute-list and return a stack of images'''
@@ -394,15 +585,25 @@ class DataSet(object):
         
     def roi_sum(self, stack,roi):
         '''given a stack of images it returns the integals over the ROI  
-        roi is expected as eg: [257, 126,  40,  40] '''
-        return stack[:,roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]].sum(axis=1).sum(axis=1).copy()
+        roi is expected as eg: [257, 126,  40,  40] 
+        the stack is read by blocks of frames'''
+        sums = [block[:,roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]].sum(axis=1).sum(axis=1)
+                for start, block in frame_blocks(stack)]
+        if not sums: # empty stack
+            return np.zeros(0)
+        return np.concatenate(sums)
 
     def roi_sum_mask(self, stack,roi,mask):
         '''given a stack of images it returns the integals over the ROI minus 
         the masked pixels  
-        the ROI is expected as eg: [257, 126,  40,  40] '''
-        _stack = stack[:]*(1-mask.astype('uint16'))
-        return _stack[:,roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]].sum(axis=1).sum(axis=1)
+        the ROI is expected as eg: [257, 126,  40,  40] 
+        the stack is read by blocks of frames'''
+        _mask = (1-mask.astype('uint16'))[roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]]
+        sums = [(block[:,roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]]*_mask).sum(axis=1).sum(axis=1)
+                for start, block in frame_blocks(stack)]
+        if not sums: # empty stack
+            return np.zeros(0)
+        return np.concatenate(sums)
     
     def calcFattenuation(self, attcoef='default', filters='default'):
         '''It aims to calculate: (attcoef**filters[:]))/acqTime considering the presence of att_new and old '''
@@ -437,26 +638,44 @@ class DataSet(object):
             if self.verbose!='NO':
                 print('Mask Not Used')
 
-        if self.scantype == 'SBS':   # here handling the data shift between data and filters SBS
-            _filterchanges = np.where((self._fattenuations[1:]-self._fattenuations[:-1])!=0)
-            roiC = (integrals[:]*self._fattenuations)/acqTime
-            _filterchanges = np.asanyarray(_filterchanges)
-            if self._SpecNaNs:  ## PyMCA do not like NaNs in the last column
-                 np.put(roiC, _filterchanges+1, 0)
-            if not self._SpecNaNs: ## but for data analysis NaNs are better
-                np.put(roiC, _filterchanges+1, np.NaN)
-            
-            setattr(self, ROIname, roiC)
-            self.attlist.append(ROIname)
-            
-            
-        if self.scantype == 'FLY':
-            f_shi = np.concatenate((self._fattenuations[2:],self._fattenuations[-1:],self._fattenuations[-1:]))    # here handling the data shift between data and filters FLY
-            roiC = (integrals[:]*(f_shi[:]))/acqTime
-                    
+        self._correctROI(integrals, acqTime, ROIname)
+        return
+
+    def _correctROI(self, integrals, acqTime, ROIname):
+        '''Correct the integrals of a roi by self._fattenuations and the 
+        acquisition time and attach them as ROIname'''
+        if self.scantype in ('SBS', 'FLY'):
+            roiC = correct_roi(integrals, self._fattenuations, acqTime, self.scantype, self._SpecNaNs)
             setattr(self, ROIname, roiC)
             self.attlist.append(ROIname)
-        return
+
+    def roi_sums(self, stack, rois, mask = None):
+        '''Integrals of several ROIs over a stack of images, in a single pass 
+        over blocks of frames. Returns an array of shape (number of images, number of ROIs),
+        column i being equal to roi_sum(stack, rois[i]), or roi_sum_mask(stack, rois[i], mask).
+        The rois are expected as eg: [[257, 126,  40,  40], [10, 20, 50, 50]]
+        Each block of frames is read and masked once, then all the ROIs are 
+        integrated on it.'''
+        rois = np.asarray(rois, dtype = int).reshape(-1, 4)
+        if mask is not None:
+            _mask = 1-mask.astype('uint16')
+        
+        sums = None
+        for start, block in frame_blocks(stack):
+            if mask is not None:
+                block = block*_mask
+            if sums is None:
+                # same type as the sums of roi_sum
+                sums = np.zeros((len(stack), len(rois)), dtype = block[:1, :1, :1].sum(axis=1).sum(axis=1).dtype)
+            for pos, roi in enumerate(rois):
+                _roi = block[:,roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]]
+                if np.issubdtype(sums.dtype, np.integer):
+                    sums[start:start + len(block), pos] = _roi.sum(axis=(1, 2), dtype = sums.dtype)
+                else:
+                    sums[start:start + len(block), pos] = _roi.sum(axis=1).sum(axis=1)
+        if sums is None: # empty stack
+            sums = np.zeros((0, len(rois)))
+        return sums
 
     def plotRoi(self, motor, roi,color='-og', detname = None,Label=None, mask = 'No'):
         '''It integrates the desired roi and plot it
@@ -508,15 +727,11 @@ class DataSet(object):
                 self._npts = len(self.__getattribute__(list2d[0]))
                 for el in list2d:
                     try:
-                        stack = self.__getattribute__(el)
-                        
                         if self.__getattribute__('_ifmask_'+el):                         
                             maskname = '_mask_' + el
                         if not self.__getattribute__('_ifmask_'+el):                         
                             maskname = 'No_Mask'   #### not existent attribute filtered away from the roi_sum function
-                        for pos, roi in enumerate(self.__getattribute__('_roi_limits_' + el), start=0):
-                            roiname = self.__getattribute__('_roi_names_' + el)[pos] +'_'+el+'_new'
-                            self.calcROI(stack, roi, maskname, self._integration_time, roiname, coef='default', filt='default')
+                        self._calcROIs(el, maskname)
                     except:
                         #raise
                         if self.verbose!='NO':
@@ -538,15 +753,7 @@ class DataSet(object):
                             maskname = '_mask_' + el
                         if not self.__getattribute__('_ifmask_'+el):                         
                             maskname = 'NO_mask_'   #### not existent attribute filtered away from the roi_sum function
-                        for pos, roi in enumerate(self.__getattribute__('_roi_limits_' + el), start=0):
-                            roiname = self.__getattribute__('_roi_names_' + el)[pos] +'_'+el+'_new'
-                            #print(maskname)
-                            stack = self.__getattribute__(el)
-                            # print("stack",el)
-                            # print("roi",roi)
-                            # print("maskname",maskname)
-                            # print("roiname",roiname)
-                            self.calcROI(stack, roi, maskname, self._integration_time, roiname, coef='default', filt='default')
+                        self._calcROIs(el, maskname)
                             
                     except:
                         if self.verbose!='NO':
@@ -554,6 +761,24 @@ class DataSet(object):
                 #                            calcROI(self, stack,roiextent, maskname,attcoef, filters, acqTime, ROIname)
         return
 
+    def _calcROIs(self, detname, maskname):
+        '''Same as calling calcROI for each roi of the detector publisher, 
+        with all the ROIs integrated in a single pass over the stack'''
+        stack = self.__getattribute__(detname)
+        rois = self.__getattribute__('_roi_limits_' + detname)
+        names = self.__getattribute__('_roi_names_' + detname)
+        
+        self.calcFattenuation(attcoef = 'default', filters = 'default')
+        if hasattr(self, maskname):
+            integrals = self.roi_sums(stack, rois, self.__getattribute__(maskname))
+        if not hasattr(self, maskname):
+            integrals = self.roi_sums(stack, rois)
+            if self.verbose!='NO':
+                print('Mask Not Used')
+        
+        for pos in range(len(rois)):
+            self._correctROI(integrals[:, pos], self._integration_time, names[pos] +'_'+detname+'_new')
+
     def roishow(self,roiname, imageN = 1):
         '''Image number is the image position in the stack series and roiname is the name contained in the 
         _roi_name variable'''
@@ -582,13 +807,17 @@ class DataSet(object):
         plt.imshow(stack[imageN][roi[1]:roi[1]+roi[3],roi[0]:roi[0]+roi[2]],norm=LogNorm(vmin=0.01, vmax=4))
         
                
-    def prj(self, axe=0, mask_extra = None):
+    def prj(self, axe=0, mask_extra = None, detectors = None):
           '''Project the 2D detector on the coosen axe of the detector and return a matrix 
           of size:'side detector pixels' x 'number of images' 
           axe = 0 ==> x axe detector image
           axe = 1 ==> y axe detector image
           specify a mask_extra variable if you like. 
-          Mask extra must be a the result of np.load(YourMask.npy)'''
+          Mask extra must be a the result of np.load(YourMask.npy)
+          detectors: list of the 2D detectors to project, default is all of them (det2d)
+          The projections are computed for whole blocks of frames (bounded memory 
+          for the lazy stacks) and attached as '<detector>_prjX', they are 
+          also returned in a dictionary.'''
           if hasattr(self, 'mask'):
               mask = self.__getattribute__('mask')
           if not hasattr(self, 'mask'):
@@ -598,21 +827,23 @@ class DataSet(object):
               if np.shape(mask) == (240,560):
                  self.make_maskFrame_xpad()
                  mask= mask #& self.mask0_xpad
-          for el in self.attlist:
-              bla = self.__getattribute__(el)
-              # get the attributes from list one by one
-              if len(bla.shape) == 3: # check for image stacks Does Not work if you have more than one 2D detectors
-                  mat = []
-                  if np.shape(mask) != np.shape(bla[0]): # verify mask size
-                      print(np.shape(mask), 'different from ', np.shape(bla[0]) ,' verify mask size')
-                      mask=1
-                  for img in bla:
-                      if np.shape(mat)[0] == 0:# fill the first line element
-                          mat = np.sum(img^mask, axis = axe)
-                      if np.shape(mat)[0] > 0:    
-                          mat = np.c_[mat, np.sum(img^mask,axis = axe)]
-                  setattr(self, str(el+'_prjX'),mat) #generate the new attribute
-              
+          if detectors is None:
+              detectors = self.det2d() or []
+          projections = {}
+          for el in detectors:
+              stack = self.__getattribute__(el)
+              _mask = mask
+              if np.shape(_mask) and np.shape(_mask) != tuple(stack.shape[1:]): # verify mask size
+                  print(np.shape(_mask), 'different from ', tuple(stack.shape[1:]) ,' verify mask size')
+                  _mask = 1
+              blocks = [np.sum(block^_mask, axis = axe+1) for start, block in frame_blocks(stack)]
+              if blocks:
+                  mat = np.concatenate(blocks).T
+              else: # empty stack
+                  mat = np.zeros((stack.shape[2-axe], 0))
+              setattr(self, str(el+'_prjX'),mat) #generate the new attribute
+              projections[el] = mat
+          return projections
 
     def det2d(self):
         '''it retunrs the name/s of the 2D detector'''
@@ -621,7 +852,7 @@ class DataSet(object):
               bla = self.__getattribute__(el)
               #print(el, bla.shape)
               # get the attributes from list one by one
-              if isinstance(bla, (np.ndarray, np.generic) ):
+              if isinstance(bla, (np.ndarray, np.generic, LazyLeaf) ):
                   if len(bla.shape) == 3: # check for image stacks
                       list2D.append(el)
         if len(list2D)>0:
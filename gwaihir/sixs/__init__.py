@@ -6,7 +6,7 @@
 """
 Welcome to phdutils.sixs"""
 
-__all__ = ["ReadNxs4", "utilities3"]
+__all__ = ["ReadNxs4", "utilities3", "scan_table", "live_roi", "utilities_vec", "peak_fit"]
 
 # from ReadNxs4 import *
 # from utilities3 import *
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Follow the ROIs of a SIXS scan while it is being recorded.
+
+    live = LiveROI('/path/to/data/Pt_ascan_01601.nxs')
+    live.follow(interval = 2, callback = lambda live: print(live.npts))
+
+At each update only the images appended to the file since the previous update
+are read and integrated over the ROIs of the detector publisher (or the given
+ROIs). The ROI curves are then corrected by the attenuation and the acquisition
+time like DataSet.calcROI_new2, with the same FLY/SBS filter shift handling:
+on FLY scans the correction of the last two points uses the filters known so
+far and is updated when the next points arrive.
+"""
+import time
+
+import numpy as np
+import tables
+
+from gwaihir.sixs import ReadNxs4 as rd
+
+
+class LiveROI(object):
+    '''Attenuation corrected ROI curves of a scan that is still growing.
+        filename, directory: the scan, as for ReadNxs4.DataSet
+        detector: 2D detector name, default is the first one with ROIs in its publisher
+        rois: list of ROIs ([x, y, width, height]), default are the ROIs of the
+            detector publisher, named like calcROI_new2 ('<roi>_<detector>_new')
+        roinames: names of the given ROIs, default are 'roi0', 'roi1', ...
+        mask: False to not use the mask of the detector publisher
+
+    After each update(), self.curves[roiname] is the corrected ROI curve,
+    self.integrals the raw integrals (points x ROIs) and self.npts the number
+    of points read.'''
+    def __init__(self, filename, directory = '', detector = None, rois = None, roinames = None,
+                 mask = True, Nxs2Spec = False, verbose = 'NO'):
+        self.verbose = verbose
+        self.data = rd.DataSet(filename, directory, verbose = verbose, Nxs2Spec = Nxs2Spec, lazy = True)
+        if self.data.scantype not in ('SBS', 'FLY'):
+            raise ValueError('No scan data in ' + self.data._fullpath)
+
+        if detector is None:
+            detectors = self.data.det2d() or []
+            with_rois = [el for el in detectors if hasattr(self.data, '_roi_limits_' + el)]
+            detector = (with_rois or detectors)[0]
+        self.detector = detector
+        self._nodepath = self.data.getStack(detector)._nodepath
+
+        if rois is None:
+            rois = self.data.__getattribute__('_roi_limits_' + detector)
+            roinames = [el + '_' + detector + '_new' for el in self.data.__getattribute__('_roi_names_' + detector)[:len(rois)]]
+        if roinames is None:
+            roinames = ['roi%d' % pos for pos in range(len(rois))]
+        self.rois = np.asarray(rois, dtype = int).reshape(-1, 4)
+        self.roinames = list(roinames)
+
+        self.mask = None
+        if mask and np.any(getattr(self.data, '_ifmask_' + detector, False)):
+            self.mask = getattr(self.data, '_mask_' + detector, None)
+
+        # leaves holding the filters, following the attribute names of DataSet
+        with tables.open_file(self.data._fullpath, 'r') as ff:
+            scan_data = ff.list_nodes('/')[0].scan_data
+            schema = dict((attr, leafname) for leafname, attr
+                          in rd.scan_data_schema(scan_data, self.data.scantype, self.data._alias_dict))
+        if self.data.scantype == 'SBS':
+            self._filters = {'attenuation': schema.get('att_sbs_xpad'), 'attenuation_old': None}
+        else:
+            self._filters = {'attenuation': schema.get('attenuation'), 'attenuation_old': schema.get('attenuation_old')}
+
+        self.npts = 0
+        self.integrals = np.zeros((0, len(self.rois)))
+        self.attenuation = np.zeros(0)
+        self.attenuation_old = np.zeros(0)
+        self.curves = dict((name, np.zeros(0)) for name in self.roinames)
+
+    def update(self):
+        '''Read the points appended since the last update and update the curves.
+        Returns the number of new points, 0 if the file cannot be opened
+        (e.g. locked by the writer).'''
+        try:
+            ff = tables.open_file(self.data._fullpath, 'r')
+        except (tables.HDF5ExtError, OSError) as e:
+            if self.verbose != 'NO':
+                print('Could not open the file:', e)
+            return 0
+
+        with ff:
+            scan_data = ff.list_nodes('/')[0].scan_data
+            stack = ff.get_node(self._nodepath)
+            filters = dict((attr, scan_data._f_get_child(leafname))
+                           for attr, leafname in self._filters.items() if leafname)
+
+            # points with an image and the filters
+            npts = min([stack.shape[0]] + [len(el) for el in filters.values()])
+            if npts <= self.npts:
+                return 0
+
+            integrals = []
+            nframes = rd._block_frames(stack.shape, stack.dtype, stack.chunkshape)
+            for start in range(self.npts, npts, nframes):
+                block = stack[start:min(npts, start + nframes)]
+                integrals.append(self.data.roi_sums(block, self.rois, self.mask))
+            new_filters = dict((attr, filters[attr][self.npts:npts] if attr in filters else np.zeros(npts - self.npts))
+                               for attr in ('attenuation', 'attenuation_old'))
+
+        self.integrals = np.concatenate([self.integrals] + integrals).astype(np.float64)
+        self.attenuation = np.concatenate([self.attenuation, new_filters['attenuation']])
+        self.attenuation_old = np.concatenate([self.attenuation_old, new_filters['attenuation_old']])
+        new = npts - self.npts
+        self.npts = npts
+        self._correct()
+        return new
+
+    def _correct(self):
+        '''Attenuation and acquisition time correction, same as calcROI'''
+        self.data.attenuation = self.attenuation
+        self.data.attenuation_old = self.attenuation_old
+        self.data.calcFattenuation()
+        corrected = rd.correct_roi(self.integrals, self.data._fattenuations, self.data._integration_time,
+                                   self.data.scantype, self.data._SpecNaNs)
+        for pos, name in enumerate(self.roinames):
+            self.curves[name] = corrected[:, pos]
+
+    def follow(self, interval = 1, timeout = 30, callback = None):
+        '''Update every interval seconds, until no new point is written during
+        timeout seconds. callback(self) is called after each update with new points.'''
+        last = time.time()
+        while time.time() - last < timeout:
+            if self.update():
+                last = time.time()
+                if callback is not None:
+                    callback(self)
+            else:
+                time.sleep(interval)
+        return self.curves
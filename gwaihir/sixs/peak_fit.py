@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Fit a gaussian peak on many curves at once, e.g. all the rocking curves or
+ROI scans of a beamtime.
+
+    table = fit_curves(x, curves)                   # one curve per row
+    table = fit_curves(x, curves, method = 'pool')  # one scipy fit per curve
+
+The model is the one of utilities3.fitgauss1d with 5 parameters:
+
+    area/(sigma*sqrt(2*pi))*exp(-(x-center)**2/(2*sigma**2)) + bkg + slope*x
+
+area, center and sigma are the amplitude, center and sigma of
+lmfit.models.GaussianModel. The initial guesses are computed for all the curves
+at once from the moments of the curves above a linear background. The default
+fit is a Levenberg-Marquardt done on all the curves together with numpy, the
+'pool' method fits the curves one by one with scipy.optimize.curve_fit in a
+process pool. Both return a pandas table, one row per curve, with the
+parameters, their standard errors (scaled by the reduced chi square, like
+curve_fit and lmfit), the fwhm and height of the peak and the fit statistics.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import optimize
+
+PARAMETERS = ['area', 'center', 'sigma', 'bkg', 'slope']
+
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+# Free parameters for each background, like the 3, 4 or 5 parameters of fitgauss1d
+BACKGROUNDS = {
+    'none': [0, 1, 2],
+    'constant': [0, 1, 2, 3],
+    'linear': [0, 1, 2, 3, 4],
+    }
+
+
+def gauss_model(x, p):
+    '''Gaussian on a linear background, p is (..., 5) with the PARAMETERS,
+    x is a 1D array or has one row per set of parameters'''
+    p = np.asarray(p, dtype = float)
+    area, center, sigma, bkg, slope = [p[..., pos, None] for pos in range(5)]
+    peak = area/(sigma*np.sqrt(2*np.pi))*np.exp(-(x-center)**2/(2*sigma**2))
+    return peak + bkg + slope*x
+
+
+def _jacobian(x, p):
+    '''Derivatives of gauss_model with respect to the PARAMETERS, (n, npts, 5)'''
+    area, center, sigma = [p[..., pos, None] for pos in range(3)]
+    x = np.broadcast_to(x, (p.shape[0], np.shape(x)[-1]))
+    shape = np.exp(-(x-center)**2/(2*sigma**2))/(sigma*np.sqrt(2*np.pi))
+    peak = area*shape
+    return np.stack([
+        shape,
+        peak*(x-center)/sigma**2,
+        peak*((x-center)**2/sigma**3 - 1/sigma),
+        np.ones_like(x),
+        x,
+        ], axis = -1)
+
+
+def moment_guess(x, y, background = 'linear', nedge = 3):
+    '''Initial parameters of all the curves (one per row of y), (n, 5).
+    The background is the line through the mean of the nedge first and last
+    points, the peak parameters are the moments of the curve above it.
+    nan values of y are ignored.'''
+    y = np.atleast_2d(np.asarray(y, dtype = float))
+    x = np.broadcast_to(np.asarray(x, dtype = float), y.shape)
+    valid = np.isfinite(y)
+    yv = np.where(valid, y, 0)
+
+    p = np.zeros((len(y), 5))
+    if background != 'none':
+        # mean of the first and last valid points of each curve
+        order = np.argsort(~valid, axis = 1, kind = 'stable')
+        last = valid.sum(axis = 1)
+        first_pos = order[:, :nedge]
+        last_pos = np.take_along_axis(order, np.clip(last[:, None] - nedge + np.arange(nedge), 0, None), axis = 1)
+        x1 = np.take_along_axis(x, first_pos, axis = 1).mean(axis = 1)
+        y1 = np.take_along_axis(yv, first_pos, axis = 1).mean(axis = 1)
+        x2 = np.take_along_axis(x, last_pos, axis = 1).mean(axis = 1)
+        y2 = np.take_along_axis(yv, last_pos, axis = 1).mean(axis = 1)
+        if background == 'linear':
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                p[:, 4] = np.where(x2 != x1, (y2-y1)/(x2-x1), 0)
+            p[:, 3] = y1 - p[:, 4]*x1
+        else:
+            p[:, 3] = (y1+y2)/2
+
+    peak = np.clip(yv - p[:, 3, None] - p[:, 4, None]*x, 0, None)*valid
+    weight = peak.sum(axis = 1)
+    weight[weight == 0] = 1
+    p[:, 1] = (peak*x).sum(axis = 1)/weight
+    sigma = np.sqrt((peak*(x-p[:, 1, None])**2).sum(axis = 1)/weight)
+
+    # the moments of the sampled curve, sigma at least one step
+    step = np.abs(np.diff(x, axis = 1)).mean(axis = 1) if x.shape[1] > 1 else np.ones(len(x))
+    p[:, 2] = np.maximum(sigma, step)
+    p[:, 0] = np.abs(trapezoid(peak, x, axis = 1))
+    return p
+
+
+def _results(p, perr, chi2, npts, nfev, success, nfree):
+    '''Parameter table of fit_curves'''
+    # same peak for negative sigma and area
+    flip = p[:, 2] < 0
+    p[flip, 0] *= -1
+    p[flip, 2] *= -1
+
+    table = pd.DataFrame(p, columns = PARAMETERS)
+    for pos, name in enumerate(PARAMETERS):
+        table[name + '_err'] = perr[:, pos]
+    table['fwhm'] = 2*np.sqrt(2*np.log(2))*table['sigma']
+    table['height'] = table['area']/(table['sigma']*np.sqrt(2*np.pi))
+    table['chi2'] = chi2
+    table['redchi'] = chi2/np.maximum(npts - nfree, 1)
+    table['npts'] = npts
+    table['nfev'] = nfev
+    table['success'] = success
+    return table
+
+
+def _errors(jacobian, chi2, dof):
+    '''Standard errors from the jacobian at the minimum, (n, nfree), nan if singular'''
+    jtj = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+    perr = np.full(jtj.shape[:2], np.nan)
+    ok = np.linalg.matrix_rank(jtj) == jtj.shape[-1]
+    if np.any(ok):
+        cov = np.linalg.inv(jtj[ok])*(chi2[ok]/np.maximum(dof[ok], 1))[:, None, None]
+        perr[ok] = np.sqrt(np.abs(np.diagonal(cov, axis1 = 1, axis2 = 2)))
+    return perr
+
+
+def _residuals(x, p, y, valid):
+    '''Residuals of gauss_model for the curves y (rows), 0 on the invalid points'''
+    return (gauss_model(x, p) - y)*valid
+
+
+def _fit_lm(x, y, p0, free, max_iter = 200, tol = 1e-10):
+    '''Levenberg-Marquardt on all the curves together, each with its own damping.
+    The nan points of y do not contribute.'''
+    valid = np.isfinite(y)
+    yv = np.where(valid, y, 0)
+    p = p0.copy()
+    n = len(p)
+
+    res = _residuals(x, p, yv, valid)
+    cost = np.sum(res**2, axis = 1)
+    damping = np.full(n, 1e-3)
+    nfev = np.ones(n, dtype = int)
+    active = np.isfinite(cost)
+
+    for iteration in range(max_iter):
+        if not np.any(active):
+            break
+        idx = np.nonzero(active)[0]
+        xi = x if np.ndim(x) == 1 else x[idx]
+        jac = _jacobian(xi, p[idx])[..., free]*valid[idx, :, None]
+        jtj = np.einsum('nmi,nmj->nij', jac, jac)
+        jtr = np.einsum('nmi,nm->ni', jac, res[idx])
+        diag = np.diagonal(jtj, axis1 = 1, axis2 = 2)
+        scaled = jtj + damping[idx, None, None]*np.einsum('ni,ij->nij', np.maximum(diag, 1e-12), np.eye(len(free)))
+        try:
+            step = -np.linalg.solve(scaled, jtr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = -np.stack([np.linalg.lstsq(a, b, rcond = None)[0] for a, b in zip(scaled, jtr)])
+
+        trial = p[idx].copy()
+        trial[:, free] += step
+        with np.errstate(all = 'ignore'):
+            trial_res = _residuals(xi, trial, yv[idx], valid[idx])
+            trial_cost = np.sum(trial_res**2, axis = 1)
+        nfev[idx] += 1
+
+        better = np.isfinite(trial_cost) & (trial_cost <= cost[idx])
+        improvement = (cost[idx] - trial_cost)/np.maximum(cost[idx], np.finfo(float).tiny)
+
+        accepted = idx[better]
+        p[accepted] = trial[better]
+        res[accepted] = trial_res[better]
+        cost[accepted] = trial_cost[better]
+        damping[accepted] = np.maximum(damping[accepted]/10, 1e-12)
+        damping[idx[~better]] *= 10
+
+        small_step = np.all(np.abs(step) <= tol*(np.abs(p[idx][:, free]) + tol), axis = 1)
+        done = (better & (improvement < tol)) | small_step | (damping[idx] > 1e12)
+        active[idx[done]] = False
+
+    success = ~active & np.all(np.isfinite(p), axis = 1)
+    npts = valid.sum(axis = 1)
+    jac = _jacobian(x, p)[..., free]*valid[:, :, None]
+    perr = np.full(p.shape, np.nan)
+    perr[:, free] = _errors(jac, cost, npts - len(free))
+    return p, perr, cost, npts, nfev, success
+
+
+def _fit_one(args):
+    '''Worker of the 'pool' method, scipy.optimize.curve_fit of a single curve'''
+    x, y, p0, free = args
+    valid = np.isfinite(y)
+    x, y = x[valid], y[valid]
+    p = np.array(p0, dtype = float)
+    perr = np.full(5, np.nan)
+
+    def model(x, *values):
+        q = p.copy()
+        q[free] = values
+        return gauss_model(x, q)
+
+    try:
+        popt, pcov, info, message, ier = optimize.curve_fit(
+            model, x, y, p0 = p[free], full_output = True)
+        p[free] = popt
+        perr[free] = np.sqrt(np.abs(np.diag(pcov)))
+        success, nfev = ier in (1, 2, 3, 4), info['nfev']
+    except (RuntimeError, ValueError, TypeError):
+        success, nfev = False, 0
+    chi2 = np.sum((gauss_model(x, p) - y)**2)
+    return p, perr, chi2, len(y), nfev, success
+
+
+def fit_curves(x, y, p0 = None, background = 'linear', method = 'lm',
+               n_workers = None, max_iter = 200):
+    '''Fit a gaussian on each row of y, return a table with one row per curve.
+        x: common abscissa (npts,) or one per curve (n, npts)
+        y: curves (n, npts), nan points are ignored
+        p0: initial parameters (5,) for all the curves or (n, 5), default
+            are moment_guess
+        background: 'linear', 'constant' or 'none', like the 5, 4 or 3
+            parameters of utilities3.fitgauss1d
+        method: 'lm' to fit all the curves together with numpy,
+            'pool' for one scipy.optimize.curve_fit per curve in n_workers processes
+    The table has the PARAMETERS, their standard errors (*_err, nan for the fixed
+    ones or when the fit is singular), fwhm, height, chi2, redchi, npts,
+    nfev and success.'''
+    if background not in BACKGROUNDS:
+        raise ValueError('background must be one of ' + ', '.join(BACKGROUNDS))
+    free = BACKGROUNDS[background]
+    y = np.atleast_2d(np.asarray(y, dtype = float))
+    x = np.asarray(x, dtype = float)
+    if x.shape[-1] != y.shape[-1] or (x.ndim == 2 and x.shape != y.shape):
+        raise ValueError('x and y have different shapes')
+
+    if p0 is None:
+        p0 = moment_guess(x, y, background)
+    p0 = np.array(np.broadcast_to(np.asarray(p0, dtype = float), (len(y), 5)))
+    fixed = [pos for pos in range(5) if pos not in free]
+    p0[:, fixed] = 0
+
+    if method == 'lm':
+        result = _fit_lm(x, y, p0, free, max_iter)
+    elif method == 'pool':
+        xs = np.broadcast_to(x, y.shape)
+        with ProcessPoolExecutor(max_workers = n_workers) as executor:
+            fits = list(executor.map(_fit_one, [(xs[pos], y[pos], p0[pos], free) for pos in range(len(y))],
+                                     chunksize = max(1, len(y)//64)))
+        result = [np.array([fit[pos] for fit in fits]) for pos in range(6)]
+    else:
+        raise ValueError("method must be 'lm' or 'pool'")
+    return _results(*result, nfree = len(free))
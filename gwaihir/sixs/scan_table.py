@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Batch loading of SIXS NeXus scans in a pandas table.
+
+    table = load_scans(range(1600, 1700), '/path/to/data/')
+
+The scans are opened in parallel with ReadNxs4.DataSet, without reading the
+detector stacks, and each scan gives one row per scan point with the motors,
+counters and ROI integrals recorded in scan_data, plus the energy, wavelength,
+integration time and time stamps of the scan.
+The table of each scan is cached on disk (by default in a per-user folder,
+see CACHE_DIR), keyed by the path and the modification time of the file, so
+that loading the same scans again only reads the cache.
+"""
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from gwaihir.sixs import ReadNxs4 as rd
+from gwaihir.sixs.utilities3 import isFloat, getint
+
+# Scalar attributes of DataSet added to every row of the scan
+SCAN_ATTRIBUTES = ['energymono', 'waveL', '_integration_time', 'start_time', 'end_time', 'scantype']
+
+# Increase when the content of the table changes, to invalidate the cache
+SCAN_TABLE_VERSION = 1
+
+# Default folder of the cache, per user (the data folders are often read-only)
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'gwaihir', 'scan_table')
+
+
+def scan_files(scans, directory = '', extension = '*.nxs'):
+    '''Return the paths of the scans, given as file names or as scan numbers
+    (the number at the end of the file name, like utilities3.number2file).
+    The directory is only listed once.'''
+    numbers = {}
+    files = []
+    for scan in scans:
+        if isinstance(scan, str):
+            files.append(scan if os.path.isabs(scan) else os.path.join(directory, scan))
+            continue
+        if not numbers:
+            for el in map(os.path.basename, glob.glob(os.path.join(directory, extension))):
+                elnumber = el[:-4].split('_')[-1]
+                if isFloat(elnumber):
+                    numbers[float(elnumber)] = el
+        if float(scan) in numbers:
+            files.append(os.path.join(directory, numbers[float(scan)]))
+        else:
+            print('No file for scan', scan)
+    return files
+
+
+def read_scan(path, calc_rois = False):
+    '''Read one scan in a DataFrame, one row per scan point.
+    Only the 1D arrays of scan_data with one value per point are kept, the
+    detector stacks are not read unless calc_rois is True, in which case the
+    ROIs of the detector publishers are integrated (calcROI_new2) and added
+    as the *_new columns.'''
+    data = rd.DataSet(path, lazy = True)
+    if calc_rois and data._list2D:
+        data.calcROI_new2()
+
+    npts = len(data.delta) if hasattr(data, 'delta') else None
+    columns = {}
+    for el in data.attlist:
+        value = getattr(data, el, None)
+        if isinstance(value, np.ndarray) and value.ndim == 1:
+            if npts is None:
+                npts = len(value)
+            if len(value) == npts and el not in columns:
+                columns[el] = value
+
+    table = pd.DataFrame(columns)
+    for el in SCAN_ATTRIBUTES:
+        if hasattr(data, el) and el.strip('_') not in table:
+            table[el.strip('_')] = getattr(data, el)
+    table.insert(0, 'point', np.arange(len(table)))
+    table.insert(0, 'filename', os.path.basename(path))
+    try:
+        table.insert(0, 'scan', getint(os.path.basename(path)))
+    except ValueError:
+        table.insert(0, 'scan', -1)
+    return table
+
+
+def _cache_path(cache_dir, path, calc_rois):
+    '''Cache file of a scan, the key changes with the file modification time'''
+    path = os.path.abspath(path)
+    key = f'{path}:{os.path.getmtime(path)}:{calc_rois}:{SCAN_TABLE_VERSION}'
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+
+
+def _read_scan(args):
+    '''Worker of load_scans, errors are returned instead of raised'''
+    path, calc_rois = args
+    try:
+        return read_scan(path, calc_rois)
+    except Exception as e:
+        return e
+
+
+def load_scans(
+    scans,
+    directory = '',
+    extension = '*.nxs',
+    calc_rois = False,
+    n_workers = None,
+    cache_dir = None,
+    ):
+    '''Load a list or range of scans in a single table, one row per scan point.
+        scans: scan numbers or file names, e.g. range(1600, 1700)
+        directory: folder of the scans
+        calc_rois: integrate the ROIs from the detector stacks, slower
+        n_workers: number of processes, default is the number of cpus
+        cache_dir: folder of the cache, default is CACHE_DIR (~/.cache/gwaihir/scan_table),
+            False to disable the cache. The cache is disabled if the folder cannot be created.
+    The scans that cannot be read are skipped with a message.'''
+    files = scan_files(scans, directory, extension)
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+        except OSError as e:
+            print('Cache disabled, could not create', cache_dir, ':', e)
+            cache_dir = False
+
+    tables = {}
+    to_read = []
+    for path in files:
+        cache = _cache_path(cache_dir, path, calc_rois) if cache_dir else None
+        if cache and os.path.isfile(cache):
+            tables[path] = pd.read_pickle(cache)
+        else:
+            to_read.append(path)
+
+    if to_read:
+        with ProcessPoolExecutor(max_workers = n_workers) as executor:
+            results = executor.map(_read_scan, [(path, calc_rois) for path in to_read])
+            for path, result in zip(to_read, results):
+                if isinstance(result, Exception):
+                    print('Could not read', path, ':', result)
+                    continue
+                tables[path] = result
+                if cache_dir:
+                    try:
+                        result.to_pickle(_cache_path(cache_dir, path, calc_rois))
+                    except OSError as e:
+                        print('Could not cache', path, ':', e)
+
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat([tables[path] for path in files if path in tables], ignore_index = True)
@@ -123,7 +123,7 @@ def filterOutlier(x,y, ts = 3):
     xst = x
     yst = y
     wz.sort()
-    wz[::-1] #starting from the last one otherwhise it changes!!!
+    wz = wz[::-1] #starting from the last one otherwhise it changes!!!
     for el in wz:
         x = np.delete(x, el)
         y = np.delete(y, el)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized versions of some helpers of utilities3, same names and same results,
+meant to be used on many curves (e.g. all the rocking curves of a beamtime).
+
+    smoothGauss: correlation with the gaussian window instead of a loop on the samples,
+        also works on 2D arrays (one curve per row)
+    numint: single sum, also works on 2D arrays (one curve per row)
+    filterOutlier: one boolean mask instead of one np.delete per outlier
+    bintoM: the bins are computed once for all the columns, one bincount
+        for the sums of all the columns
+
+gwaihir/scripts/benchmarks/bench_utilities_vec.py checks that they give the same
+results as utilities3 and compares the times.
+"""
+import numpy as np
+
+from gwaihir.sixs.utilities3 import detect_outlier
+
+
+def gauss_weights(degree = 4):
+    '''Gaussian window of smoothGauss, 2*degree-1 points'''
+    window = degree*2-1
+    frac = (np.arange(window) - degree + 1) / float(window)
+    return 1/(np.exp((4*(frac))**2))
+
+
+def smoothGauss(vect, degree = 4):
+    '''It smooths the vector vect by convoluting it with a gaussian 4 pts large.
+    The output vector is 2*degree-1 shorter, ie:9 pts shorter for the default case.
+    vect can be a 2D array, each row being smoothed.'''
+    vect = np.asarray(vect, dtype = float)
+    weight = gauss_weights(degree)
+    window = len(weight)
+    npts = vect.shape[-1] - window
+    if npts <= 0:
+        return np.zeros(vect.shape[:-1] + (0,))
+    windows = np.lib.stride_tricks.sliding_window_view(vect, window, axis = -1)[..., :npts, :]
+    return windows @ weight / np.sum(weight)
+
+
+def numint(x, y):
+    '''suppose a regular distribution of points
+    y can be a 2D array, one integral per row'''
+    x = np.asarray(x)
+    dx = (np.max(x)-np.min(x))/np.shape(x)
+    return np.sum(np.asarray(y)*dx, axis = -1, keepdims = np.ndim(y) == 1)
+
+
+def filterOutlier(x, y, ts = 3):
+    '''Meant to remove spikes from x,y arrays '''
+    keep = np.ones(len(y), dtype = bool)
+    keep[detect_outlier(y, threshold = ts)] = False
+    return np.asarray(x)[keep], np.asarray(y)[keep]
+
+
+def bintoM(x, y, Nintervals):
+    '''For a given x, y return a new pair of vectors with Nintervals isospaced intervals
+    it returns the data into the new vectors.
+    y is intended to be a set of vectors to function of x, to be binned to the same number of intervals
+    It retuns the new x and the new y'''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    col = np.shape(y)[1]
+
+    # same bins as np.histogram, the last edge is included, nan and values outside are not counted
+    edges = np.histogram_bin_edges(x, bins = Nintervals, range = (np.nanmin(x), np.nanmax(x)))
+    keep = (x >= edges[0]) & (x <= edges[-1])
+    index = np.searchsorted(edges, x[keep], side = 'right') - 1
+    index[index == Nintervals] = Nintervals - 1
+
+    n = np.bincount(index, minlength = Nintervals)
+    fy = np.bincount(
+        (index[:, None] * col + np.arange(col)).ravel(),
+        weights = y[keep].ravel(),
+        minlength = Nintervals * col,
+        ).reshape(Nintervals, col)
+    ny = fy / n[:, None]
+    nx = np.linspace(np.nanmin(x), np.nanmax(x), Nintervals)
+    return nx, ny